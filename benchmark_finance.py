@@ -0,0 +1,322 @@
+# Headless benchmarks for the finance app's data paths
+#
+#   python benchmark_finance.py                      # 10k, 1M and 10M rows
+#   python benchmark_finance.py --sizes 10000 --output before.json
+#   python benchmark_finance.py --sizes 10000 --compare before.json
+#
+# Ledgers are generated deterministically from --seed and cached in
+# --data-dir, so repeated runs and different versions measure the same data.
+# Tk rendering is not measured; each operation runs the SQL and aggregation
+# the app issues for the corresponding action.
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import finance_analytics
+import finance_db
+
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+DEFAULT_SEED = 42
+# Rows per Treeview page; matches PAGE_SIZE in finance_window
+PAGE_SIZE = 100
+GENERATE_BATCH_SIZE = 100_000
+LEDGER_END = date(2024, 12, 31)
+LEDGER_DAYS = 10 * 365
+DESCRIPTIONS = ['Salary', 'Rent', 'Groceries', 'Utilities', 'Fuel', 'Dining out',
+                'Insurance', 'Subscriptions', 'Transfer', 'Refund', 'Pharmacy', 'Travel']
+# Rows in the statement the import operation reads
+IMPORT_ROWS = 100_000
+# Filters of the search operations, as set by the app's filter bar
+SEARCH_FILTERS = {
+    'search_text': {'text': 'salary'},
+    'search_type': {'ttype': 'Expense'},
+    'search_text_type': {'text': 'salary', 'ttype': 'Expense'},
+}
+# Timed repetitions per operation; aggregation, searches and imports are
+# slower, so fewer
+REPEATS = {'load': 20, 'refresh': 200, 'insert': 200, 'delete': 200, 'aggregation': 10,
+           'search_text': 20, 'search_type': 20, 'search_text_type': 20, 'bulk_import': 3}
+
+
+def generate_rows(count, seed):
+    # Batches of INSERT_TRANSACTION parameters, identical for the same seed
+    rng = random.Random(seed)
+    start = LEDGER_END - timedelta(days=LEDGER_DAYS - 1)
+    dates = [(day.strftime(finance_db.DISPLAY_DATE_FORMAT), day.isoformat())
+             for day in (start + timedelta(days=offset) for offset in range(LEDGER_DAYS))]
+    produced = 0
+    while produced < count:
+        size = min(GENERATE_BATCH_SIZE, count - produced)
+        batch = []
+        for _ in range(size):
+            display, iso = dates[rng.randrange(LEDGER_DAYS)]
+            if rng.random() < 0.3:
+                ttype, amount = 'Income', round(rng.uniform(50, 5000), 2)
+            else:
+                ttype, amount = 'Expense', round(rng.lognormvariate(3.5, 1.0), 2)
+            batch.append((ttype, amount, display, iso, rng.choice(DESCRIPTIONS)))
+        produced += size
+        yield batch
+
+
+def ledger_path(data_dir, count, seed):
+    return os.path.join(data_dir, f"ledger-{count}-{seed}.db")
+
+
+def generate_ledger(data_dir, count, seed):
+    # Reuse a cached ledger when it is complete; otherwise build it afresh
+    path = ledger_path(data_dir, count, seed)
+    if os.path.exists(path):
+        conn = finance_db.connect(path)
+        existing = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        conn.close()
+        if existing == count:
+            return path
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    os.makedirs(data_dir, exist_ok=True)
+    started = time.perf_counter()
+    conn = finance_db.connect(path)
+    finance_db.bulk_insert(conn, generate_rows(count, seed))
+    conn.close()
+    print(f"Generated {count} rows in {time.perf_counter() - started:.1f}s: {path}",
+          file=sys.stderr)
+    return path
+
+
+def generate_statement(data_dir, count, seed):
+    # A CSV statement of count rows for the import operation, cached like
+    # the ledgers; its rows differ from the ledger's
+    path = os.path.join(data_dir, f"statement-{count}-{seed}.csv")
+    if os.path.exists(path):
+        return path
+    os.makedirs(data_dir, exist_ok=True)
+    with open(path + '.tmp', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['type', 'amount', 'date', 'description'])
+        for batch in generate_rows(count, seed + 1):
+            writer.writerows((ttype, amount, display, description)
+                             for ttype, amount, display, _, description in batch)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+class Operations:
+    # One callable per benchmarked operation against a generated ledger
+    def __init__(self, path, seed, statement_path):
+        self.path = path
+        self.statement_path = statement_path
+        self.rng = random.Random(seed)
+        self.conn = sqlite3.connect(path)
+        self.cursor = self.conn.cursor()
+        self.max_id = self.conn.execute("SELECT MAX(id) FROM transactions").fetchone()[0]
+        self.inserted = []
+
+    def load(self):
+        # Opening the ledger the way the app starts: schema check, first
+        # page of the table and the dashboard totals
+        conn = finance_db.connect(self.path)
+        cursor = conn.cursor()
+        rows = finance_db.fetch_page(cursor, PAGE_SIZE)
+        finance_db.read_totals(cursor)
+        conn.close()
+        return len(rows)
+
+    def refresh(self):
+        # update_treeview at a random scroll position
+        start_id = self.rng.randint(1, self.max_id)
+        rows = finance_db.fetch_page(self.cursor, PAGE_SIZE, after_id=start_id, inclusive=True)
+        finance_db.has_rows_before(self.cursor, start_id)
+        return len(rows)
+
+    def insert(self):
+        # add_transaction: one INSERT and a commit
+        day = LEDGER_END - timedelta(days=self.rng.randrange(LEDGER_DAYS))
+        _, new_row = finance_db.save_transaction(
+            self.cursor, None, 'Expense', round(self.rng.uniform(1, 500), 2),
+            day.strftime(finance_db.DISPLAY_DATE_FORMAT), 'Benchmark')
+        self.inserted.append(new_row[0])
+        self.conn.commit()
+        return 1
+
+    def delete(self):
+        # delete_transaction: lookup, DELETE and a commit; removes the rows
+        # added by insert so the ledger is unchanged
+        finance_db.remove_transaction(self.cursor, self.inserted.pop())
+        self.conn.commit()
+        return 1
+
+    def aggregation(self):
+        # The dashboard worker's recomputation
+        totals, series = finance_analytics.compute_dashboard(self.conn)
+        return len(totals)
+
+    def search(self, filters):
+        # update_treeview under a filter at a random scroll position, and
+        # the match count select_all shows
+        start_id = self.rng.randint(1, self.max_id)
+        rows = finance_db.fetch_page(self.cursor, PAGE_SIZE, after_id=start_id,
+                                     inclusive=True, **filters)
+        if rows:
+            finance_db.has_rows_before(self.cursor, rows[0][0], **filters)
+        finance_db.count_transactions(self.cursor, **filters)
+        return len(rows)
+
+    def search_text(self):
+        return self.search(SEARCH_FILTERS['search_text'])
+
+    def search_type(self):
+        return self.search(SEARCH_FILTERS['search_type'])
+
+    def search_text_type(self):
+        return self.search(SEARCH_FILTERS['search_text_type'])
+
+    def bulk_import(self):
+        # import_statement of an IMPORT_ROWS-row CSV statement
+        self.import_after = self.conn.execute("SELECT MAX(id) FROM transactions").fetchone()[0]
+        imported, _ = finance_db.import_statement(self.conn, self.statement_path)
+        return imported
+
+    def undo_bulk_import(self):
+        # Untimed: delete the imported rows so the ledger is unchanged
+        self.conn.execute("DELETE FROM transactions WHERE id > ?", (self.import_after,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def percentile(ordered, fraction):
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(operation, repeats, undo=None):
+    # undo, if given, runs untimed after each run of operation
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - started) * 1000)
+        if undo:
+            undo()
+
+    # Separate pass so tracing overhead does not skew the timings
+    tracemalloc.start()
+    operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if undo:
+        undo()
+
+    timings.sort()
+    return {
+        'runs': repeats,
+        'mean_ms': statistics.fmean(timings),
+        'p50_ms': percentile(timings, 0.50),
+        'p90_ms': percentile(timings, 0.90),
+        'p99_ms': percentile(timings, 0.99),
+        'max_ms': timings[-1],
+        'peak_python_bytes': peak,
+    }
+
+
+def run_size(data_dir, count, seed, scale):
+    path = generate_ledger(data_dir, count, seed)
+    operations = Operations(path, seed, generate_statement(data_dir, IMPORT_ROWS, seed))
+    results = {}
+    try:
+        for name, repeats in REPEATS.items():
+            results[name] = measure(getattr(operations, name), max(1, int(repeats * scale)),
+                                    undo=getattr(operations, 'undo_' + name, None))
+            if name == 'bulk_import':
+                results[name]['rows_per_s'] = IMPORT_ROWS / (results[name]['p50_ms'] / 1000)
+            print(f"{count:>10} rows  {name:<16} p50 {results[name]['p50_ms']:9.3f} ms"
+                  f"  p99 {results[name]['p99_ms']:9.3f} ms", file=sys.stderr)
+    finally:
+        operations.close()
+    return results
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(previous, current):
+    # Print the p50/p99 ratio of current to previous per size and operation
+    for size, operations in current['results'].items():
+        for name, result in operations.items():
+            before = previous['results'].get(size, {}).get(name)
+            if not before:
+                continue
+            print(f"{size:>10} rows  {name:<16} p50 x{result['p50_ms'] / max(before['p50_ms'], 1e-9):6.2f}"
+                  f"  p99 x{result['p99_ms'] / max(before['p99_ms'], 1e-9):6.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the finance app's data paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="ledger sizes in rows")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--data-dir', default='bench_data',
+                        help="where generated ledgers are cached")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiplier for the number of timed repetitions")
+    parser.add_argument('--output', help="write results as JSON to this path")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = {str(count): run_size(args.data_dir, count, args.seed, args.scale)
+               for count in args.sizes}
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,41 +1,107 @@
 from tkinter import *
-from tkinter import messagebox, ttk
-import re
-import os
+from tkinter import filedialog, messagebox, ttk
+import csv
+import queue
+import threading
+
+import contact_import
+from contact_index import TRIGRAM_MAX_CONTACTS, ContactIndex
+from contact_list import VirtualList
+from contact_store import ContactStore
 
 root = Tk()
 
 root.geometry('600x600')
 root.title("Contact Book")
 
-datas = []
+store = None
+search_index = None
+index_thread = None
+index_events = None
+import_thread = None
+import_events = None
+
+# Most search results shown at once
+SEARCH_LIMIT = 200
+# How often the running import is checked for its result
+IMPORT_POLL_MS = 100
+# How often the index being built is checked for
+INDEX_POLL_MS = 100
 
 contacts_file = "contacts.txt"
 
 
 def is_valid_email(email):
-    regex = r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$'
-    return re.match(regex, email)
+    return contact_import.is_valid_email(email)
 
 
 def load_contacts():
-    global datas
-    if os.path.exists(contacts_file):
-        with open(contacts_file, "r") as file:
-            for line in file:
-                line = line.strip()
-                if line:
-                    datas.append(line.split('|'))
+    # Snapshot plus journal; see contact_store.py for the file format
+    global store
+    store = ContactStore(contacts_file)
+
+
+def searchable():
+    # The search index, or None until it is built. Building it decodes every
+    # contact, so it is only started by the first search, and it runs on a
+    # worker thread so that the window stays responsive meanwhile
+    global index_thread, index_events
+    if search_index is None and index_thread is None:
+        index_events = queue.Queue()
+        index_thread = threading.Thread(target=build_index, args=(index_events,), daemon=True)
+        index_thread.start()
+        root.after(INDEX_POLL_MS, poll_index)
+    return search_index
+
+
+def build_index(events):
+    try:
+        events.put(('done', ContactIndex(store, use_trigrams=len(store) <= TRIGRAM_MAX_CONTACTS)))
+    except Exception as e:
+        events.put(('error', e))
+
+
+def poll_index():
+    global search_index, index_thread
+    try:
+        kind, payload = index_events.get_nowait()
+    except queue.Empty:
+        root.after(INDEX_POLL_MS, poll_index)
+        return
+
+    index_thread = None
+    if kind == 'error':
+        # The next search tries again
+        search_status.config(text="")
+        messagebox.showerror("Search Error", f"Could not index the contacts: {payload}")
+        return
+    search_index = payload
+    update_book()
 
 
-def save_contacts():
-    with open(contacts_file, "w") as file:
-        for contact in datas:
-            file.write('|'.join(contact) + '\n')
+def importing():
+    # True (after telling the user) while an import or the search index is
+    # reading the book, which must not change until they are done
+    if import_thread is not None:
+        messagebox.showerror(
+            "Import Running", "Please wait for the running import to finish.")
+        return True
+    if index_thread is not None:
+        messagebox.showerror(
+            "Indexing Contacts", "Please wait for the search index to be built.")
+        return True
+    return False
+
+
+def selected_contact(action):
+    # Id of the selected contact, or None after telling the user to select one
+    if contact_list.selected is None:
+        messagebox.showerror(
+            "Selection Error", f"Please select a contact to {action}.")
+    return contact_list.selected
 
 
 def add():
-    global datas
     name = Name.get()
     number = Number.get()
     email = Email.get()
@@ -51,36 +117,41 @@ def add():
             "Invalid Input", "Email ID is not in correct format.")
         return
 
-    datas.append([name, number, email, addr])
-    update_book()
-    save_contacts()
+    if importing():
+        return
+
+    contact = (name, number, email, addr)
+    try:
+        contact_id = store.add(contact)
+    except OSError as e:
+        messagebox.showerror("Save Error", f"Could not save the contact:\n{e}")
+        return
+    if search_index is not None:
+        search_index.add(contact_id, contact)
+    if Search.get().strip():
+        # The new contact may or may not match the search
+        update_book()
+    else:
+        contact_list.insert(contact_id)
     reset()
 
 
 def view():
-    try:
-        selected_item = tree.selection()[0]
-        selection_index = int(tree.item(selected_item, 'values')[0])
-    except IndexError:
-        messagebox.showerror(
-            "Selection Error", "Please select a contact to view.")
+    contact_id = selected_contact("view")
+    if contact_id is None:
         return
 
-    Name.set(datas[selection_index][0])
-    Number.set(datas[selection_index][1])
-    Email.set(datas[selection_index][2])
+    name, number, email, addr = store.get(contact_id)
+    Name.set(name)
+    Number.set(number)
+    Email.set(email)
     address.delete(1.0, "end")
-    address.insert(1.0, datas[selection_index][3])
+    address.insert(1.0, addr)
 
 
 def edit():
-    global datas
-    try:
-        selected_item = tree.selection()[0]
-        selection_index = int(tree.item(selected_item, 'values')[0])
-    except IndexError:
-        messagebox.showerror(
-            "Selection Error", "Please select a contact to edit.")
+    contact_id = selected_contact("edit")
+    if contact_id is None:
         return
 
     name = Name.get()
@@ -98,24 +169,115 @@ def edit():
             "Invalid Input", "Email ID is not in correct format.")
         return
 
-    datas[selection_index] = [name, number, email, addr]
+    if importing():
+        return
 
-    update_book()
-    save_contacts()
+    contact = (name, number, email, addr)
+    try:
+        store.update(contact_id, contact)
+    except OSError as e:
+        messagebox.showerror("Save Error", f"Could not save the contact:\n{e}")
+        return
+    if search_index is not None:
+        search_index.update(contact_id, contact)
+
+    query = Search.get()
+    if query.strip() and search_index is not None and not search_index.matches(contact_id, query):
+        # The edit took the contact out of the search results
+        contact_list.remove(contact_id)
+    else:
+        contact_list.update(contact_id)
 
     reset()
 
 
 def delete():
+    contact_id = selected_contact("delete")
+    if contact_id is None or importing():
+        return
+
+    try:
+        store.delete(contact_id)
+    except OSError as e:
+        messagebox.showerror("Delete Error", f"Could not delete the contact:\n{e}")
+        return
+    if search_index is not None:
+        search_index.remove(contact_id)
+    contact_list.remove(contact_id)
+
+
+def import_file():
+    # Reading the file and matching it against the book decodes every
+    # contact, so it runs on a worker thread; the Tk thread applies the
+    # result in one batch once it is ready
+    global import_thread, import_events
+    if importing():
+        return
+    path = filedialog.askopenfilename(
+        title="Import contacts",
+        filetypes=[("vCard or CSV", "*.vcf *.vcard *.csv"), ("All files", "*.*")])
+    if not path:
+        return
+
+    import_events = queue.Queue()
+    import_thread = threading.Thread(
+        target=run_import, args=(path, import_events), daemon=True)
+    import_thread.start()
+    search_status.config(text="Importing...")
+    root.after(IMPORT_POLL_MS, poll_import, path)
+
+
+def run_import(path, events):
+    try:
+        events.put(('done', contact_import.plan_import(path, store)))
+    except Exception as e:
+        events.put(('error', e))
+
+
+def poll_import(path):
+    global import_thread
+    if index_thread is not None:
+        # A search started during the import is indexing the book, which
+        # must not change until the index is built
+        root.after(IMPORT_POLL_MS, poll_import, path)
+        return
     try:
-        selected_item = tree.selection()[0]
-        selection_index = int(tree.item(selected_item, 'values')[0])
-        del datas[selection_index]
+        kind, payload = import_events.get_nowait()
+    except queue.Empty:
+        root.after(IMPORT_POLL_MS, poll_import, path)
+        return
+
+    search_status.config(text="")
+    try:
+        if kind == 'error':
+            if isinstance(payload, (OSError, ValueError, csv.Error)):
+                messagebox.showerror("Import Error", f"Could not import {path}:\n{payload}")
+            else:
+                messagebox.showerror("Import Error", f"Import of {path} failed: {payload}")
+            return
+
+        summary, new_contacts, changed = payload
+        try:
+            ids = store.apply(new_contacts, changed)
+        except OSError as e:
+            # Nothing of the batch was applied
+            messagebox.showerror("Import Error", f"Could not save the contacts from {path}:\n{e}")
+            return
+        added = zip(ids, new_contacts)
+        updated = changed.items()
+        if search_index is not None:
+            for contact_id, contact in added:
+                search_index.add(contact_id, contact)
+            for contact_id, contact in updated:
+                search_index.update(contact_id, contact)
         update_book()
-        save_contacts()
-    except IndexError:
-        messagebox.showerror(
-            "Selection Error", "Please select a contact to delete.")
+        messagebox.showinfo(
+            "Import Complete",
+            f"Added {summary['added']}, merged {summary['merged']} into matching contacts, "
+            f"skipped {summary['skipped']} duplicates and {summary['invalid']} invalid rows.")
+    finally:
+        # Adding, editing and deleting are allowed again whatever happened
+        import_thread = None
 
 
 def reset():
@@ -126,15 +288,31 @@ def reset():
 
 
 def update_book():
-    for i in tree.get_children():
-        tree.delete(i)
-    for index, (n, p, e, a) in enumerate(datas):
-        tree.insert("", "end", iid=index+1, values=(index+1, n, p, e, a))
+    # Show the whole book, or the search results; only the visible rows are
+    # materialized, so this is cheap even for large books
+    query = Search.get()
+    if query.strip():
+        index = searchable()
+        if index is None:
+            # The list stays as it is; poll_index shows the results once
+            # the index is built
+            search_status.config(text="Building the search index...")
+            return
+        matches = index.search(query, SEARCH_LIMIT)
+        contact_list.set_ids(matches, ordered=False)
+        if len(matches) == SEARCH_LIMIT:
+            search_status.config(text=f"Showing the first {SEARCH_LIMIT} matches")
+        else:
+            search_status.config(text=f"{len(matches)} matches")
+    else:
+        contact_list.set_ids(store.ids(), ordered=True)
+        search_status.config(text="")
 
 
 Name = StringVar()
 Number = StringVar()
 Email = StringVar()
+Search = StringVar()
 
 main_frame = Frame(root, padx=10, pady=10)
 main_frame.pack(fill=BOTH, expand=True)
@@ -177,6 +355,19 @@ Button(button_frame, text="Delete", font="arial 12 bold", command=delete,
        width=10, bg="#f44336", fg="white").grid(row=0, column=3, padx=10, pady=5)
 Button(button_frame, text="Reset", font="arial 12 bold", command=reset,
        width=10, bg="#FFC107", fg="white").grid(row=0, column=4, padx=10, pady=5)
+Button(button_frame, text="Import", font="arial 12 bold", command=import_file,
+       width=10, bg="#607D8B", fg="white").grid(row=0, column=5, padx=10, pady=5)
+
+search_frame = Frame(main_frame)
+search_frame.pack(fill=X)
+
+Label(search_frame, text='Search', font='arial 12 bold').pack(side=LEFT)
+Entry(search_frame, textvariable=Search, width=40,
+      font='arial 12').pack(side=LEFT, padx=10)
+search_status = Label(search_frame, font='arial 10')
+search_status.pack(side=LEFT)
+# Filter the list on every keystroke
+Search.trace_add('write', lambda *args: update_book())
 
 list_frame = Frame(main_frame, pady=10)
 list_frame.pack()
@@ -188,9 +379,16 @@ tree.heading('Name', text='Name')
 tree.heading('Phone Number', text='Phone Number')
 tree.heading('Email', text='Email')
 tree.heading('Address', text='Address')
-tree.pack(fill=BOTH, expand=True)
+tree.pack(side=LEFT, fill=BOTH, expand=True)
+
+# Rows are keyed by contact id; the Index column is the display position
+contact_list = VirtualList(tree, fetch=lambda contact_id: store.get(contact_id))
+scrollbar = ttk.Scrollbar(list_frame, orient=VERTICAL, command=contact_list.yview)
+scrollbar.pack(side=RIGHT, fill=Y)
+contact_list.yscrollcommand = scrollbar.set
 
 load_contacts()
 update_book()
 
 root.mainloop()
+store.close()
@@ -0,0 +1,231 @@
+# Bulk import of contacts from vCard (.vcf) and CSV files
+#
+# Files are read as a stream of records and validated in batches with the
+# patterns below. Each contact is matched against the book and the earlier
+# rows of the file by its phone digits and its casefolded email. A match
+# fills in the fields the existing contact is missing, or is skipped if it
+# adds nothing. All changes are then written to the store as a single batch.
+import csv
+import os
+import re
+from itertools import islice
+
+EMAIL_RE = re.compile(r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$')
+NON_DIGIT_RE = re.compile(r'\D')
+# Characters allowed in a phone number besides digits
+PHONE_RE = re.compile(r'^[\d\s()+./-]*\d[\d\s()+./-]*$')
+
+IMPORT_BATCH = 5000
+VCARD_EXTENSIONS = ('.vcf', '.vcard')
+
+# Accepted CSV headers for each field, compared casefolded
+CSV_COLUMNS = {
+    'name': ('name', 'full name', 'display name', 'fn'),
+    'phone': ('phone', 'phone number', 'phone no.', 'mobile', 'mobile phone', 'tel', 'telephone'),
+    'email': ('email', 'e-mail', 'email address', 'e-mail address', 'email id'),
+    'address': ('address', 'home address', 'street', 'adr'),
+}
+CSV_FIRST_NAME = ('first name', 'given name')
+CSV_LAST_NAME = ('last name', 'family name', 'surname')
+
+_VCARD_UNESCAPE_RE = re.compile(r'\\([\\,;nN])')
+# An escaped character or a component separator in a structured value
+_VCARD_SPLIT_RE = re.compile(r'\\.|;')
+
+
+def is_valid_email(email):
+    return EMAIL_RE.match(email)
+
+
+def _vcard_unescape(value):
+    return _VCARD_UNESCAPE_RE.sub(
+        lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+
+def _vcard_components(value):
+    # Unescaped components of a structured value such as N or ADR; an
+    # escaped semicolon belongs to its component
+    parts = []
+    start = 0
+    for match in _VCARD_SPLIT_RE.finditer(value):
+        if match.group() == ';':
+            parts.append(_vcard_unescape(value[start:match.start()]).strip())
+            start = match.end()
+    parts.append(_vcard_unescape(value[start:]).strip())
+    return parts
+
+
+def _unfold(file):
+    # vCard lines continued on the next line start with a space or tab
+    current = None
+    for line in file:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def read_vcards(file):
+    # (name, phone, email, address) per card, using the first TEL, EMAIL and
+    # ADR of each
+    card = None
+    for line in _unfold(file):
+        prop, sep, value = line.partition(':')
+        if not sep:
+            continue
+        # "item1.TEL;TYPE=cell" -> "TEL"
+        key = prop.split(';', 1)[0].rsplit('.', 1)[-1].upper()
+        if key == 'BEGIN' and value.strip().upper() == 'VCARD':
+            card = {}
+        elif card is None:
+            continue
+        elif key == 'END':
+            name = card.get('FN') or card.get('N', '')
+            yield name, card.get('TEL', ''), card.get('EMAIL', ''), card.get('ADR', '')
+            card = None
+        elif key in ('FN', 'TEL', 'EMAIL') and key not in card:
+            value = _vcard_unescape(value).strip()
+            # vCard 4 may give numbers as tel: URIs
+            if key == 'TEL' and value[:4].lower() == 'tel:':
+                value = value[4:]
+            card[key] = value
+        elif key == 'N' and 'N' not in card:
+            # family;given;additional;prefix;suffix
+            parts = _vcard_components(value)
+            parts += [''] * (5 - len(parts))
+            card['N'] = ' '.join(part for part in (parts[3], parts[1], parts[2], parts[0], parts[4]) if part)
+        elif key == 'ADR' and 'ADR' not in card:
+            # po box;extended;street;locality;region;postal code;country
+            parts = _vcard_components(value)
+            card['ADR'] = ', '.join(part for part in parts if part)
+
+
+def _csv_column(fieldnames, aliases):
+    for position, field in enumerate(fieldnames):
+        if field.strip().casefold() in aliases:
+            return position
+    return None
+
+
+def read_csv(file):
+    # (name, phone, email, address) per row; needs a header row naming at
+    # least a phone or email column
+    reader = csv.reader(file)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = {field: _csv_column(header, aliases) for field, aliases in CSV_COLUMNS.items()}
+    first = _csv_column(header, CSV_FIRST_NAME)
+    last = _csv_column(header, CSV_LAST_NAME)
+    if columns['phone'] is None and columns['email'] is None:
+        raise ValueError("the CSV header has no phone or email column")
+
+    def cell(row, position):
+        return row[position].strip() if position is not None and position < len(row) else ''
+
+    for row in reader:
+        name = cell(row, columns['name'])
+        if not name:
+            name = ' '.join(part for part in (cell(row, first), cell(row, last)) if part)
+        yield (name, cell(row, columns['phone']), cell(row, columns['email']),
+               cell(row, columns['address']))
+
+
+def read_contacts(path):
+    # Contacts from a vCard or CSV file, read lazily; the format is chosen by
+    # the file extension
+    with open(path, 'r', encoding='utf-8-sig', errors='replace', newline='') as file:
+        if os.path.splitext(path)[1].lower() in VCARD_EXTENSIONS:
+            yield from read_vcards(file)
+        else:
+            yield from read_csv(file)
+
+
+def validate_batch(rows):
+    # Split rows into valid contacts, with the phone reduced to its digits
+    # as the form requires, and the number of invalid rows
+    valid = []
+    for name, phone, email, addr in rows:
+        if PHONE_RE.match(phone) and EMAIL_RE.match(email):
+            valid.append((name, NON_DIGIT_RE.sub('', phone), email, addr))
+    return valid, len(rows) - len(valid)
+
+
+def dedup_keys(contact):
+    # Normalized phone and email keys; contacts saved without one get no key
+    keys = []
+    phone = NON_DIGIT_RE.sub('', contact[1])
+    if phone:
+        keys.append(('phone', phone))
+    if contact[2]:
+        keys.append(('email', contact[2].casefold()))
+    return keys
+
+
+def merge(existing, incoming):
+    # existing with its empty fields filled in from incoming
+    return tuple(old or new for old, new in zip(existing, incoming))
+
+
+def plan_import(path, store):
+    # Read path and match it against store without changing either.
+    # Returns (summary, new contacts, {id: merged contact}), where summary
+    # counts added, merged, skipped (duplicate) and invalid rows. Decodes
+    # every contact in the book, so the app runs it on a worker thread;
+    # store must not change until it returns.
+    summary = {'added': 0, 'merged': 0, 'skipped': 0, 'invalid': 0}
+    # Dedup key -> existing contact id, or -(position + 1) in new_contacts
+    owners = {}
+    for contact_id, contact in store:
+        for key in dedup_keys(contact):
+            owners.setdefault(key, contact_id)
+    new_contacts = []
+    changed = {}
+
+    rows = read_contacts(path)
+    while True:
+        batch = list(islice(rows, IMPORT_BATCH))
+        if not batch:
+            break
+        valid, invalid = validate_batch(batch)
+        summary['invalid'] += invalid
+        for contact in valid:
+            keys = dedup_keys(contact)
+            owner = next((owners[key] for key in keys if key in owners), None)
+            if owner is None:
+                new_contacts.append(contact)
+                owner = -len(new_contacts)
+                summary['added'] += 1
+            elif owner < 0:
+                current = new_contacts[-owner - 1]
+                merged = merge(current, contact)
+                if merged == current:
+                    summary['skipped'] += 1
+                else:
+                    new_contacts[-owner - 1] = merged
+                    summary['merged'] += 1
+            else:
+                current = changed.get(owner) or store.get(owner)
+                merged = merge(current, contact)
+                if merged == current:
+                    summary['skipped'] += 1
+                else:
+                    changed[owner] = merged
+                    summary['merged'] += 1
+            for key in keys:
+                owners.setdefault(key, owner)
+
+    return summary, new_contacts, changed
+
+
+def import_contacts(path, store):
+    # Import path into store as one batch. Returns (summary, added,
+    # updated), where added/updated are the (id, contact) pairs written.
+    summary, new_contacts, changed = plan_import(path, store)
+    ids = store.apply(new_contacts, changed)
+    return summary, list(zip(ids, new_contacts)), list(changed.items())
@@ -0,0 +1,232 @@
+# In-memory search indexes for the contact book's search box
+#
+# Name words, emails and phone digits are kept in sorted key arrays, so a
+# prefix lookup is two binary searches and the first matches come out in key
+# order without scanning the book. Substring matches ("gmail", "4567") use a
+# trigram index when it is enabled; it costs a set entry per trigram per
+# contact, so large books are indexed without it.
+import gc
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+
+# Books larger than this are indexed without trigrams by default
+TRIGRAM_MAX_CONTACTS = 200_000
+
+_WORD_RE = re.compile(r'\w+')
+_NON_DIGIT_RE = re.compile(r'\D')
+_PHONE_QUERY_RE = re.compile(r'[\d\s()+.-]+')
+
+
+def name_words(name):
+    return _WORD_RE.findall(name.casefold())
+
+
+def phone_digits(phone):
+    return _NON_DIGIT_RE.sub('', phone)
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SortedKeys:
+    # (key, id) pairs sorted by key then id, stored as a list of keys and a
+    # parallel array of ids to avoid a tuple per entry. Pairs must be given
+    # in ascending id order; the sort is stable, so equal keys keep it.
+    def __init__(self, pairs=()):
+        pairs = sorted(pairs, key=itemgetter(0))
+        self.keys = [key for key, _ in pairs]
+        self.ids = array('q', [contact_id for _, contact_id in pairs])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _position(self, key, contact_id):
+        lo = bisect_left(self.keys, key)
+        hi = bisect_right(self.keys, key, lo)
+        return bisect_left(self.ids, contact_id, lo, hi)
+
+    def add(self, key, contact_id):
+        position = self._position(key, contact_id)
+        self.keys.insert(position, key)
+        self.ids.insert(position, contact_id)
+
+    def remove(self, key, contact_id):
+        position = self._position(key, contact_id)
+        if position < len(self.keys) and self.keys[position] == key and self.ids[position] == contact_id:
+            del self.keys[position]
+            del self.ids[position]
+
+    def prefix_range(self, prefix):
+        # (start, stop) positions of the keys starting with prefix
+        return (bisect_left(self.keys, prefix),
+                bisect_left(self.keys, prefix + '\U0010ffff'))
+
+    def prefix(self, prefix):
+        # Ids whose key starts with prefix, in key order
+        start, stop = self.prefix_range(prefix)
+        ids = self.ids
+        for position in range(start, stop):
+            yield ids[position]
+
+
+class ContactIndex:
+    # Search indexes over (id, (name, phone, email, address)) pairs in
+    # ascending id order, kept in step with the book through add, update and
+    # remove
+    def __init__(self, contacts=(), use_trigrams=True):
+        self.use_trigrams = use_trigrams
+        # id -> (name words, phone digits, email, searchable text or None
+        # without trigrams)
+        self.entries = {}
+        self.trigrams = {}
+        names, phones, emails = [], [], []
+        # The build allocates millions of small objects that all stay alive;
+        # letting the cycle collector rescan them repeatedly triples its cost
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            self._build(contacts, names, phones, emails)
+            self.names = SortedKeys(names)
+            self.phones = SortedKeys(phones)
+            self.emails = SortedKeys(emails)
+        finally:
+            if collecting:
+                gc.enable()
+
+    def _build(self, contacts, names, phones, emails):
+        for contact_id, contact in contacts:
+            entry = self._entry(contact)
+            self.entries[contact_id] = entry
+            words, digits, email, text = entry
+            names.extend((word, contact_id) for word in set(words))
+            if digits:
+                phones.append((digits, contact_id))
+            emails.append((email, contact_id))
+            if text:
+                self._add_trigrams(text, contact_id)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _entry(self, contact):
+        name, phone, email, _ = contact
+        words = name_words(name)
+        digits = phone_digits(phone)
+        email = email.casefold()
+        text = f"{' '.join(words)}\0{email}\0{digits}" if self.use_trigrams else None
+        return words, digits, email, text
+
+    def _add_trigrams(self, text, contact_id):
+        for gram in trigrams(text):
+            self.trigrams.setdefault(gram, set()).add(contact_id)
+
+    def add(self, contact_id, contact):
+        entry = self._entry(contact)
+        self.entries[contact_id] = entry
+        words, digits, email, text = entry
+        for word in set(words):
+            self.names.add(word, contact_id)
+        if digits:
+            self.phones.add(digits, contact_id)
+        self.emails.add(email, contact_id)
+        if self.use_trigrams:
+            self._add_trigrams(text, contact_id)
+
+    def remove(self, contact_id):
+        words, digits, email, text = self.entries.pop(contact_id)
+        for word in set(words):
+            self.names.remove(word, contact_id)
+        if digits:
+            self.phones.remove(digits, contact_id)
+        self.emails.remove(email, contact_id)
+        if self.use_trigrams:
+            for gram in trigrams(text):
+                ids = self.trigrams[gram]
+                ids.discard(contact_id)
+                if not ids:
+                    del self.trigrams[gram]
+
+    def update(self, contact_id, contact):
+        self.remove(contact_id)
+        self.add(contact_id, contact)
+
+    def matches(self, contact_id, query):
+        # Whether search(query) finds contact_id, without a limit; checks
+        # the one contact instead of walking the indexes
+        query = query.strip().casefold()
+        entry = self.entries.get(contact_id)
+        if not query or entry is None:
+            return False
+        words, digits, email, text = entry
+        if _PHONE_QUERY_RE.fullmatch(query):
+            query_digits = phone_digits(query)
+            if query_digits:
+                if digits.startswith(query_digits):
+                    return True
+                query = query_digits
+
+        query_words = name_words(query)
+        if query_words and all(any(word.startswith(other) for word in words) for other in query_words):
+            return True
+        if email.startswith(query):
+            return True
+        return self.use_trigrams and len(query) >= 3 and query in text
+
+    def search(self, query, limit):
+        # Up to limit ids matching query: phone prefixes, then contacts with
+        # a name word starting with each query word, then email prefixes,
+        # then substring matches
+        query = query.strip().casefold()
+        if not query:
+            return []
+        found = {}
+        for ids in self._matches(query):
+            for contact_id in ids:
+                found.setdefault(contact_id)
+                if len(found) >= limit:
+                    return list(found)
+        return list(found)
+
+    def _matches(self, query):
+        if _PHONE_QUERY_RE.fullmatch(query):
+            digits = phone_digits(query)
+            if digits:
+                yield self.phones.prefix(digits)
+                query = digits
+
+        words = name_words(query)
+        if words:
+            yield self._name_matches(words)
+        yield self.emails.prefix(query)
+
+        if self.use_trigrams and len(query) >= 3:
+            yield self._substring_matches(query)
+
+    def _name_matches(self, words):
+        # Walk the prefix range of the word with the fewest matches and check
+        # the other words against each contact
+        ranges = sorted(((self.names.prefix_range(word), word) for word in words),
+                        key=lambda item: item[0][1] - item[0][0])
+        (start, stop), _ = ranges[0]
+        others = [word for _, word in ranges[1:]]
+        for position in range(start, stop):
+            contact_id = self.names.ids[position]
+            if not others:
+                yield contact_id
+                continue
+            contact_words = self.entries[contact_id][0]
+            if all(any(word.startswith(other) for word in contact_words) for other in others):
+                yield contact_id
+
+    def _substring_matches(self, query):
+        sets = sorted((self.trigrams.get(gram, ()) for gram in trigrams(query)), key=len)
+        if not sets or not sets[0]:
+            return
+        candidates = sets[0].intersection(*sets[1:]) if len(sets) > 1 else sets[0]
+        for contact_id in candidates:
+            if query in self.entries[contact_id][3]:
+                yield contact_id
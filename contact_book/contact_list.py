@@ -0,0 +1,173 @@
+# Virtual scrolling for the contact list
+#
+# A Treeview with an item per contact takes seconds to fill for a large book
+# and has to be rebuilt whenever positions change. VirtualList instead keeps
+# the displayed ids in an int64 array and only creates items for the rows
+# that fit in the Treeview, keyed by contact id. Scrolling re-fills that
+# window; adding, editing or removing one contact touches at most the
+# visible rows, however long the list is.
+from array import array
+from bisect import bisect_left
+
+
+class VirtualList:
+    # Drives tree, a Treeview whose first column is the row number, from a
+    # list of contact ids. fetch(contact_id) gives the other column values.
+    # Call yview from a scrollbar's command and set yscrollcommand to the
+    # scrollbar's set, as with a scrollable Tk widget.
+    def __init__(self, tree, fetch):
+        self.tree = tree
+        self.fetch = fetch
+        self.ids = array('q')
+        # Whether ids are ascending, so positions can be found by bisection
+        self.ordered = True
+        self.top = 0
+        self.selected = None
+        self.yscrollcommand = None
+        tree.configure(selectmode='browse')
+        tree.bind('<<TreeviewSelect>>', self.on_select)
+        tree.bind('<MouseWheel>', self.on_wheel)
+        tree.bind('<Button-4>', lambda event: self.scroll(-3))
+        tree.bind('<Button-5>', lambda event: self.scroll(3))
+        tree.bind('<Up>', lambda event: self.move_selection(-1))
+        tree.bind('<Down>', lambda event: self.move_selection(1))
+        tree.bind('<Prior>', lambda event: self.move_selection(-self.rows))
+        tree.bind('<Next>', lambda event: self.move_selection(self.rows))
+        tree.bind('<Home>', lambda event: self.move_selection(-len(self.ids)))
+        tree.bind('<End>', lambda event: self.move_selection(len(self.ids)))
+
+    @property
+    def rows(self):
+        return int(self.tree.cget('height'))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, contact_id):
+        # Position of contact_id in the list, or -1
+        if self.ordered:
+            position = bisect_left(self.ids, contact_id)
+            return position if position < len(self.ids) and self.ids[position] == contact_id else -1
+        try:
+            return self.ids.index(contact_id)
+        except ValueError:
+            return -1
+
+    def set_ids(self, ids, ordered):
+        # Show a new list of ids from the top; the selection is kept if the
+        # selected contact is still in it
+        self.ids = ids if isinstance(ids, array) else array('q', ids)
+        self.ordered = ordered
+        self.top = 0
+        if self.selected is not None and self.position(self.selected) < 0:
+            self.selected = None
+        self.render()
+
+    def insert(self, contact_id, position=None):
+        # Add contact_id at position, by default at its place in an ordered
+        # list or else at the end
+        if position is None:
+            position = bisect_left(self.ids, contact_id) if self.ordered else len(self.ids)
+        self.ids.insert(position, contact_id)
+        if position < self.top:
+            # Keep the same contacts in view
+            self.top += 1
+        if position < self.top + self.rows:
+            self.render()
+        else:
+            self.update_scrollbar()
+
+    def update(self, contact_id):
+        # Redraw contact_id's row if it is visible
+        iid = str(contact_id)
+        if self.tree.exists(iid):
+            position = self.position(contact_id)
+            self.tree.item(iid, values=(position + 1, *self.fetch(contact_id)))
+
+    def remove(self, contact_id):
+        position = self.position(contact_id)
+        if position < 0:
+            return
+        del self.ids[position]
+        if contact_id == self.selected:
+            self.selected = None
+        if position < self.top:
+            self.top -= 1
+        if position < self.top + self.rows:
+            self.render()
+        else:
+            self.update_scrollbar()
+
+    def render(self):
+        # Make the Treeview hold exactly the rows from self.top: items that
+        # left the window are deleted, new ones inserted, and the row numbers
+        # of the rest refreshed
+        self.top = max(0, min(self.top, len(self.ids) - self.rows))
+        window = [str(contact_id) for contact_id in self.ids[self.top:self.top + self.rows]]
+        wanted = set(window)
+        stale = [iid for iid in self.tree.get_children() if iid not in wanted]
+        if stale:
+            self.tree.delete(*stale)
+        for index, iid in enumerate(window):
+            values = (self.top + index + 1, *self.fetch(int(iid)))
+            if self.tree.exists(iid):
+                self.tree.move(iid, '', index)
+                self.tree.item(iid, values=values)
+            else:
+                self.tree.insert('', index, iid=iid, values=values)
+        selected = str(self.selected)
+        if selected in wanted and self.tree.selection() != (selected,):
+            self.tree.selection_set(selected)
+        self.update_scrollbar()
+
+    def update_scrollbar(self):
+        if self.yscrollcommand:
+            total = max(len(self.ids), 1)
+            self.yscrollcommand(self.top / total, min(self.top + self.rows, total) / total)
+
+    def scroll(self, rows):
+        top = max(0, min(self.top + rows, len(self.ids) - self.rows))
+        if top != self.top:
+            self.top = top
+            self.render()
+        return 'break'
+
+    def yview(self, *args):
+        # Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'/'pages')
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.ids))
+            self.render()
+        elif args[0] == 'scroll':
+            step = self.rows if args[2] == 'pages' else 1
+            self.scroll(int(args[1]) * step)
+
+    def on_wheel(self, event):
+        # event.delta is a multiple of 120 on Windows and smaller on macOS
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def on_select(self, event):
+        # Scrolling deletes the selected item when it leaves the window, so
+        # only a new selection replaces the remembered one
+        selection = self.tree.selection()
+        if selection:
+            self.selected = int(selection[0])
+
+    def move_selection(self, rows):
+        # Arrow and page keys: move the selection, scrolling to keep it shown
+        if not self.ids:
+            return 'break'
+        position = self.position(self.selected) if self.selected is not None else -1
+        if position < 0:
+            # Nothing selected: step in from the edge of the window, so Down
+            # selects the first row in view, Up the last, and End the last
+            # contact
+            position = self.top - 1 if rows > 0 else min(self.top + self.rows, len(self.ids))
+        position = max(0, min(position + rows, len(self.ids) - 1))
+        self.selected = self.ids[position]
+        if position < self.top:
+            self.top = position
+        elif position >= self.top + self.rows:
+            self.top = position - self.rows + 1
+        self.render()
+        self.tree.focus(str(self.selected))
+        return 'break'
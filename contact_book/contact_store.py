@@ -0,0 +1,609 @@
+# Journaled storage for the contact book
+#
+# The book lives in two files: a snapshot (contacts.txt) holding every
+# contact, and a journal (contacts.txt.journal) that each add, edit and
+# delete appends one line to. Loading replays the journal over the snapshot.
+# Once the journal outgrows the snapshot it is compacted into a new snapshot
+# on a background thread, so a change writes one short record instead of
+# rewriting the whole book.
+#
+# Snapshot:  "#contacts 1 <next id>" header, then "id|name|phone|email|address"
+#            in ascending id order
+# Journal:   "<crc32>|A|id|name|phone|email|address" (add),
+#            "<crc32>|E|id|..." (edit) or "<crc32>|D|id" (delete)
+#            "<crc32>|B|n" ... "<crc32>|C|n" around the n records of a batch
+#
+# Fields escape backslash, "|" and line breaks, so addresses can span lines.
+# Every journal record is written with one write() and fsync'd before the
+# change is reported as saved. A record cut short by a crash fails its
+# checksum and is dropped, along with anything after it, on the next load;
+# a batch whose commit record is missing is dropped as a whole.
+# Snapshots without the header are the older format (name|phone|email|address
+# per line); they are numbered in file order and rewritten on load.
+#
+# The snapshot is memory-mapped rather than read in. Only the id and byte
+# offset of each line are kept in memory, and a contact is decoded when it is
+# looked up. The offsets are cached in contacts.txt.idx, so opening a book
+# does not scan the snapshot unless it changed behind the cache's back.
+# Changes since the snapshot are held in small dicts on top of it.
+import itertools
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+
+SNAPSHOT_HEADER = '#contacts 1'
+JOURNAL_SUFFIX = '.journal'
+# Journal being folded into a new snapshot by a running compaction
+COMPACTING_SUFFIX = '.journal.compacting'
+INDEX_SUFFIX = '.idx'
+PARTIAL_SUFFIX = '.partial'
+# Compact once the journal is larger than both this and the snapshot
+COMPACT_BYTES = 1 << 20
+# Large batches are written to the journal in pieces of about this size
+WRITE_CHUNK_BYTES = 1 << 20
+
+# Offset index: magic, snapshot size, snapshot mtime (ns), row count, then
+# the ids and the row offsets (one more than rows) as little-endian int64
+INDEX_MAGIC = b'CBIDX1\r\n'
+_INDEX_HEADER = struct.Struct('<8sqqq')
+
+_ESCAPES = {'\\': '\\\\', '|': '\\p', '\n': '\\n', '\r': '\\r'}
+_UNESCAPES = {value[1]: key for key, value in _ESCAPES.items()}
+_ESCAPE_RE = re.compile(r'[\\|\n\r]')
+_UNESCAPE_RE = re.compile(r'\\(.)')
+
+
+def escape(field):
+    return _ESCAPE_RE.sub(lambda match: _ESCAPES[match.group()], field)
+
+
+def unescape(field):
+    if '\\' not in field:
+        return field
+    return _UNESCAPE_RE.sub(lambda match: _UNESCAPES.get(match.group(1), match.group(1)), field)
+
+
+def encode_contact(contact_id, contact):
+    return '|'.join([str(contact_id)] + [escape(field) for field in contact])
+
+
+def decode_contact(line):
+    # (id, (name, phone, email, address)) from an encode_contact line
+    fields = line.split('|')
+    if len(fields) != 5:
+        raise ValueError(f"expected 5 fields, got {len(fields)}")
+    return int(fields[0]), tuple(unescape(field) for field in fields[1:])
+
+
+def journal_record(op, payload):
+    body = f"{op}|{payload}"
+    return f"{zlib.crc32(body.encode('utf-8')):08x}|{body}\n".encode('utf-8')
+
+
+def _fsync_directory(path):
+    # Make a rename or a new file in the directory durable; not possible on Windows
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def save_index(index_path, snapshot_path, ids, offsets):
+    stat = os.stat(snapshot_path)
+    with open(index_path, 'wb') as file:
+        file.write(_INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(ids)))
+        for values in (ids, offsets):
+            if sys.byteorder == 'big':
+                values = array('q', values)
+                values.byteswap()
+            values.tofile(file)
+
+
+def load_index(index_path, snapshot_path):
+    # (ids, offsets) from an index that matches the snapshot, else None
+    try:
+        stat = os.stat(snapshot_path)
+        with open(index_path, 'rb') as file:
+            magic, size, mtime, rows = _INDEX_HEADER.unpack(file.read(_INDEX_HEADER.size))
+            if (magic, size, mtime) != (INDEX_MAGIC, stat.st_size, stat.st_mtime_ns):
+                return None
+            ids, offsets = array('q'), array('q')
+            ids.fromfile(file, rows)
+            offsets.fromfile(file, rows + 1)
+    except (OSError, EOFError, struct.error):
+        return None
+    if sys.byteorder == 'big':
+        ids.byteswap()
+        offsets.byteswap()
+    return ids, offsets
+
+
+def write_snapshot(path, next_id, lines):
+    # Write (id, encoded line) pairs, in ascending id order, to a partial
+    # snapshot next to path, with its offset index; adopt_snapshot renames
+    # both into place
+    partial = path + PARTIAL_SUFFIX
+    ids, offsets = array('q'), array('q')
+    with open(partial, 'wb') as file:
+        position = file.write(f"{SNAPSHOT_HEADER} {next_id}\n".encode('utf-8'))
+        for contact_id, line in lines:
+            ids.append(contact_id)
+            offsets.append(position)
+            position += file.write(line)
+        offsets.append(position)
+        file.flush()
+        os.fsync(file.fileno())
+    save_index(partial + INDEX_SUFFIX, partial, ids, offsets)
+
+
+def adopt_snapshot(path):
+    # Rename a write_snapshot result over the snapshot, so a crash leaves
+    # either the old or the new snapshot. A stale index is rebuilt on open.
+    os.replace(path + PARTIAL_SUFFIX, path)
+    os.replace(path + PARTIAL_SUFFIX + INDEX_SUFFIX, path + INDEX_SUFFIX)
+    _fsync_directory(path)
+
+
+class Snapshot:
+    # Read-only view of a snapshot file: ids and line offsets in two int64
+    # arrays, 16 bytes per contact, with lines decoded from the mapped file
+    # on demand
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self.map.find(b'\n') + 1
+        self.next_id = int(self.map[:header_end].split()[2])
+        index = load_index(path + INDEX_SUFFIX, path)
+        if index is None:
+            index = self._scan(header_end)
+            try:
+                save_index(path + INDEX_SUFFIX, path, *index)
+            except OSError:
+                pass
+        self.ids, self.offsets = index
+
+    def _scan(self, position):
+        ids, offsets = array('q'), array('q')
+        data, size = self.map, self.size
+        while position < size:
+            end = data.find(b'\n', position)
+            if end < 0:
+                end = size
+            if end > position:
+                ids.append(int(data[position:data.find(b'|', position, end)]))
+                offsets.append(position)
+            position = end + 1
+        offsets.append(size)
+        return ids, offsets
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, contact_id):
+        # Row of contact_id, or -1
+        position = bisect_left(self.ids, contact_id)
+        if position < len(self.ids) and self.ids[position] == contact_id:
+            return position
+        return -1
+
+    def line(self, position):
+        # Encoded row, ending in a newline
+        line = self.map[self.offsets[position]:self.offsets[position + 1]].rstrip(b'\n')
+        return line + b'\n'
+
+    def contact(self, position):
+        return decode_contact(self.line(position)[:-1].decode('utf-8'))[1]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def _snapshot_lines(snapshot, edited, deleted, added):
+    # Rows of a new snapshot: unchanged rows are copied from the old one
+    # without decoding them
+    if snapshot:
+        for position, contact_id in enumerate(snapshot.ids):
+            if contact_id in deleted:
+                continue
+            contact = edited.get(contact_id)
+            if contact is None:
+                yield contact_id, snapshot.line(position)
+            else:
+                yield contact_id, (encode_contact(contact_id, contact) + '\n').encode('utf-8')
+    for contact_id, contact in added.items():
+        yield contact_id, (encode_contact(contact_id, contact) + '\n').encode('utf-8')
+
+
+class ContactStore:
+    # Contacts as (name, phone, email, address) tuples by id, iterated in id
+    # order, which is the order they were added in. Ids are never reused, so
+    # they can key widgets and journal records. The snapshot's rows are
+    # overlaid by edited (id -> contact), deleted (ids) and added (id ->
+    # contact, for ids after the snapshot's).
+    def __init__(self, path, compact_bytes=COMPACT_BYTES):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.compacting_path = path + COMPACTING_SUFFIX
+        self.compact_bytes = compact_bytes
+        self.snapshot = None
+        self.edited = {}
+        self.deleted = set()
+        self.added = {}
+        self.next_id = 1
+        self.journal_bytes = 0
+        self.journal = None
+        self.compactor = None
+        # State a finished background compaction wrote out, until adopted
+        self.compacted = None
+        # Exception from the last background compaction, if it failed
+        self.compact_error = None
+        self.load()
+
+    @property
+    def snapshot_bytes(self):
+        return self.snapshot.size if self.snapshot else 0
+
+    def __len__(self):
+        return (len(self.snapshot) if self.snapshot else 0) - len(self.deleted) + len(self.added)
+
+    def __iter__(self):
+        # (id, contact) pairs in id order. The book must not change while
+        # this runs.
+        snapshot, edited, deleted = self.snapshot, self.edited, self.deleted
+        if snapshot:
+            for position, contact_id in enumerate(snapshot.ids):
+                if contact_id in deleted:
+                    continue
+                contact = edited.get(contact_id)
+                yield contact_id, contact if contact is not None else snapshot.contact(position)
+        yield from self.added.items()
+
+    def ids(self):
+        # Ids of every contact in order, as an int64 array
+        ids = array('q', self.snapshot.ids) if self.snapshot else array('q')
+        if self.deleted:
+            deleted = self.deleted
+            ids = array('q', [contact_id for contact_id in ids if contact_id not in deleted])
+        ids.extend(self.added)
+        return ids
+
+    def __contains__(self, contact_id):
+        if contact_id in self.added or contact_id in self.edited:
+            return True
+        if contact_id in self.deleted or not self.snapshot:
+            return False
+        return self.snapshot.position(contact_id) >= 0
+
+    def get(self, contact_id):
+        contact = self.added.get(contact_id) or self.edited.get(contact_id)
+        if contact is not None:
+            return contact
+        position = self.snapshot.position(contact_id) if self.snapshot else -1
+        if position < 0 or contact_id in self.deleted:
+            raise KeyError(contact_id)
+        return self.snapshot.contact(position)
+
+    def _put(self, contact_id, contact):
+        if self.snapshot and self.snapshot.position(contact_id) >= 0:
+            self.edited[contact_id] = contact
+        else:
+            self.added[contact_id] = contact
+
+    def _pop(self, contact_id):
+        if self.added.pop(contact_id, None) is None:
+            self.edited.pop(contact_id, None)
+            if self.snapshot and self.snapshot.position(contact_id) >= 0:
+                self.deleted.add(contact_id)
+
+    def load(self):
+        if self.snapshot:
+            self.snapshot.close()
+        self.snapshot = None
+        self.edited, self.deleted, self.added = {}, set(), {}
+        self.next_id = 1
+        for leftover in (self.path + PARTIAL_SUFFIX, self.path + PARTIAL_SUFFIX + INDEX_SUFFIX):
+            _remove(leftover)
+
+        legacy = self._open_snapshot()
+        interrupted = os.path.exists(self.compacting_path)
+        if interrupted:
+            self._replay(self.compacting_path)
+        self.journal_bytes = self._replay(self.journal_path)
+        if legacy or interrupted:
+            # Convert an old-format snapshot, or fold in both journals of a
+            # compaction that did not finish, before accepting new records
+            frozen = self._freeze()
+            write_snapshot(self.path, self.next_id, _snapshot_lines(*frozen[:4]))
+            self._adopt(frozen)
+            _remove(self.compacting_path)
+            open(self.journal_path, 'wb').close()
+            self.journal_bytes = 0
+        self.journal = open(self.journal_path, 'ab', buffering=0)
+        self._maybe_compact()
+
+    def _open_snapshot(self):
+        # Map the snapshot, or read an old-format one into self.added.
+        # Returns True for an old-format snapshot with contacts in it.
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as file:
+            header = file.readline()
+        if header.startswith(SNAPSHOT_HEADER.encode('utf-8')):
+            self.snapshot = Snapshot(self.path)
+            self.next_id = self.snapshot.next_id
+            return False
+        with open(self.path, 'r', encoding='utf-8', newline='\n') as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    fields = line.split('|')
+                    fields += [''] * (4 - len(fields))
+                    self.added[self.next_id] = tuple(fields[:3]) + ('|'.join(fields[3:]),)
+                    self.next_id += 1
+        return bool(self.added)
+
+    def _replay(self, path):
+        # Apply a journal's records and return its valid length in bytes. A
+        # torn or corrupt record ends the journal; it is cut off there, or at
+        # the start of an unfinished batch, so new records are not appended
+        # after garbage.
+        if not os.path.exists(path):
+            return 0
+        valid = 0
+        offset = 0
+        batch = None
+        with open(path, 'rb') as file:
+            for raw in file:
+                offset += len(raw)
+                try:
+                    if not raw.endswith(b'\n'):
+                        raise ValueError("incomplete record")
+                    checksum, body = raw[:-1].decode('utf-8').split('|', 1)
+                    if int(checksum, 16) != zlib.crc32(body.encode('utf-8')):
+                        raise ValueError("checksum mismatch")
+                    op, payload = body.split('|', 1)
+                    if op == 'B' and batch is None:
+                        batch = []
+                        continue
+                    if op == 'C' and batch is not None:
+                        if len(batch) != int(payload):
+                            raise ValueError("batch is missing records")
+                        for record in batch:
+                            self._apply(*record)
+                        batch = None
+                    elif op not in ('A', 'E', 'D'):
+                        raise ValueError(f"unexpected operation {op!r}")
+                    elif batch is not None:
+                        batch.append((op, payload))
+                        continue
+                    else:
+                        self._apply(op, payload)
+                except ValueError as e:
+                    print(f"{path}: dropping journal from byte {valid}: {e}", file=sys.stderr)
+                    break
+                valid = offset
+            else:
+                if batch is not None:
+                    print(f"{path}: dropping unfinished batch from byte {valid}", file=sys.stderr)
+        if valid < os.path.getsize(path):
+            with open(path, 'r+b') as file:
+                file.truncate(valid)
+        return valid
+
+    def _apply(self, op, payload):
+        if op == 'D':
+            contact_id = int(payload)
+            self._pop(contact_id)
+        else:
+            contact_id, contact = decode_contact(payload)
+            self._put(contact_id, contact)
+        self.next_id = max(self.next_id, contact_id + 1)
+
+    def _append(self, record):
+        self._write([record])
+
+    def _write(self, records):
+        # Append records and fsync. If that fails, whatever part was written
+        # is cut off again so later records are not appended after it.
+        start = self.journal_bytes
+        try:
+            chunk, size = [], 0
+            for record in records:
+                chunk.append(record)
+                size += len(record)
+                if size >= WRITE_CHUNK_BYTES:
+                    self.journal.write(b''.join(chunk))
+                    self.journal_bytes += size
+                    chunk, size = [], 0
+            self.journal.write(b''.join(chunk))
+            self.journal_bytes += size
+            os.fsync(self.journal.fileno())
+        except OSError:
+            self.journal_bytes = start
+            try:
+                os.ftruncate(self.journal.fileno(), start)
+            except OSError:
+                pass
+            raise
+
+    def apply(self, added=(), updated=()):
+        # Add contacts and replace others ({id: contact}) as one batch: one
+        # fsync, and after a crash either all of it or none of it is loaded.
+        # Returns the ids given to the added contacts, in order.
+        self._finish_compaction()
+        added = [tuple(contact) for contact in added]
+        updated = {contact_id: tuple(contact) for contact_id, contact in dict(updated).items()}
+        for contact_id in updated:
+            if contact_id not in self:
+                raise KeyError(contact_id)
+        ids = range(self.next_id, self.next_id + len(added))
+        count = len(added) + len(updated)
+        if not count:
+            return []
+
+        records = [('A', contact_id, contact) for contact_id, contact in zip(ids, added)]
+        records += [('E', contact_id, contact) for contact_id, contact in updated.items()]
+        self._write(itertools.chain(
+            [journal_record('B', str(count))],
+            (journal_record(op, encode_contact(contact_id, contact))
+             for op, contact_id, contact in records),
+            [journal_record('C', str(count))]))
+
+        self.added.update(zip(ids, added))
+        for contact_id, contact in updated.items():
+            self._put(contact_id, contact)
+        self.next_id += len(added)
+        self._maybe_compact()
+        return list(ids)
+
+    def add(self, contact):
+        self._finish_compaction()
+        contact_id = self.next_id
+        contact = tuple(contact)
+        self._append(journal_record('A', encode_contact(contact_id, contact)))
+        self.next_id += 1
+        self.added[contact_id] = contact
+        self._maybe_compact()
+        return contact_id
+
+    def update(self, contact_id, contact):
+        self._finish_compaction()
+        if contact_id not in self:
+            raise KeyError(contact_id)
+        contact = tuple(contact)
+        self._append(journal_record('E', encode_contact(contact_id, contact)))
+        self._put(contact_id, contact)
+        self._maybe_compact()
+
+    def delete(self, contact_id):
+        self._finish_compaction()
+        if contact_id not in self:
+            raise KeyError(contact_id)
+        self._append(journal_record('D', str(contact_id)))
+        self._pop(contact_id)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        # Called once a change is applied in memory, so the snapshot includes it
+        if self.journal_bytes >= max(self.compact_bytes, self.snapshot_bytes):
+            self.compact()
+
+    def _freeze(self):
+        # The current contents as (snapshot, edited, deleted, added, next id).
+        # Contacts are immutable tuples, so copying the overlays is enough.
+        return self.snapshot, dict(self.edited), set(self.deleted), dict(self.added), self.next_id
+
+    def compact(self, wait=False):
+        # Start writing a snapshot of the current contacts on a background
+        # thread. The journal is swapped for an empty one first; the new
+        # snapshot is renamed into place, and the old journal deleted, by the
+        # next change or close(). Returns False if a previous compaction is
+        # still running or failed.
+        self._finish_compaction()
+        if self.compactor and self.compactor.is_alive():
+            if wait:
+                self.compactor.join()
+                self._finish_compaction()
+            return False
+        if os.path.exists(self.compacting_path):
+            # Left behind by a failed compaction; load() folds it in
+            return False
+        self.journal.close()
+        os.replace(self.journal_path, self.compacting_path)
+        self.journal = open(self.journal_path, 'ab', buffering=0)
+        _fsync_directory(self.path)
+        self.journal_bytes = 0
+
+        self.compact_error = None
+        self.compactor = threading.Thread(target=self._compact, args=(self._freeze(),),
+                                          name='contact-compactor')
+        self.compactor.start()
+        if wait:
+            self.compactor.join()
+            self._finish_compaction()
+        return True
+
+    def _compact(self, frozen):
+        # Runs on the compactor thread; reads only the frozen state and the
+        # old snapshot, which stays mapped until the new one is adopted
+        snapshot, edited, deleted, added, next_id = frozen
+        try:
+            write_snapshot(self.path, next_id, _snapshot_lines(snapshot, edited, deleted, added))
+        except OSError as e:
+            self.compact_error = e
+            return
+        self.compacted = frozen
+
+    def _finish_compaction(self):
+        # Switch to the snapshot a background compaction wrote, on the
+        # thread that owns the store
+        if self.compacted is None:
+            return
+        frozen, self.compacted = self.compacted, None
+        try:
+            self._adopt(frozen)
+        except OSError as e:
+            self.compact_error = e
+            return
+        _remove(self.compacting_path)
+
+    def _adopt(self, frozen):
+        # Rename the new snapshot into place and drop the overlay entries it
+        # already holds. The old snapshot is unmapped first, as Windows
+        # cannot replace a mapped file; if the rename fails it is reopened
+        # and the overlays, which still hold every change, stay as they are.
+        _, edited, deleted, added, _ = frozen
+        if self.snapshot:
+            self.snapshot.close()
+            self.snapshot = None
+        try:
+            adopt_snapshot(self.path)
+        finally:
+            if os.path.exists(self.path):
+                self.snapshot = Snapshot(self.path)
+
+        live_edited, live_deleted, live_added = self.edited, self.deleted, self.added
+        self.edited, self.deleted, self.added = {}, set(), {}
+        for contact_id, contact in itertools.chain(live_edited.items(), live_added.items()):
+            if contact is not edited.get(contact_id, added.get(contact_id)):
+                self._put(contact_id, contact)
+        for contact_id in live_deleted:
+            if contact_id not in deleted:
+                self.deleted.add(contact_id)
+        for contact_id in added:
+            if contact_id not in live_added:
+                self.deleted.add(contact_id)
+
+    def close(self):
+        # Wait for a running compaction, adopt its snapshot and close the files
+        if self.compactor:
+            self.compactor.join()
+            self._finish_compaction()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        if self.snapshot:
+            self.snapshot.close()
+            self.snapshot = None
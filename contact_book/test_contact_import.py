@@ -0,0 +1,157 @@
+# Tests for the vCard and CSV contact import
+#
+# Run from this folder with "python -m pytest test_contact_import.py" or
+# "python test_contact_import.py". The readers are fed in-memory files; the
+# dedup tests import into a store in a temporary folder.
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import contact_import
+from contact_store import ContactStore
+
+
+class ReadVcardsTest(unittest.TestCase):
+    def read(self, text):
+        return list(contact_import.read_vcards(io.StringIO(text)))
+
+    def test_first_of_each_property_is_used(self):
+        cards = self.read(
+            "BEGIN:VCARD\r\nVERSION:3.0\r\nFN:Ann Lee\r\n"
+            "item1.TEL;TYPE=cell:+1 555 0100\r\nTEL:999\r\n"
+            "EMAIL;TYPE=work:ann@example.com\r\nEMAIL:other@example.com\r\n"
+            "ADR:;;1 Main St;Springfield;;12345;\r\nEND:VCARD\r\n")
+        self.assertEqual(cards, [('Ann Lee', '+1 555 0100', 'ann@example.com',
+                                  '1 Main St, Springfield, 12345')])
+
+    def test_folded_lines_and_escapes(self):
+        cards = self.read(
+            "BEGIN:VCARD\nFN:Smith\\, John\nEMAIL:john@exam\n ple.com\n"
+            "ADR:;;Flat 2\\nHigh St;Town\\;East;;;\nTEL:1\nEND:VCARD\n")
+        self.assertEqual(cards, [('Smith, John', '1', 'john@example.com',
+                                  'Flat 2\nHigh St, Town;East')])
+
+    def test_name_from_n_and_tel_uri(self):
+        cards = self.read(
+            "BEGIN:VCARD\nVERSION:4.0\nN:Lee;Ann;B.;Dr.;\n"
+            "TEL;VALUE=uri:tel:+44-20-7946-0000\nEND:VCARD\n")
+        self.assertEqual(cards, [('Dr. Ann B. Lee', '+44-20-7946-0000', '', '')])
+
+    def test_lines_outside_cards_are_ignored(self):
+        cards = self.read("FN:stray\nnot a property\nBEGIN:VCARD\nFN:A\nEND:VCARD\nTEL:2\n")
+        self.assertEqual(cards, [('A', '', '', '')])
+
+
+class ReadCsvTest(unittest.TestCase):
+    def read(self, text):
+        return list(contact_import.read_csv(io.StringIO(text)))
+
+    def test_header_aliases(self):
+        rows = self.read("Full Name, Mobile ,E-mail Address,Home Address\n"
+                         "Ann,555,ann@example.com,\"1 Main St, Town\"\n")
+        self.assertEqual(rows, [('Ann', '555', 'ann@example.com', '1 Main St, Town')])
+
+    def test_first_and_last_name(self):
+        rows = self.read("Given Name,Surname,Email\nAnn,Lee,ann@example.com\n,Bo,b@example.com\n")
+        self.assertEqual(rows, [('Ann Lee', '', 'ann@example.com', ''),
+                                ('Bo', '', 'b@example.com', '')])
+
+    def test_short_rows_are_padded(self):
+        self.assertEqual(self.read("name,phone,email\nAnn\n"), [('Ann', '', '', '')])
+
+    def test_missing_phone_and_email_columns(self):
+        with self.assertRaises(ValueError):
+            self.read("name,address\nAnn,1 Main St\n")
+
+    def test_empty_file(self):
+        self.assertEqual(self.read(""), [])
+
+
+class ValidateTest(unittest.TestCase):
+    def test_validate_batch(self):
+        valid, invalid = contact_import.validate_batch([
+            ('Ann', '+1 (555) 010-0', 'ann@example.com', ''),
+            ('No phone', '', 'n@example.com', ''),
+            ('Letters', '555-CALL', 'l@example.com', ''),
+            ('Bad email', '555', 'not-an-email', ''),
+        ])
+        self.assertEqual(valid, [('Ann', '15550100', 'ann@example.com', '')])
+        self.assertEqual(invalid, 3)
+
+    def test_dedup_keys(self):
+        self.assertEqual(contact_import.dedup_keys(('A', '555-01', 'Ann@Example.COM', '')),
+                         [('phone', '55501'), ('email', 'ann@example.com')])
+        self.assertEqual(contact_import.dedup_keys(('A', '', '', 'x')), [])
+
+    def test_merge_fills_only_empty_fields(self):
+        self.assertEqual(contact_import.merge(('Ann', '555', 'a@example.com', ''),
+                                              ('Other', '1', 'b@example.com', '1 Main St')),
+                         ('Ann', '555', 'a@example.com', '1 Main St'))
+
+
+class ImportContactsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = ContactStore(os.path.join(self.folder, 'contacts.txt'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.folder)
+
+    def write(self, name, text):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            file.write(text)
+        return path
+
+    def test_matches_book_and_earlier_rows(self):
+        ann = self.store.add(('Ann', '555', 'ann@example.com', ''))
+        bob = self.store.add(('Bob', '777', 'bob@example.com', '2 High St'))
+        # Saved without phone or email, so nothing can match it
+        blank = self.store.add(('Blank', '', '', ''))
+        path = self.write('import.csv', "\n".join([
+            "name,phone,email,address",
+            "Ann L,5-5-5,new@example.com,1 Main St",
+            "Bobby,000,BOB@example.com,Elsewhere",
+            "Cy,888,cy@example.com,",
+            "Cy again,888,other@example.com,3 Low St",
+            "Cy dup,999,CY@example.com,",
+            "Broken,,nobody@example.com,",
+        ]) + "\n")
+
+        summary, added, updated = contact_import.import_contacts(path, self.store)
+
+        self.assertEqual(summary, {'added': 1, 'merged': 2, 'skipped': 2, 'invalid': 1})
+        self.assertEqual(updated, [(ann, ('Ann', '555', 'ann@example.com', '1 Main St'))])
+        self.assertEqual([contact for _, contact in added], [('Cy', '888', 'cy@example.com', '3 Low St')])
+        self.assertEqual(self.store.get(ann), ('Ann', '555', 'ann@example.com', '1 Main St'))
+        self.assertEqual(self.store.get(bob), ('Bob', '777', 'bob@example.com', '2 High St'))
+        self.assertEqual(self.store.get(blank), ('Blank', '', '', ''))
+        self.assertEqual(len(self.store), 4)
+
+    def test_plan_leaves_store_unchanged(self):
+        self.store.add(('Ann', '555', 'ann@example.com', ''))
+        path = self.write('cards.vcf', "BEGIN:VCARD\nFN:Cy\nTEL:888\nEMAIL:cy@example.com\nEND:VCARD\n")
+        summary, new_contacts, changed = contact_import.plan_import(path, self.store)
+        self.assertEqual(summary['added'], 1)
+        self.assertEqual(new_contacts, [('Cy', '888', 'cy@example.com', '')])
+        self.assertEqual(changed, {})
+        self.assertEqual(len(self.store), 1)
+
+    def test_rows_span_batches(self):
+        rows = [f"n{n},{n % 50},{n}@example.com" for n in range(120)]
+        path = self.write('many.csv', "name,phone,email\n" + "\n".join(rows) + "\n")
+        original = contact_import.IMPORT_BATCH
+        contact_import.IMPORT_BATCH = 7
+        try:
+            summary, added, updated = contact_import.import_contacts(path, self.store)
+        finally:
+            contact_import.IMPORT_BATCH = original
+        self.assertEqual(summary, {'added': 50, 'merged': 0, 'skipped': 70, 'invalid': 0})
+        self.assertEqual(len(self.store), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# Tests for the contact search indexes
+#
+# Run from this folder with "python -m pytest test_contact_index.py" or
+# "python test_contact_index.py". The indexes are built from in-memory
+# contacts.
+import unittest
+
+from contact_index import ContactIndex
+
+CONTACTS = [
+    (1, ('Ann Lee', '555-0100', 'ann@example.com', '1 Main St')),
+    (2, ('Bob Leeds', '(555) 0199', 'bob@gmail.com', '')),
+    (3, ('Carla Ann Smith', '+44 20 7946 0000', 'carla@work.org', '')),
+    (4, ('Dan', '', 'dan.lee@gmail.com', '')),
+]
+QUERIES = ['ann', 'lee', 'ann lee', 'le an', '555', '(555) 01', '555-0100', '44 20',
+           'bob@', 'gmail', 'dan.lee', 'smith carla', 'xyz', '0000', '   ']
+
+
+class MatchesTest(unittest.TestCase):
+    def test_matches_agrees_with_search(self):
+        for use_trigrams in (True, False):
+            index = ContactIndex(CONTACTS, use_trigrams=use_trigrams)
+            for query in QUERIES:
+                with self.subTest(use_trigrams=use_trigrams, query=query):
+                    found = set(index.search(query, len(CONTACTS)))
+                    self.assertEqual({contact_id for contact_id, _ in CONTACTS
+                                      if index.matches(contact_id, query)}, found)
+
+    def test_edited_contact_stops_matching(self):
+        index = ContactIndex(CONTACTS)
+        self.assertTrue(index.matches(1, 'ann'))
+        index.update(1, ('Anne Lee', '555-0100', 'anne@example.com', ''))
+        self.assertTrue(index.matches(1, 'ann'))
+        index.update(1, ('Zoe Lee', '555-0100', 'zoe@example.com', ''))
+        self.assertFalse(index.matches(1, 'ann'))
+        self.assertNotIn(1, index.search('ann', 10))
+
+    def test_removed_contact_does_not_match(self):
+        index = ContactIndex(CONTACTS)
+        index.remove(2)
+        self.assertFalse(index.matches(2, 'bob'))
+
+
+if __name__ == '__main__':
+    unittest.main()
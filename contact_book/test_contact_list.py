@@ -0,0 +1,213 @@
+# Tests for the virtual contact list
+#
+# Run from this folder with "python -m pytest test_contact_list.py" or
+# "python test_contact_list.py". The list drives a stub with the parts of
+# ttk.Treeview it uses, so no display is needed.
+import unittest
+
+from contact_list import VirtualList
+
+HEIGHT = 10
+
+
+class StubTree:
+    # Items in order with their values, the selection, and the event
+    # bindings; like Tk, deleting an item drops it from the selection
+    def __init__(self, height=HEIGHT):
+        self.height = height
+        self.items = []
+        self.values = {}
+        self.selected = ()
+        self.focused = None
+        self.bindings = {}
+
+    def configure(self, **options):
+        pass
+
+    def bind(self, sequence, callback):
+        self.bindings[sequence] = callback
+
+    def cget(self, option):
+        return str(self.height)
+
+    def get_children(self):
+        return tuple(self.items)
+
+    def exists(self, iid):
+        return iid in self.values
+
+    def insert(self, parent, index, iid, values):
+        self.items.insert(index, iid)
+        self.values[iid] = values
+
+    def move(self, iid, parent, index):
+        self.items.remove(iid)
+        self.items.insert(index, iid)
+
+    def item(self, iid, values):
+        self.values[iid] = values
+
+    def delete(self, *iids):
+        for iid in iids:
+            self.items.remove(iid)
+            del self.values[iid]
+        self.selected = tuple(iid for iid in self.selected if iid in self.values)
+
+    def selection(self):
+        return self.selected
+
+    def selection_set(self, iid):
+        self.selected = (iid,)
+
+    def focus(self, iid):
+        self.focused = iid
+
+
+class VirtualListTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = StubTree()
+        self.names = {}
+        self.fetched = []
+        self.scrollbar = None
+        self.list = VirtualList(self.tree, fetch=self.fetch)
+        self.list.yscrollcommand = lambda first, last: setattr(self, 'scrollbar', (first, last))
+
+    def fetch(self, contact_id):
+        self.fetched.append(contact_id)
+        return (self.names.get(contact_id, f"name {contact_id}"), '', '', '')
+
+    def click(self, contact_id):
+        # The user selecting a row
+        self.tree.selection_set(str(contact_id))
+        self.tree.bindings['<<TreeviewSelect>>'](None)
+
+    def shown(self):
+        # (row number, contact id) of every item, checked against the list
+        rows = [(self.tree.values[iid][0], int(iid)) for iid in self.tree.items]
+        ids = self.list.ids
+        self.assertEqual(rows, [(self.list.top + index + 1, ids[self.list.top + index])
+                                for index in range(min(HEIGHT, len(ids) - self.list.top))])
+        return [contact_id for _, contact_id in rows]
+
+    def test_window_is_refilled_on_scroll(self):
+        self.list.set_ids(range(1, 1001), ordered=True)
+        self.assertEqual(self.shown(), list(range(1, 11)))
+        self.assertEqual(self.scrollbar, (0.0, HEIGHT / 1000))
+
+        self.fetched.clear()
+        self.list.scroll(25)
+        self.assertEqual(self.shown(), list(range(26, 36)))
+        # Only the visible rows are fetched
+        self.assertEqual(sorted(self.fetched), list(range(26, 36)))
+
+        self.list.yview('moveto', '0.5')
+        self.assertEqual(self.shown(), list(range(501, 511)))
+        self.list.yview('scroll', '1', 'pages')
+        self.assertEqual(self.shown(), list(range(511, 521)))
+        self.list.yview('scroll', '-2', 'units')
+        self.assertEqual(self.shown(), list(range(509, 519)))
+        self.assertEqual(self.tree.bindings['<MouseWheel>'](type('Event', (), {'delta': -120})), 'break')
+        self.assertEqual(self.shown(), list(range(512, 522)))
+        self.assertEqual(self.scrollbar, (511 / 1000, 521 / 1000))
+
+    def test_scrolling_stops_at_the_ends(self):
+        self.list.set_ids(range(1, 101), ordered=True)
+        self.list.scroll(-5)
+        self.assertEqual(self.shown(), list(range(1, 11)))
+
+        self.list.yview('moveto', '1.0')
+        self.assertEqual(self.shown(), list(range(91, 101)))
+        self.list.scroll(3)
+        self.list.yview('scroll', '1', 'pages')
+        self.assertEqual(self.shown(), list(range(91, 101)))
+        self.assertEqual(self.scrollbar, (0.9, 1.0))
+
+        self.list.yview('moveto', '-0.2')
+        self.assertEqual(self.shown(), list(range(1, 11)))
+
+        # The End and Home keys select the last and first contacts
+        self.tree.bindings['<End>'](None)
+        self.assertEqual((self.list.selected, self.tree.selection()), (100, ('100',)))
+        self.assertEqual(self.shown(), list(range(91, 101)))
+        self.tree.bindings['<Home>'](None)
+        self.assertEqual((self.list.selected, self.tree.focused), (1, '1'))
+        self.assertEqual(self.shown(), list(range(1, 11)))
+
+    def test_short_list(self):
+        self.list.set_ids([4, 8, 15], ordered=True)
+        self.assertEqual(self.shown(), [4, 8, 15])
+        self.assertEqual(self.scrollbar, (0.0, 1.0))
+        self.list.scroll(5)
+        self.list.yview('moveto', '0.9')
+        self.assertEqual(self.shown(), [4, 8, 15])
+        # With nothing selected, Up starts from the last row in view
+        self.tree.bindings['<Up>'](None)
+        self.assertEqual(self.list.selected, 15)
+
+        self.list.set_ids([], ordered=True)
+        self.assertEqual(self.shown(), [])
+        self.assertEqual(self.tree.bindings['<Down>'](None), 'break')
+        self.assertIsNone(self.list.selected)
+
+    def test_selection_follows_the_contact_id(self):
+        self.list.set_ids(range(1, 101, 2), ordered=True)
+        self.list.scroll(20)
+        self.click(45)
+        self.assertEqual(self.list.selected, 45)
+
+        # A contact added above the window keeps the same contacts in view
+        self.list.insert(2)
+        self.assertEqual(self.shown(), list(range(41, 61, 2)))
+        self.assertEqual(self.tree.selection(), ('45',))
+        # One added and one removed inside the window shift the rows
+        self.list.insert(44)
+        self.list.remove(43)
+        self.assertEqual(self.shown()[:4], [41, 44, 45, 47])
+        self.assertEqual(self.tree.selection(), ('45',))
+
+        # An edit redraws the row in place
+        self.names[45] = 'renamed'
+        self.list.update(45)
+        self.assertEqual(self.tree.values['45'], (self.list.position(45) + 1, 'renamed', '', '', ''))
+        self.assertEqual(self.list.selected, 45)
+
+        # Scrolled out of the window and back, the contact is selected again
+        self.list.yview('moveto', '0')
+        self.assertEqual(self.tree.selection(), ())
+        self.assertEqual(self.list.selected, 45)
+        self.list.scroll(20)
+        self.assertEqual(self.tree.selection(), ('45',))
+
+        # The arrow keys move from the selected contact, whatever is in view
+        self.list.yview('moveto', '0')
+        self.tree.bindings['<Down>'](None)
+        self.assertEqual(self.list.selected, 47)
+        self.assertIn(47, self.shown())
+
+        self.list.remove(47)
+        self.assertIsNone(self.list.selected)
+        self.assertNotIn(47, self.shown())
+
+    def test_new_list_keeps_a_selection_it_contains(self):
+        self.list.set_ids(range(1, 51), ordered=True)
+        self.click(7)
+        self.list.set_ids([30, 7, 12], ordered=False)
+        self.assertEqual(self.list.selected, 7)
+        self.assertEqual(self.tree.selection(), ('7',))
+        self.list.set_ids([30, 12], ordered=False)
+        self.assertIsNone(self.list.selected)
+
+    def test_unordered_list(self):
+        # Search results are in match order; new contacts go at the end
+        self.list.set_ids([30, 7, 12], ordered=False)
+        self.list.insert(1)
+        self.assertEqual(self.shown(), [30, 7, 12, 1])
+        self.list.remove(7)
+        self.assertEqual(self.shown(), [30, 12, 1])
+        self.assertEqual(self.list.position(12), 1)
+        self.list.remove(99)
+        self.assertEqual(self.shown(), [30, 12, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+# Regression tests for the journaled contact store
+#
+# Run from this folder with "python -m pytest test_contact_store.py" or
+# "python test_contact_store.py". A random sequence of changes, reopens and
+# compactions is checked against a plain dict, and crashes are simulated by
+# cutting the journal short or abandoning a store without closing it.
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import contact_store
+from contact_store import (COMPACTING_SUFFIX, INDEX_SUFFIX, JOURNAL_SUFFIX, PARTIAL_SUFFIX,
+                           ContactStore, Snapshot)
+
+
+def random_contact(rng):
+    # Fields include the characters the store has to escape
+    def text():
+        return ''.join(rng.choice('abc xyz|\\\n\ré') for _ in range(rng.randint(0, 8)))
+    return (text(), str(rng.randint(0, 10 ** 9)), text(), text())
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'contacts.txt')
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            if store.compactor:
+                store.compactor.join()
+            for file in (store.journal, store.snapshot):
+                if file:
+                    file.close()
+        shutil.rmtree(self.folder)
+
+    def open(self, **options):
+        store = ContactStore(self.path, **options)
+        self.stores.append(store)
+        return store
+
+    def assertMatches(self, store, model):
+        self.assertEqual(list(store), sorted(model.items()))
+        self.assertEqual(list(store.ids()), sorted(model))
+        self.assertEqual(len(store), len(model))
+        for contact_id, contact in model.items():
+            self.assertIn(contact_id, store)
+            self.assertEqual(store.get(contact_id), contact)
+
+    def journal_size(self):
+        return os.path.getsize(self.path + JOURNAL_SUFFIX)
+
+
+class ModelTest(StoreTestCase):
+    def run_model(self, seed, steps=400):
+        rng = random.Random(seed)
+        os.mkdir(os.path.join(self.folder, str(seed)))
+        self.path = os.path.join(self.folder, str(seed), 'contacts.txt')
+        # A small threshold so compactions start often
+        options = {'compact_bytes': 2048}
+        store = self.open(**options)
+        model = {}
+        for _ in range(steps):
+            action = rng.random()
+            if action < 0.35 or not model:
+                contact = random_contact(rng)
+                model[store.add(contact)] = contact
+            elif action < 0.55:
+                contact_id = rng.choice(list(model))
+                model[contact_id] = random_contact(rng)
+                store.update(contact_id, model[contact_id])
+            elif action < 0.7:
+                contact_id = rng.choice(list(model))
+                del model[contact_id]
+                store.delete(contact_id)
+            elif action < 0.8:
+                added = [random_contact(rng) for _ in range(rng.randint(0, 5))]
+                updated = {contact_id: random_contact(rng)
+                           for contact_id in rng.sample(list(model), min(len(model), 3))}
+                ids = store.apply(added, updated)
+                model.update(updated)
+                model.update(zip(ids, added))
+            elif action < 0.85:
+                store.compact(wait=rng.random() < 0.5)
+            elif action < 0.9:
+                store.close()
+                store = self.open(**options)
+            elif action < 0.95:
+                # Crash: abandon the store without adopting a finished
+                # compaction or closing anything
+                if store.compactor:
+                    store.compactor.join()
+                store = self.open(**options)
+            self.assertMatches(store, model)
+            self.assertIsNone(store.compact_error)
+        store.close()
+        self.assertMatches(self.open(), model)
+
+    def test_random_changes_match_a_dict(self):
+        for seed in range(6):
+            with self.subTest(seed=seed):
+                self.run_model(seed)
+
+    def test_ids_are_not_reused(self):
+        store = self.open()
+        first = store.add(('a', '1', 'a@example.com', ''))
+        store.delete(first)
+        store.close()
+        store = self.open()
+        self.assertGreater(store.add(('b', '2', 'b@example.com', '')), first)
+
+
+class JournalRecoveryTest(StoreTestCase):
+    def test_truncated_tail_is_dropped(self):
+        store = self.open()
+        contact = ('kept', '1', 'k@example.com', 'line one\nline two')
+        kept = {store.add(contact): contact}
+        valid = self.journal_size()
+        store.add(('torn', '2', 't@example.com', ''))
+        store.close()
+        with open(self.path + JOURNAL_SUFFIX, 'r+b') as file:
+            file.truncate(self.journal_size() - 5)
+
+        store = self.open()
+        self.assertMatches(store, kept)
+        # The torn record is cut off so new records follow valid ones
+        self.assertEqual(self.journal_size(), valid)
+        contact = ('after', '3', 'a@example.com', '')
+        kept[store.add(contact)] = contact
+        store.close()
+        self.assertMatches(self.open(), kept)
+
+    def test_corrupt_record_drops_the_rest(self):
+        store = self.open()
+        first = ('first', '1', 'f@example.com', '')
+        first_id = store.add(first)
+        valid = self.journal_size()
+        store.add(('second', '2', 's@example.com', ''))
+        store.add(('third', '3', 'th@example.com', ''))
+        store.close()
+        with open(self.path + JOURNAL_SUFFIX, 'r+b') as file:
+            file.seek(valid + 12)
+            byte = file.read(1)
+            file.seek(valid + 12)
+            file.write(bytes([byte[0] ^ 1]))
+
+        self.assertMatches(self.open(), {first_id: first})
+        self.assertEqual(self.journal_size(), valid)
+
+    def test_torn_batch_is_dropped_whole(self):
+        store = self.open()
+        single = ('single', '1', 's@example.com', '')
+        model = {store.add(single): single}
+        valid = self.journal_size()
+        store.apply([('a', '2', 'a@example.com', ''), ('b', '3', 'b@example.com', '')],
+                    {next(iter(model)): ('single', '1', 's@example.com', 'edited')})
+        store.close()
+        with open(self.path + JOURNAL_SUFFIX, 'rb') as file:
+            records = file.readlines()
+        # Every record of the batch is intact; only its commit is missing
+        with open(self.path + JOURNAL_SUFFIX, 'wb') as file:
+            file.writelines(records[:-1])
+
+        store = self.open()
+        self.assertMatches(store, model)
+        self.assertEqual(self.journal_size(), valid)
+        # The dropped batch's ids were never saved, so they are handed out again
+        self.assertEqual(store.apply([single]), [max(model) + 1])
+
+    def test_batch_survives_reopen(self):
+        store = self.open()
+        added = [random_contact(random.Random(n)) for n in range(20)]
+        ids = store.apply(added)
+        store.close()
+        self.assertMatches(self.open(), dict(zip(ids, added)))
+
+
+class CompactionTest(StoreTestCase):
+    def test_changes_during_compaction_are_kept(self):
+        rng = random.Random(1)
+        store = self.open()
+        model = {}
+        for _ in range(300):
+            contact = random_contact(rng)
+            model[store.add(contact)] = contact
+        self.assertTrue(store.compact())
+        # These run while the compactor may still be writing the snapshot
+        for contact_id in list(model)[:50]:
+            model[contact_id] = random_contact(rng)
+            store.update(contact_id, model[contact_id])
+        for contact_id in list(model)[50:80]:
+            del model[contact_id]
+            store.delete(contact_id)
+        for _ in range(30):
+            contact = random_contact(rng)
+            model[store.add(contact)] = contact
+        self.assertMatches(store, model)
+
+        store.compactor.join()
+        store._finish_compaction()
+        self.assertFalse(os.path.exists(self.path + COMPACTING_SUFFIX))
+        self.assertMatches(store, model)
+        store.close()
+        self.assertMatches(self.open(), model)
+
+    def test_interrupted_compaction_is_folded_in_on_load(self):
+        store = self.open()
+        model = {}
+        for n in range(10):
+            contact = (f"name {n}", str(n), f"{n}@example.com", '')
+            model[store.add(contact)] = contact
+        store.close()
+        # Crash after the journal was set aside, before the snapshot was
+        # written: a partial snapshot and the set-aside journal are left
+        os.replace(self.path + JOURNAL_SUFFIX, self.path + COMPACTING_SUFFIX)
+        with open(self.path + PARTIAL_SUFFIX, 'wb') as file:
+            file.write(b'#contacts 1 5\n1|half')
+        store = self.open()
+        contact = ('late', '99', 'late@example.com', '')
+        model[store.add(contact)] = contact
+        store.close()
+
+        store = self.open()
+        self.assertMatches(store, model)
+        for leftover in (COMPACTING_SUFFIX, PARTIAL_SUFFIX):
+            self.assertFalse(os.path.exists(self.path + leftover))
+
+
+class SnapshotIndexTest(StoreTestCase):
+    def write_book(self, count):
+        store = self.open()
+        model = {}
+        rng = random.Random(count)
+        for _ in range(count):
+            contact = random_contact(rng)
+            model[store.add(contact)] = contact
+        store.compact(wait=True)
+        store.close()
+        return model
+
+    def test_cached_index_matches_a_scan(self):
+        self.write_book(200)
+        snapshot = Snapshot(self.path)
+        try:
+            header_end = snapshot.map.find(b'\n') + 1
+            self.assertEqual(snapshot._scan(header_end), (snapshot.ids, snapshot.offsets))
+        finally:
+            snapshot.close()
+
+    def test_stale_index_is_rebuilt(self):
+        model = self.write_book(50)
+        # Rewrite the snapshot behind the cache's back with a longer first row
+        with open(self.path, 'rb') as file:
+            lines = file.readlines()
+        first_id = min(model)
+        model[first_id] = ('renamed to something longer', '1', 'r@example.com', '')
+        lines[1] = (contact_store.encode_contact(first_id, model[first_id]) + '\n').encode('utf-8')
+        with open(self.path, 'wb') as file:
+            file.writelines(lines)
+        self.assertIsNone(contact_store.load_index(self.path + INDEX_SUFFIX, self.path))
+
+        self.assertMatches(self.open(), model)
+        self.assertIsNotNone(contact_store.load_index(self.path + INDEX_SUFFIX, self.path))
+
+    def test_legacy_file_is_converted(self):
+        with open(self.path, 'w', encoding='utf-8', newline='\n') as file:
+            file.write("Ann|123|ann@example.com|1 Main St\n\nBob|456|bob@example.com|a|b\n")
+        store = self.open()
+        expected = {1: ('Ann', '123', 'ann@example.com', '1 Main St'),
+                    2: ('Bob', '456', 'bob@example.com', 'a|b')}
+        self.assertMatches(store, expected)
+        store.close()
+        with open(self.path, 'rb') as file:
+            self.assertTrue(file.readline().startswith(b'#contacts 1'))
+        self.assertMatches(self.open(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
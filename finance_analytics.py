@@ -0,0 +1,129 @@
+# Columnar cash-flow pipeline for the finance dashboard
+import queue
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+import finance_db
+
+# Bucket size chosen from the span being shown: (max days, pandas frequency).
+# Every span gives at most a few hundred points per line, so the buckets
+# are plotted as they are.
+RESAMPLE_RULES = [
+    (92, 'D'),
+    (2 * 366, 'W'),
+]
+LONG_RANGE_RULE = 'MS'
+
+TYPES = ['Income', 'Expense']
+
+
+def load_daily_totals(conn, start=None, end=None):
+    # Per-day, per-type sums from the daily_totals rollup, optionally limited
+    # to an inclusive yyyy-mm-dd range
+    conditions = []
+    params = []
+    if start:
+        conditions.append("day >= ?")
+        params.append(start)
+    if end:
+        conditions.append("day <= ?")
+        params.append(end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    frame = pd.read_sql_query(f"SELECT day, type, total FROM daily_totals {where}",
+                              conn, params=params,
+                              dtype={'day': 'string', 'type': 'string', 'total': 'float64'})
+    frame['day'] = pd.to_datetime(frame['day'], format='%Y-%m-%d', errors='coerce')
+    return frame.dropna(subset=['day'])
+
+
+def choose_rule(start, end):
+    span = (end - start).days
+    for max_days, rule in RESAMPLE_RULES:
+        if span <= max_days:
+            return rule
+    return LONG_RANGE_RULE
+
+
+def resample_cash_flow(daily, rule=None):
+    # Pivot to one column per type and sum into day/week/month buckets
+    if daily.empty:
+        return pd.DataFrame(columns=TYPES, dtype='float64')
+    wide = daily.pivot_table(index='day', columns='type', values='total', aggfunc='sum')
+    wide = wide.reindex(columns=TYPES, fill_value=0.0).fillna(0.0)
+    if rule is None:
+        rule = choose_rule(wide.index.min(), wide.index.max())
+    return wide.resample(rule).sum()
+
+
+def cash_flow_series(conn, start=None, end=None):
+    # Plot-ready {type: (dates, amounts)} for the cash-flow chart
+    return series_from_daily(load_daily_totals(conn, start, end))
+
+
+def series_from_daily(daily):
+    # cash_flow_series for an already loaded load_daily_totals frame
+    buckets = resample_cash_flow(daily)
+    if buckets.empty:
+        return {}
+
+    dates = buckets.index.to_numpy(dtype='datetime64[ns]')
+    return {ttype: (dates, buckets[ttype].to_numpy(dtype=np.float64)) for ttype in TYPES}
+
+
+def compute_dashboard(conn):
+    # Everything the dashboard shows: ({type: total}, cash-flow series)
+    return finance_db.read_totals(conn.cursor()), cash_flow_series(conn)
+
+
+class DashboardWorker(threading.Thread):
+    # Recomputes dashboard data off the Tk thread with its own connection.
+    # Requests that queue up while a computation runs are served by the
+    # next single computation; results (or the raised exception) are put on
+    # self.results for the UI to poll. outstanding counts the requests not
+    # yet answered; it drops only after their result has been queued.
+    # Computations are timed when given a finance_profiler.Profiler.
+    def __init__(self, db_path, profiler=None):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.profiler = profiler
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.outstanding = 0
+        self.lock = threading.Lock()
+
+    def request(self):
+        with self.lock:
+            self.outstanding += 1
+        self.requests.put(True)
+
+    def stop(self):
+        self.requests.put(None)
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            while True:
+                pending = [self.requests.get()]
+                while True:
+                    try:
+                        pending.append(self.requests.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in pending:
+                    return
+                try:
+                    if self.profiler:
+                        with self.profiler.measure('aggregation', 'compute_dashboard'):
+                            result = compute_dashboard(conn)
+                    else:
+                        result = compute_dashboard(conn)
+                    self.results.put(result)
+                except Exception as e:
+                    self.results.put(e)
+                with self.lock:
+                    self.outstanding -= len(pending)
+        finally:
+            conn.close()
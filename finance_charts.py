@@ -0,0 +1,108 @@
+# Dashboard charts drawn onto any matplotlib Figure: the app's Tk canvas or
+# the headless report renderer's Agg figures. No backend is selected here;
+# that is left to the caller.
+import math
+
+from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+
+INCOME_COLOR = "#2ecc71"
+EXPENSE_COLOR = "#e74c3c"
+TEXT_COLOR = "#34495e"
+
+
+class DashboardCharts:
+    # The income-vs-expense pie and the cash-flow lines on two side-by-side
+    # axes. Artists are created once and updated in place by draw().
+    def __init__(self, figure, income_color=INCOME_COLOR, expense_color=EXPENSE_COLOR,
+                 text_color=TEXT_COLOR):
+        self.figure = figure
+        self.income_color = income_color
+        self.expense_color = expense_color
+        self.ax1, self.ax2 = figure.subplots(1, 2)
+
+        self.pie_labels = None
+        self.pie_artists = []
+        self.ax1.set_title("Income vs Expense")
+        self.pie_empty_text = self.ax1.text(0.5, 0.5, 'No Data Available', horizontalalignment='center',
+                                            verticalalignment='center', transform=self.ax1.transAxes, fontsize=24, color=text_color)
+
+        self.ax2.xaxis_date()
+        locator = AutoDateLocator()
+        self.ax2.xaxis.set_major_locator(locator)
+        self.ax2.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+        self.income_line, = self.ax2.plot([], [], marker='o',
+                                          linestyle='-', color=income_color, label='Income')
+        self.expense_line, = self.ax2.plot([], [], marker='o',
+                                           linestyle='-', color=expense_color, label='Expense')
+        self.ax2.set_title("Cash Flow Over Time")
+        self.ax2.set_ylabel("Amount ($)")
+        self.ax2.set_xlabel("Date")
+        self.ax2.legend()
+        self.cash_flow_empty_text = self.ax2.text(0.5, 0.5, 'No Data Available', horizontalalignment='center',
+                                                  verticalalignment='center', transform=self.ax2.transAxes, fontsize=24, color=text_color)
+
+    def draw(self, totals, cash_flow):
+        # totals is {type: total}, cash_flow as from
+        # finance_analytics.cash_flow_series; the caller redraws the canvas
+        income = totals.get('Income', 0.0)
+        expense = totals.get('Expense', 0.0)
+
+        labels = []
+        sizes = []
+        colors = []
+
+        if income > 0:
+            labels.append('Income')
+            sizes.append(income)
+            colors.append(self.income_color)
+
+        if expense > 0:
+            labels.append('Expense')
+            sizes.append(expense)
+            colors.append(self.expense_color)
+
+        self.draw_pie(labels, sizes, colors)
+
+        # Cash Flow Over Time
+        if cash_flow:
+            self.income_line.set_data(*cash_flow['Income'])
+            self.expense_line.set_data(*cash_flow['Expense'])
+        else:
+            self.income_line.set_data([], [])
+            self.expense_line.set_data([], [])
+        self.cash_flow_empty_text.set_visible(not cash_flow)
+        self.ax2.relim()
+        self.ax2.autoscale_view()
+
+    def draw_pie(self, labels, sizes, colors):
+        self.pie_empty_text.set_visible(not sizes)
+
+        if labels != self.pie_labels:
+            # The set of wedges changed; replace them
+            for artist in self.pie_artists:
+                artist.remove()
+            self.pie_artists = []
+            if sizes:
+                wedges, texts, autotexts = self.ax1.pie(sizes, labels=labels, colors=colors,
+                                                        autopct='%1.1f%%', startangle=90)
+                self.pie_wedges = wedges
+                self.pie_artists = [*wedges, *texts, *autotexts]
+                self.pie_label_texts = texts
+                self.pie_autotexts = autotexts
+            self.pie_labels = labels
+            return
+
+        # Same wedges: move their angles and labels
+        total = sum(sizes)
+        theta = 90.0
+        for wedge, label, autotext, size in zip(self.pie_wedges, self.pie_label_texts, self.pie_autotexts, sizes):
+            span = 360.0 * size / total
+            wedge.set_theta1(theta)
+            wedge.set_theta2(theta + span)
+            middle = math.radians(theta + span / 2)
+            x, y = math.cos(middle), math.sin(middle)
+            label.set_position((1.1 * x, 1.1 * y))
+            label.set_horizontalalignment('left' if x > 0 else 'right')
+            autotext.set_position((0.6 * x, 0.6 * y))
+            autotext.set_text(f"{100 * size / total:1.1f}%")
+            theta += span
@@ -0,0 +1,1305 @@
+# Database layer for the personal finance app, usable without Tk
+import argparse
+import csv
+import itertools
+import math
+import os
+import queue
+import re
+import sqlite3
+import stat
+import sys
+import threading
+import time
+from datetime import datetime
+from operator import itemgetter
+
+DEFAULT_DB = 'finance.db'
+
+# Columns shown in the UI, in Treeview order; qualified so they can be
+# selected from the full-text search join as well
+COLUMNS = "transactions.id, transactions.type, transactions.amount, transactions.date, transactions.description"
+
+# Format dates are shown and stored in for display; iso_date mirrors it
+# as yyyy-mm-dd so SQLite can sort and range-scan through an index
+DISPLAY_DATE_FORMAT = '%d-%m-%Y'
+MIGRATION_BATCH_SIZE = 10000
+
+# Rows validated and written per executemany call during imports
+IMPORT_BATCH_SIZE = 50000
+# An import whose first batch adds at least this fraction of the rows
+# already in the table rebuilds the secondary indexes once at the end
+# instead of updating them row by row
+INDEX_REBUILD_FRACTION = 1.0
+# Page cache for the import's connection while it runs, in KiB; index
+# pages that stay cached are not re-read for every row
+IMPORT_CACHE_KIB = 256 * 1024
+# Accepted statement date formats, tried in order, unless an import names
+# its own; OFX dates use the first eight characters of DTPOSTED. Slashed
+# dates are read day first, so US statements need date_format='%m/%d/%Y'.
+IMPORT_DATE_FORMATS = ('%d-%m-%Y', '%Y-%m-%d', '%d/%m/%Y', '%d.%m.%Y', '%Y%m%d')
+OFX_DATE_FORMAT = '%Y%m%d'
+# Amounts float() rejects that are still unambiguous: optional parentheses
+# or a sign before or after a currency symbol, and thousands separated by
+# commas, e.g. "($1,234.50)" or "$-12.00". Anything else, such as the
+# European "1.234,56", is rejected rather than guessed at.
+AMOUNT_RE = re.compile(
+    r'(\()?\s*([+-]?)\s*[$\u00a3\u20ac\u00a5]?\s*([+-]?)\s*((?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?)\s*(\))?')
+# Statement transaction types mapped onto the app's two types; anything
+# else is classified by the sign of the amount
+INCOME_TYPES = {'income', 'credit', 'deposit', 'dep', 'int', 'div', 'directdep', 'cr'}
+EXPENSE_TYPES = {'expense', 'debit', 'payment', 'withdrawal', 'check', 'fee',
+                 'srvchg', 'atm', 'pos', 'directdebit', 'repeatpmt', 'dr'}
+# Header names recognised in CSV statements, per field
+CSV_HEADERS = {
+    'type': ('type', 'transaction type', 'trntype'),
+    'amount': ('amount', 'trnamt', 'value'),
+    'date': ('date', 'transaction date', 'posted date', 'posting date', 'dtposted'),
+    'description': ('description', 'memo', 'name', 'payee', 'details'),
+}
+OFX_TAG = re.compile(r'<(/?[A-Za-z0-9.]+)>([^<]*)')
+
+# Rows fetched per step when exporting; memory stays bounded by this
+EXPORT_BATCH_SIZE = 50000
+EXPORT_COLUMNS = ['id', 'type', 'amount', 'date', 'description']
+
+# Columns a bulk update may set
+BULK_UPDATE_COLUMNS = ('type', 'amount', 'date', 'description')
+
+# Longest a write queued on a WriteQueue waits for others to share its commit
+WRITE_FLUSH_MS = 200
+
+INSERT_TRANSACTION = '''INSERT INTO transactions (type, amount, date, iso_date, description)
+                        VALUES (?, ?, ?, ?, ?)'''
+
+# Rollup key expressions over a transactions row; {row} is new/old in
+# triggers or the table name when rebuilding. Dates are stored dd-mm-yyyy.
+DAY_EXPR = "substr({row}.date, 7, 4) || '-' || substr({row}.date, 4, 2) || '-' || substr({row}.date, 1, 2)"
+MONTH_EXPR = "substr({row}.date, 7, 4) || '-' || substr({row}.date, 4, 2)"
+
+# Rollup table -> extra bucket column and its key expression
+ROLLUPS = {
+    'totals_by_type': None,
+    'daily_totals': ('day', DAY_EXPR),
+    'monthly_totals': ('month', MONTH_EXPR),
+}
+
+
+# Closed years can be moved out to read-only files next to the database,
+# attached under PARTITION_PREFIX + year. SQLite attaches at most 10
+# databases per connection unless compiled otherwise.
+PARTITION_PREFIX = 'year_'
+MAX_PARTITIONS = 10
+PARTITION_COLUMNS = "id, type, amount, date, iso_date, description"
+
+
+def connect(path=DEFAULT_DB):
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    return conn
+
+
+def create_schema(conn):
+    # WAL lets readers (exports, reports, the dashboard worker) and one
+    # writer work at the same time; in rollback-journal mode a long read
+    # blocks every commit. The mode is stored in the file.
+    conn.execute("PRAGMA main.journal_mode = WAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS transactions
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, amount REAL, date TEXT, description TEXT)''')
+    conn.commit()
+    migrate(conn)
+    create_rollups(conn)
+    conn.commit()
+    attach_partitions(conn)
+
+
+def to_iso_date(display_date):
+    return datetime.strptime(display_date, DISPLAY_DATE_FORMAT).strftime('%Y-%m-%d')
+
+
+def _migrate_iso_date(conn):
+    # Add an indexed yyyy-mm-dd copy of the display date, backfilled in
+    # batches so large ledgers are not locked in one long transaction
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(transactions)")]
+    if 'iso_date' not in columns:
+        conn.execute("ALTER TABLE transactions ADD COLUMN iso_date TEXT")
+        conn.commit()
+
+    iso_expr = DAY_EXPR.format(row='transactions')
+    last_id = conn.execute("SELECT coalesce(MAX(id), 0) FROM transactions").fetchone()[0]
+    for start in range(0, last_id, MIGRATION_BATCH_SIZE):
+        with conn:
+            conn.execute(f'''UPDATE transactions SET iso_date = {iso_expr}
+                             WHERE id > ? AND id <= ? AND iso_date IS NULL''',
+                         (start, start + MIGRATION_BATCH_SIZE))
+
+    conn.executescript(f'''
+        CREATE INDEX IF NOT EXISTS idx_transactions_iso_date ON transactions (iso_date);
+
+        -- Rows written without iso_date (older clients, manual edits) get it filled in
+        CREATE TRIGGER IF NOT EXISTS iso_date_after_insert AFTER INSERT ON transactions
+        WHEN new.iso_date IS NULL
+        BEGIN
+            UPDATE transactions SET iso_date = {DAY_EXPR.format(row='new')} WHERE id = new.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS iso_date_after_update AFTER UPDATE OF date ON transactions
+        WHEN new.iso_date IS old.iso_date AND new.date IS NOT old.date
+        BEGIN
+            UPDATE transactions SET iso_date = {DAY_EXPR.format(row='new')} WHERE id = new.id;
+        END;
+    ''')
+
+
+FTS_TRIGGERS = {
+    'transactions_fts_after_insert': '''AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO transactions_fts (rowid, description) VALUES (new.id, new.description);
+        END''',
+    'transactions_fts_after_delete': '''AFTER DELETE ON transactions
+        BEGIN
+            INSERT INTO transactions_fts (transactions_fts, rowid, description)
+            VALUES ('delete', old.id, old.description);
+        END''',
+    'transactions_fts_after_update': '''AFTER UPDATE OF description ON transactions
+        BEGIN
+            INSERT INTO transactions_fts (transactions_fts, rowid, description)
+            VALUES ('delete', old.id, old.description);
+            INSERT INTO transactions_fts (rowid, description) VALUES (new.id, new.description);
+        END''',
+}
+
+
+def _migrate_search(conn):
+    # Full-text index over descriptions, stored external-content so the
+    # text is not duplicated
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts
+                    USING fts5(description, content='transactions', content_rowid='id')''')
+    conn.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+    for name, body in FTS_TRIGGERS.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    conn.commit()
+
+
+def _migrate_partitions(conn):
+    # Closed years moved to their own files; empty for a single-file ledger
+    conn.execute('''CREATE TABLE IF NOT EXISTS partitions
+                    (year INTEGER PRIMARY KEY, path TEXT NOT NULL, rows INTEGER NOT NULL)''')
+    conn.commit()
+
+
+def _migrate_type_index(conn):
+    # One (type, id) index gives the type filter keyset pages in id order
+    # without a sort. It replaces three range-filter indexes that every
+    # insert had to update but no query plan used; date ranges use
+    # idx_transactions_iso_date.
+    for name in ('idx_transactions_type_date', 'idx_transactions_type_amount', 'idx_transactions_amount'):
+        conn.execute(f"DROP INDEX IF EXISTS main.{name}")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transactions_type_id ON transactions (type, id)")
+    conn.commit()
+
+
+# Schema migrations in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _migrate_iso_date,
+    _migrate_search,
+    _migrate_partitions,
+    _migrate_type_index,
+]
+
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+
+
+def _key_columns(table):
+    bucket = ROLLUPS[table]
+    return ['type'] if bucket is None else [bucket[0], 'type']
+
+
+def _key_values(table, row):
+    bucket = ROLLUPS[table]
+    type_expr = f"coalesce({row}.type, '')"
+    if bucket is None:
+        return [type_expr]
+    return [bucket[1].format(row=row), type_expr]
+
+
+def _add_to_rollup(table, row):
+    columns = _key_columns(table)
+    return f'''INSERT INTO {table} ({', '.join(columns)}, total, count)
+            VALUES ({', '.join(_key_values(table, row))}, {row}.amount, 1)
+            ON CONFLICT({', '.join(columns)}) DO UPDATE
+            SET total = total + excluded.total, count = count + 1;'''
+
+
+def _remove_from_rollup(table, row):
+    match = ' AND '.join(f'{column} = {value}' for column, value in zip(
+        _key_columns(table), _key_values(table, row)))
+    return f'''UPDATE {table} SET total = total - {row}.amount, count = count - 1
+            WHERE {match};
+            DELETE FROM {table} WHERE {match} AND count <= 0;'''
+
+
+ROLLUP_TRIGGERS = {
+    'rollup_after_insert': f'''AFTER INSERT ON transactions
+        BEGIN
+            {''.join(_add_to_rollup(table, 'new') for table in ROLLUPS)}
+        END''',
+    'rollup_after_delete': f'''AFTER DELETE ON transactions
+        BEGIN
+            {''.join(_remove_from_rollup(table, 'old') for table in ROLLUPS)}
+        END''',
+    'rollup_after_update': f'''AFTER UPDATE OF type, amount, date ON transactions
+        BEGIN
+            {''.join(_remove_from_rollup(table, 'old') for table in ROLLUPS)}
+            {''.join(_add_to_rollup(table, 'new') for table in ROLLUPS)}
+        END''',
+}
+
+
+def _create_rollup_trigger(conn, name):
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {name} {ROLLUP_TRIGGERS[name]}")
+
+
+def create_rollups(conn):
+    # Summary tables kept current by triggers so the dashboard reads a
+    # handful of rows instead of scanning every transaction
+    created = False
+    for table in ROLLUPS:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if not exists:
+            columns = _key_columns(table)
+            conn.execute(f'''CREATE TABLE {table}
+                             ({' TEXT NOT NULL, '.join(columns)} TEXT NOT NULL,
+                              total REAL NOT NULL DEFAULT 0, count INTEGER NOT NULL DEFAULT 0,
+                              PRIMARY KEY ({', '.join(columns)})) WITHOUT ROWID''')
+            created = True
+
+    for name in ROLLUP_TRIGGERS:
+        _create_rollup_trigger(conn, name)
+
+    # Tables created next to an existing ledger start out empty
+    if created:
+        rebuild_rollups(conn)
+
+
+def _rollup_query(table, where="WHERE 1", source="transactions"):
+    columns = ', '.join(_key_values(table, 'transactions'))
+    return f'''SELECT {columns}, SUM(amount), COUNT(*) FROM {source} {where}
+               GROUP BY {', '.join(str(i + 1) for i in range(len(_key_columns(table))))}'''
+
+
+def add_to_rollups(conn, after_id):
+    # Fold rows with id > after_id into the rollups; used when rows were
+    # inserted with the insert trigger suspended. The new rows are scanned
+    # once into per-day buckets and the coarser rollups are built from those.
+    conn.execute("DROP TABLE IF EXISTS temp.new_daily_totals")
+    conn.execute(
+        "CREATE TEMP TABLE new_daily_totals (day TEXT, type TEXT, total REAL, count INTEGER)")
+    conn.execute(f'''INSERT INTO temp.new_daily_totals
+                     {_rollup_query('daily_totals', "WHERE id > ?")}''', (after_id,))
+    sources = {
+        'daily_totals': "SELECT * FROM temp.new_daily_totals",
+        'monthly_totals': '''SELECT substr(day, 1, 7), type, SUM(total), SUM(count)
+                             FROM temp.new_daily_totals GROUP BY 1, 2''',
+        'totals_by_type': '''SELECT type, SUM(total), SUM(count)
+                             FROM temp.new_daily_totals GROUP BY 1''',
+    }
+    for table, source in sources.items():
+        columns = ', '.join(_key_columns(table))
+        conn.execute(f'''INSERT INTO {table} ({columns}, total, count)
+                         SELECT * FROM ({source}) WHERE 1
+                         ON CONFLICT({columns}) DO UPDATE
+                         SET total = total + excluded.total, count = count + excluded.count''')
+    conn.execute("DROP TABLE temp.new_daily_totals")
+
+
+def rebuild_rollups(conn):
+    # Rollups cover closed-year partitions as well as the main table
+    source = build_filter(partitions=attached_partitions(conn))[0]
+    with conn:
+        for table in ROLLUPS:
+            columns = _key_columns(table)
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f'''INSERT INTO {table} ({', '.join(columns)}, total, count)
+                             {_rollup_query(table, source=source)}''')
+
+
+def verify_rollups(conn, tolerance=1e-9):
+    # Recompute every rollup from the raw table and report differing buckets;
+    # totals are compared with a relative tolerance since summation order
+    # differs between incremental updates and a fresh SUM
+    drift = []
+    source = build_filter(partitions=attached_partitions(conn))[0]
+    for table in ROLLUPS:
+        width = len(_key_columns(table))
+        expected = {row[:width]: row[width:]
+                    for row in conn.execute(_rollup_query(table, source=source))}
+        stored = {row[:width]: row[width:] for row in conn.execute(
+            f"SELECT {', '.join(_key_columns(table))}, total, count FROM {table}")}
+        for key in expected.keys() | stored.keys():
+            want = expected.get(key, (0.0, 0))
+            have = stored.get(key, (0.0, 0))
+            if want[1] != have[1] or not math.isclose(want[0], have[0], rel_tol=tolerance, abs_tol=1e-6):
+                drift.append((table, key, want, have))
+    return drift
+
+
+def read_totals(cursor):
+    cursor.execute("SELECT type, total FROM totals_by_type")
+    return dict(cursor.fetchall())
+
+
+def fetch_page(cursor, limit, after_id=None, before_id=None, inclusive=False, offset=0, **filters):
+    # One keyset page of COLUMNS rows in id order: the rows following
+    # after_id (starting at it when inclusive), the rows preceding before_id,
+    # or the first page when neither is given. offset skips that many rows
+    # of a forward page, which costs a step per row skipped; it is for
+    # jumping to a position, not for paging. filters are build_filter's.
+    partitions = attached_partitions(cursor)
+    if before_id is not None:
+        source, key, where, params = build_filter(
+            **filters, keyset="{key} < ?", keyset_params=(before_id,), partitions=partitions)
+        cursor.execute(f"SELECT {COLUMNS} FROM {source} {where} ORDER BY {key} DESC LIMIT ?",
+                       (*params, limit))
+        return cursor.fetchall()[::-1]
+    if after_id is None:
+        source, key, where, params = build_filter(**filters, partitions=partitions)
+    else:
+        source, key, where, params = build_filter(**filters, keyset=f"{{key}} {'>=' if inclusive else '>'} ?",
+                                                  keyset_params=(after_id,), partitions=partitions)
+    cursor.execute(f"SELECT {COLUMNS} FROM {source} {where} ORDER BY {key} LIMIT ? OFFSET ?",
+                   (*params, limit, offset))
+    return cursor.fetchall()
+
+
+def has_rows_before(cursor, transaction_id, **filters):
+    source, _, where, params = build_filter(
+        **filters, keyset="{key} < ?", keyset_params=(transaction_id,),
+        partitions=attached_partitions(cursor))
+    cursor.execute(f"SELECT 1 FROM {source} {where} LIMIT 1", params)
+    return cursor.fetchone() is not None
+
+
+def matches_filter(cursor, transaction_id, **filters):
+    source, _, where, params = build_filter(
+        **filters, keyset="{key} = ?", keyset_params=(transaction_id,),
+        partitions=attached_partitions(cursor))
+    cursor.execute(f"SELECT 1 FROM {source} {where}", params)
+    return cursor.fetchone() is not None
+
+
+def fetch_transaction(cursor, transaction_id):
+    source, _, where, params = build_filter(
+        keyset="{key} = ?", keyset_params=(transaction_id,),
+        partitions=attached_partitions(cursor))
+    cursor.execute(f"SELECT {COLUMNS} FROM {source} {where}", params)
+    return cursor.fetchone()
+
+
+def _check_amount(amount):
+    # The rollup triggers add amounts into NOT NULL totals
+    if amount is None:
+        raise ValueError("a transaction needs an amount")
+
+
+def insert_transaction(cursor, ttype, amount, date, description):
+    # date is in the display format; returns the new row id
+    _check_amount(amount)
+    cursor.execute(INSERT_TRANSACTION,
+                   (ttype, amount, date, to_iso_date(date), description))
+    return cursor.lastrowid
+
+
+def update_transaction(cursor, transaction_id, ttype, amount, date, description):
+    _check_amount(amount)
+    cursor.execute("UPDATE transactions SET type = ?, amount = ?, date = ?, iso_date = ?, description = ? WHERE id = ?",
+                   (ttype, amount, date, to_iso_date(date), description, transaction_id))
+
+
+def delete_transaction(cursor, transaction_id):
+    cursor.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
+
+
+def save_transaction(cursor, transaction_id, ttype, amount, date, description):
+    # Insert a transaction, or update it when transaction_id is set.
+    # Returns (old row or None, new row).
+    if not transaction_id:
+        transaction_id = insert_transaction(
+            cursor, ttype, amount, date, description)
+        return None, (transaction_id, ttype, amount, date, description)
+    old_row = fetch_transaction(cursor, transaction_id)
+    if old_row is None:
+        raise ValueError(f"transaction {transaction_id} no longer exists")
+    update_transaction(cursor, transaction_id,
+                       ttype, amount, date, description)
+    if cursor.rowcount == 0:
+        raise ValueError(f"transaction {transaction_id} is in a closed year and is read-only")
+    return old_row, (transaction_id, ttype, amount, date, description)
+
+
+def remove_transaction(cursor, transaction_id):
+    # Delete a transaction; returns the deleted row, or None if there was none
+    row = fetch_transaction(cursor, transaction_id)
+    if row is not None:
+        delete_transaction(cursor, transaction_id)
+        if cursor.rowcount == 0:
+            raise ValueError(f"transaction {transaction_id} is in a closed year and is read-only")
+    return row
+
+
+def fetch_transactions(cursor, ids, **filters):
+    # The rows among ids that still match filters
+    placeholders = ', '.join('?' * len(ids))
+    source, key, where, params = build_filter(
+        keyset=f"{{key}} IN ({placeholders})", keyset_params=ids,
+        partitions=attached_partitions(cursor), **filters)
+    cursor.execute(f"SELECT {COLUMNS} FROM {source} {where}", params)
+    return cursor.fetchall()
+
+
+def count_transactions(cursor, before_id=None, **filters):
+    # Rows matching filters, or only those with an id below before_id
+    if before_id is None and all(value is None for name, value in filters.items() if name != 'ttype'):
+        # The rollups count every row, closed years included
+        ttype = filters.get('ttype')
+        where, params = ("WHERE type = ?", (ttype,)) if ttype is not None else ("", ())
+        cursor.execute(f"SELECT coalesce(SUM(count), 0) FROM totals_by_type {where}", params)
+        return cursor.fetchone()[0]
+    if before_id is not None:
+        filters.update(keyset="{key} < ?", keyset_params=(before_id,))
+    source, _, where, params = build_filter(
+        partitions=attached_partitions(cursor), **filters)
+    cursor.execute(f"SELECT COUNT(*) FROM {source} {where}", params)
+    return cursor.fetchone()[0]
+
+
+def _select_transactions(cursor, ids, filters):
+    # Fill temp.selected_ids with ids, or when ids is None with every id
+    # matching filters (build_filter keywords; {} selects the whole table)
+    if ids is None and filters is None:
+        raise ValueError("either ids or filters is required")
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS selected_ids (id INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM selected_ids")
+    if ids is None:
+        source, key, where, params = build_filter(
+            partitions=attached_partitions(cursor), **filters)
+        cursor.execute(
+            f"INSERT INTO selected_ids SELECT {key} FROM {source} {where}", params)
+    else:
+        cursor.executemany("INSERT OR IGNORE INTO selected_ids VALUES (?)",
+                           [(transaction_id,) for transaction_id in ids])
+
+
+def _selected_totals(cursor):
+    cursor.execute('''SELECT type, SUM(amount) FROM transactions
+                      WHERE id IN (SELECT id FROM selected_ids) GROUP BY type''')
+    return dict(cursor.fetchall())
+
+
+def _selected_read_only(cursor):
+    # How many selected ids are in closed-year partitions
+    read_only = 0
+    for schema, _ in attached_partitions(cursor):
+        cursor.execute(f'''SELECT COUNT(*) FROM {schema}.transactions
+                           WHERE id IN (SELECT id FROM selected_ids)''')
+        read_only += cursor.fetchone()[0]
+    return read_only
+
+
+def delete_transactions(cursor, ids=None, filters=None):
+    # Delete the given ids, or every transaction matching filters, with one
+    # statement. Rows in closed-year partitions are left alone. Returns
+    # (rows deleted, rows left alone as read-only, {type: change in total}).
+    _select_transactions(cursor, ids, filters)
+    removed = _selected_totals(cursor)
+    cursor.execute(
+        "DELETE FROM transactions WHERE id IN (SELECT id FROM selected_ids)")
+    deleted = cursor.rowcount
+    return deleted, _selected_read_only(cursor), {ttype: -total for ttype, total in removed.items()}
+
+
+def update_transactions(cursor, changes, ids=None, filters=None):
+    # Set the columns in changes (any of BULK_UPDATE_COLUMNS; dates in the
+    # display format) on the given ids, or on every transaction matching
+    # filters, with one statement. Rows in closed-year partitions are left
+    # alone. Returns (rows updated, rows left alone as read-only,
+    # {type: change in total}).
+    unknown = set(changes) - set(BULK_UPDATE_COLUMNS)
+    if unknown or not changes:
+        raise ValueError(f"cannot bulk update {', '.join(sorted(unknown)) or 'nothing'}")
+    assignments = [f"{column} = ?" for column in changes]
+    params = list(changes.values())
+    if 'date' in changes:
+        assignments.append("iso_date = ?")
+        params.append(to_iso_date(changes['date']))
+
+    _select_transactions(cursor, ids, filters)
+    before = _selected_totals(cursor)
+    cursor.execute(f'''UPDATE transactions SET {', '.join(assignments)}
+                       WHERE id IN (SELECT id FROM selected_ids)''', params)
+    updated = cursor.rowcount
+    after = _selected_totals(cursor)
+    return updated, _selected_read_only(cursor), {ttype: after.get(ttype, 0.0) - before.get(ttype, 0.0)
+                     for ttype in before.keys() | after.keys()}
+
+
+class WriteQueue(threading.Thread):
+    # Applies writes on its own thread and connection so callers never wait
+    # on a commit. Writes that arrive within flush_ms of the first pending
+    # one are committed together in a single WAL transaction. Each write
+    # runs in a savepoint, so a failing write does not undo the others.
+    # Once the commit succeeds, (token, result or raised exception) pairs
+    # are put on self.results; if the commit itself fails, every write in
+    # it reports that error. Commits are timed when given a
+    # finance_profiler.Profiler.
+    #
+    # If the thread dies of an unexpected error, every write it had not
+    # answered, and every write submitted afterwards, reports that error.
+    #
+    # Durability: a write is only in memory until its commit, at most
+    # flush_ms after it was submitted; stop() commits everything queued.
+    # Committed writes survive the app crashing. With synchronous = NORMAL,
+    # a power loss or OS crash can roll back the most recent commits, but
+    # it never corrupts the database.
+    def __init__(self, db_path, flush_ms=WRITE_FLUSH_MS, profiler=None):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.flush_ms = flush_ms
+        self.profiler = profiler
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.tokens = itertools.count(1)
+        # The exception that ended the thread, if one did
+        self.failure = None
+
+    def submit(self, function, *args):
+        # Queue function(cursor, *args); returns the token its result is
+        # reported under
+        token = next(self.tokens)
+        self.requests.put((token, function, args))
+        if self.failure is not None:
+            self._fail_queued()
+        return token
+
+    def stop(self):
+        # Commit whatever is queued, then end the thread
+        self.requests.put(None)
+        self.join()
+
+    def _fail_queued(self):
+        # Answer every queued write with the error that ended the thread
+        while True:
+            try:
+                item = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, tuple):
+                self.results.put((item[0], self.failure))
+
+    def run(self):
+        writes = []
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute("PRAGMA synchronous = NORMAL")
+                attach_partitions(conn)
+                while True:
+                    item = self.requests.get()
+                    deadline = time.monotonic() + self.flush_ms / 1000
+                    writes = []
+                    while isinstance(item, tuple):
+                        writes.append(item)
+                        try:
+                            item = self.requests.get(
+                                timeout=max(0.0, deadline - time.monotonic()))
+                        except queue.Empty:
+                            item = False
+                    started = time.perf_counter()
+                    results = self._commit(conn, writes)
+                    writes = []
+                    for result in results:
+                        self.results.put(result)
+                    if results and self.profiler:
+                        self.profiler.record('commit', f"COMMIT ({len(results)} queued writes)",
+                                             time.perf_counter() - started, len(results), 'WriteQueue')
+                    if item is None:
+                        return
+            finally:
+                conn.close()
+        except Exception as e:
+            self.failure = e
+            for token, _, _ in writes:
+                self.results.put((token, e))
+            self._fail_queued()
+
+    def _commit(self, conn, writes):
+        # Run and commit writes; returns their (token, result) pairs
+        if not writes:
+            return []
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.cursor()
+            for token, function, args in writes:
+                conn.execute("SAVEPOINT write")
+                try:
+                    results.append((token, function(cursor, *args)))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    results.append((token, e))
+                conn.execute("RELEASE write")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            results = [(token, e) for token, _, _ in writes]
+        return results
+
+
+def iter_csv_rows(file):
+    # (type, amount, date, description) strings from a CSV statement with a
+    # header row; type and description are optional columns
+    reader = csv.reader(file)
+    header = [name.strip().lower() for name in next(reader, [])]
+    positions = {}
+    for field, names in CSV_HEADERS.items():
+        for name in names:
+            if name in header:
+                positions[field] = header.index(name)
+                break
+    missing = {'amount', 'date'} - positions.keys()
+    if missing:
+        raise ValueError(
+            f"CSV header has no {' or '.join(sorted(missing))} column")
+
+    # Absent optional columns read the empty string appended to each record
+    fields = itemgetter(*(positions.get(field, -1) for field in (
+        'type', 'amount', 'date', 'description')))
+    for record in reader:
+        record.append('')
+        try:
+            yield fields(record)
+        except IndexError:
+            # Short record; rejected by normalize_rows
+            yield ('', '', '', '')
+
+
+def iter_ofx_rows(file):
+    # (type, amount, date, description) strings from the STMTTRN blocks of
+    # an OFX/QFX file, read line by line (SGML or XML flavour)
+    current = None
+    for line in file:
+        for tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                current = {}
+            elif tag == '/STMTTRN' and current is not None:
+                yield (current.get('TRNTYPE', ''), current.get('TRNAMT', ''),
+                       current.get('DTPOSTED', '')[:8],
+                       current.get('NAME') or current.get('MEMO', ''))
+                current = None
+            elif current is not None and not tag.startswith('/'):
+                current[tag] = value.strip()
+
+
+def _parse_amount(text):
+    # None for text that is not a finite amount; float() alone would accept
+    # "nan" and "inf", which would poison every total they are added to
+    try:
+        amount = float(text)
+    except ValueError:
+        match = AMOUNT_RE.fullmatch(text.strip())
+        if match is None:
+            return None
+        opening, sign, inner_sign, digits, closing = match.groups()
+        # At most one of a leading sign, a sign after the symbol or parentheses
+        if bool(opening) != bool(closing) or len(sign + inner_sign + (opening or '')) > 1:
+            return None
+        sign = sign or inner_sign
+        amount = float(digits.replace(',', ''))
+        if opening or sign == '-':
+            amount = -amount
+    return amount if math.isfinite(amount) else None
+
+
+def _parse_date(text, cache, formats=IMPORT_DATE_FORMATS):
+    # Statements repeat the same few dates, so parses are memoised;
+    # unparseable dates are cached as False. The cache must only be shared
+    # between calls with the same formats.
+    dates = cache.get(text)
+    if dates is None:
+        dates = False
+        for fmt in formats:
+            try:
+                parsed = datetime.strptime(text.strip(), fmt)
+            except ValueError:
+                continue
+            dates = (parsed.strftime(DISPLAY_DATE_FORMAT),
+                     parsed.strftime('%Y-%m-%d'))
+            break
+        cache[text] = dates
+    return dates
+
+
+def normalize_rows(rows, date_cache, date_formats=IMPORT_DATE_FORMATS):
+    # Validate a batch of raw statement rows into INSERT_TRANSACTION
+    # parameters; returns (valid rows, number rejected)
+    valid = []
+    rejected = 0
+    for ttype, amount_text, date_text, description in rows:
+        amount = _parse_amount(amount_text)
+        dates = _parse_date(date_text, date_cache, date_formats)
+        if amount is None or not dates:
+            rejected += 1
+            continue
+        kind = ttype.strip().lower()
+        if kind in INCOME_TYPES:
+            ttype = 'Income'
+        elif kind in EXPENSE_TYPES:
+            ttype = 'Expense'
+        else:
+            ttype = 'Expense' if amount < 0 else 'Income'
+        valid.append((ttype, abs(amount), dates[0],
+                     dates[1], description.strip()))
+    return valid, rejected
+
+
+def bulk_insert(conn, batches):
+    # Insert batches of INSERT_TRANSACTION parameter tuples in a single
+    # transaction under WAL. Returns the number of rows inserted.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute(f"PRAGMA cache_size = {-IMPORT_CACHE_KIB}")
+
+    batches = iter(batches)
+    inserted = 0
+    conn.execute("BEGIN")
+    try:
+        # Per-row insert triggers dominate bulk inserts: iso_date is always
+        # supplied, and the new rows are folded into the rollups and the
+        # search index with grouped passes at the end. Large imports also
+        # drop the secondary indexes and build them again from the full
+        # table. DDL is transactional, so a failure restores the triggers
+        # and indexes on rollback.
+        last_id, rows = conn.execute(
+            "SELECT coalesce(MAX(id), 0), COUNT(*) FROM transactions").fetchone()
+        suspended = _drop_triggers(
+            conn, ('rollup_after_insert', 'iso_date_after_insert', 'transactions_fts_after_insert'))
+        first = next(batches, [])
+        if first and len(first) >= rows * INDEX_REBUILD_FRACTION:
+            suspended += _drop_indexes(conn)
+        for batch in itertools.chain([first], batches):
+            conn.executemany(INSERT_TRANSACTION, batch)
+            inserted += len(batch)
+        add_to_rollups(conn, last_id)
+        conn.execute('''INSERT INTO transactions_fts (rowid, description)
+                        SELECT id, description FROM transactions WHERE id > ?''', (last_id,))
+        for sql in suspended:
+            conn.execute(sql)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute(f"PRAGMA cache_size = {cache_size}")
+    return inserted
+
+
+def _drop_triggers(conn, names):
+    # Drop triggers inside the current transaction and return their CREATE
+    # statements for the caller to run again before committing; DDL is
+    # transactional, so a rollback restores them as well
+    suspended = conn.execute(f'''SELECT name, sql FROM sqlite_master WHERE type = 'trigger'
+                                 AND name IN ({', '.join('?' * len(names))})''', names).fetchall()
+    for name, _ in suspended:
+        conn.execute(f"DROP TRIGGER {name}")
+    return [sql for _, sql in suspended]
+
+
+def _drop_indexes(conn):
+    # Drop the transactions table's secondary indexes inside the current
+    # transaction and return their CREATE statements, as _drop_triggers does
+    suspended = conn.execute('''SELECT name, sql FROM main.sqlite_master WHERE type = 'index'
+                                AND tbl_name = 'transactions' AND sql IS NOT NULL''').fetchall()
+    for name, _ in suspended:
+        conn.execute(f"DROP INDEX main.{name}")
+    return [sql for _, sql in suspended]
+
+
+def attached_partitions(cursor):
+    # [(schema, year)] for the closed-year partitions attached to the
+    # connection behind cursor (or to cursor itself when it is a connection)
+    conn = getattr(cursor, 'connection', cursor)
+    return [(name, int(name[len(PARTITION_PREFIX):]))
+            for _, name, _ in conn.execute("PRAGMA database_list")
+            if name.startswith(PARTITION_PREFIX)]
+
+
+def _main_file(conn):
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return path
+
+
+def attach_partitions(conn):
+    # ATTACH every closed-year partition listed in the partitions table;
+    # done whenever a database is opened through create_schema
+    attached = {year for _, year in attached_partitions(conn)}
+    for year, path in conn.execute("SELECT year, path FROM partitions ORDER BY year").fetchall():
+        if year in attached:
+            continue
+        path = os.path.join(os.path.dirname(_main_file(conn)), path)
+        # ATTACH would silently create an empty file in its place
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"partition for {year} is missing: {path}")
+        conn.execute(f"ATTACH DATABASE ? AS {PARTITION_PREFIX}{year}", (path,))
+
+
+def partition_path(conn, year):
+    main_file = _main_file(conn)
+    if not main_file:
+        raise ValueError("partitions need a database file")
+    stem, extension = os.path.splitext(main_file)
+    return f"{stem}-{year}{extension or '.db'}"
+
+
+def _remove_database_file(path):
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.chmod(path + suffix, stat.S_IREAD | stat.S_IWRITE)
+            os.remove(path + suffix)
+
+
+def close_year(conn, year):
+    # Move one finished year's transactions into their own file, which is
+    # written once, VACUUMed, made read-only and attached from then on.
+    # Ids, rollups and search results are unchanged. Rows for the year added
+    # later stay in the main table. Returns the number of rows moved.
+    if year >= datetime.now().year:
+        raise ValueError(f"{year} has not finished yet")
+    if conn.execute("SELECT 1 FROM partitions WHERE year = ?", (year,)).fetchone():
+        raise ValueError(f"{year} is already closed")
+    if conn.execute("SELECT COUNT(*) FROM partitions").fetchone()[0] >= MAX_PARTITIONS:
+        raise RuntimeError(f"at most {MAX_PARTITIONS} years can be closed; reopen one first")
+    path = partition_path(conn, year)
+    first, last = f"{year}-01-01", f"{year}-12-31"
+    schema = f"{PARTITION_PREFIX}{year}"
+    conn.commit()
+
+    # Main is in WAL mode, where a transaction spanning two files is not
+    # atomic, so the copy is committed first and only then are the rows
+    # removed from main and the partition registered. A file left behind
+    # by an interrupted close was never registered and is replaced.
+    _remove_database_file(path)
+    conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+    try:
+        conn.execute(f'''CREATE TABLE {schema}.transactions
+                         (id INTEGER PRIMARY KEY, type TEXT, amount REAL, date TEXT, iso_date TEXT, description TEXT)''')
+        conn.execute(f'''INSERT INTO {schema}.transactions
+                         SELECT {PARTITION_COLUMNS} FROM main.transactions
+                         WHERE iso_date BETWEEN ? AND ? ORDER BY id''', (first, last))
+        # Same indexes as the main table
+        for name, sql in conn.execute('''SELECT name, sql FROM main.sqlite_master
+                                         WHERE type = 'index' AND tbl_name = 'transactions'
+                                         AND sql IS NOT NULL''').fetchall():
+            conn.execute(sql.replace(f"INDEX {name}", f"INDEX {schema}.{name}", 1))
+        conn.execute(f'''CREATE VIRTUAL TABLE {schema}.transactions_fts
+                         USING fts5(description, content='transactions', content_rowid='id')''')
+        conn.execute(
+            f"INSERT INTO {schema}.transactions_fts (transactions_fts) VALUES ('rebuild')")
+        conn.commit()
+        conn.execute(f"VACUUM {schema}")
+    finally:
+        conn.execute(f"DETACH DATABASE {schema}")
+    os.chmod(path, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+    conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Only remove rows that are still exactly what was copied
+        copied, unchanged = conn.execute(f'''
+            SELECT (SELECT COUNT(*) FROM {schema}.transactions), COUNT(*)
+            FROM main.transactions AS m JOIN {schema}.transactions AS p ON p.id = m.id
+            WHERE m.type IS p.type AND m.amount IS p.amount AND m.date IS p.date
+            AND m.iso_date IS p.iso_date AND m.description IS p.description''').fetchone()
+        if copied != unchanged:
+            raise RuntimeError(f"transactions from {year} changed while closing it; try again")
+        # The rows still count towards the rollups, so only the search
+        # index follows the delete
+        suspended = _drop_triggers(conn, ('rollup_after_delete',))
+        conn.execute(
+            f"DELETE FROM main.transactions WHERE id IN (SELECT id FROM {schema}.transactions)")
+        for sql in suspended:
+            conn.execute(sql)
+        conn.execute("INSERT INTO partitions (year, path, rows) VALUES (?, ?, ?)",
+                     (year, os.path.basename(path), copied))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        conn.execute(f"DETACH DATABASE {schema}")
+        _remove_database_file(path)
+        raise
+    return copied
+
+
+def reopen_year(conn, year):
+    # Move a closed year's transactions back into the main table and delete
+    # its partition file. Returns the number of rows moved.
+    row = conn.execute(
+        "SELECT path FROM partitions WHERE year = ?", (year,)).fetchone()
+    if row is None:
+        raise ValueError(f"{year} is not closed")
+    schema = f"{PARTITION_PREFIX}{year}"
+    path = os.path.join(os.path.dirname(_main_file(conn)), row[0])
+    conn.commit()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        suspended = _drop_triggers(conn, ('rollup_after_insert',))
+        moved = conn.execute(f'''INSERT INTO main.transactions ({PARTITION_COLUMNS})
+                                 SELECT {PARTITION_COLUMNS} FROM {schema}.transactions''').rowcount
+        for sql in suspended:
+            conn.execute(sql)
+        conn.execute("DELETE FROM partitions WHERE year = ?", (year,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.execute(f"DETACH DATABASE {schema}")
+    _remove_database_file(path)
+    return moved
+
+
+def import_statement(conn, path, fmt=None, batch_size=IMPORT_BATCH_SIZE, progress=None,
+                     date_format=None):
+    # Stream a CSV or OFX statement into the transactions table in one
+    # transaction. date_format is the strptime format of a CSV file's
+    # dates; by default any of IMPORT_DATE_FORMATS is accepted. progress(
+    # imported, rejected, bytes_read, total_bytes) is called after every
+    # batch. Returns (imported, rejected).
+    if fmt is None:
+        fmt = 'ofx' if path.lower().endswith(('.ofx', '.qfx')) else 'csv'
+    if fmt == 'ofx':
+        date_formats = (OFX_DATE_FORMAT,)
+    else:
+        date_formats = (date_format,) if date_format else IMPORT_DATE_FORMATS
+    total_bytes = os.path.getsize(path)
+    counts = {'imported': 0, 'rejected': 0}
+
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as file:
+        rows = iter_ofx_rows(file) if fmt == 'ofx' else iter_csv_rows(file)
+
+        def batches():
+            date_cache = {}
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    return
+                valid, rejected = normalize_rows(batch, date_cache, date_formats)
+                yield valid
+                counts['imported'] += len(valid)
+                counts['rejected'] += rejected
+                if progress:
+                    progress(counts['imported'], counts['rejected'],
+                             file.buffer.tell(), total_bytes)
+
+        bulk_insert(conn, batches())
+    return counts['imported'], counts['rejected']
+
+
+def fts_query(text):
+    # Every word of the search text as a quoted prefix term, so typing
+    # "groc sto" matches "Grocery store"; None when there are no words
+    terms = ['"' + word.replace('"', '""') + '"*' for word in text.split()]
+    return ' '.join(terms) or None
+
+
+def build_filter(ttype=None, start=None, end=None, min_amount=None, max_amount=None, text=None,
+                 keyset=None, keyset_params=(), partitions=()):
+    # (source, key, where, params) for the optional transaction filters:
+    # the FROM clause, the id column to order and page by, and the WHERE
+    # clause. Dates are inclusive yyyy-mm-dd bounds on the indexed iso_date
+    # column. With search text the FTS index drives the query in rowid order,
+    # so a page stops after its limit instead of collecting every match; the
+    # CROSS JOIN keeps SQLite from starting at the type index and running the
+    # MATCH once per row of that type instead.
+    # keyset is an extra condition on {key}, e.g. "{key} > ?". partitions
+    # are attached_partitions(); see _partition_source.
+    query = fts_query(text) if text else None
+    if partitions:
+        source, params = _partition_source(partitions, start, end, query)
+        key = "transactions.id"
+        conditions = []
+    elif query:
+        source = "transactions_fts CROSS JOIN transactions ON transactions.id = transactions_fts.rowid"
+        key = "transactions_fts.rowid"
+        conditions = ["transactions_fts MATCH ?"]
+        params = [query]
+    else:
+        source = "transactions"
+        key = "transactions.id"
+        conditions = []
+        params = []
+    if keyset:
+        conditions.append(keyset.format(key=key))
+        params.extend(keyset_params)
+    if ttype:
+        conditions.append("type = ?")
+        params.append(ttype)
+    if start:
+        conditions.append("iso_date >= ?")
+        params.append(start)
+    if end:
+        conditions.append("iso_date <= ?")
+        params.append(end)
+    if min_amount is not None:
+        conditions.append("amount >= ?")
+        params.append(min_amount)
+    if max_amount is not None:
+        conditions.append("amount <= ?")
+        params.append(max_amount)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return source, key, where, params
+
+
+def _partition_source(partitions, start, end, query):
+    # The main table and every closed-year partition overlapping the
+    # start/end range as one UNION ALL subquery named transactions. Each
+    # branch is read in id order, so SQLite merges them for keyset pages
+    # without sorting; years outside the range are left out entirely.
+    schemas = ['main'] + [schema for schema, year in partitions
+                          if (not start or f"{year}-12-31" >= start) and (not end or f"{year}-01-01" <= end)]
+    if query:
+        branch = '''SELECT f.rowid AS id, t.type, t.amount, t.date, t.iso_date, t.description
+                    FROM {schema}.transactions_fts AS f CROSS JOIN {schema}.transactions AS t ON t.id = f.rowid
+                    WHERE f.transactions_fts MATCH ?'''
+    else:
+        branch = f"SELECT {PARTITION_COLUMNS} FROM {{schema}}.transactions WHERE 1"
+    branches = []
+    params = []
+    for schema in schemas:
+        branches.append(branch.format(schema=schema))
+        if query:
+            params.append(query)
+        if schema == 'main' and (start or end):
+            # Main holds any date, so it cannot be pruned by year; this
+            # constant check, evaluated once, skips it when it has nothing
+            # in range instead of walking it in id order
+            bounds = [bound for bound in (start and "iso_date >= ?", end and "iso_date <= ?") if bound]
+            branches[-1] += f''' AND EXISTS (SELECT 1 FROM main.transactions
+                                             WHERE {' AND '.join(bounds)})'''
+            params.extend(bound for bound in (start, end) if bound)
+    return f"({' UNION ALL '.join(branches)}) AS transactions", params
+
+
+def iter_transaction_batches(conn, batch_size=EXPORT_BATCH_SIZE, **filters):
+    # Lists of (id, type, amount, iso_date, description) rows in id order,
+    # stepped through one cursor so only one batch is held at a time
+    source, key, where, params = build_filter(
+        partitions=attached_partitions(conn), **filters)
+    cursor = conn.cursor()
+    cursor.execute(f'''SELECT transactions.id, type, amount, iso_date, transactions.description
+                       FROM {source} {where} ORDER BY {key}''', params)
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+    finally:
+        cursor.close()
+
+
+def _write_csv(path, batches, progress):
+    exported = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(EXPORT_COLUMNS)
+        for batch in batches:
+            writer.writerows(batch)
+            exported += len(batch)
+            if progress:
+                progress(exported)
+    return exported
+
+
+def _write_parquet(path, batches, progress):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs the pyarrow package") from None
+
+    schema = pa.schema([('id', pa.int64()), ('type', pa.string()), ('amount', pa.float64()),
+                        ('date', pa.date32()), ('description', pa.string())])
+    exported = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            ids, types, amounts, dates, descriptions = zip(*batch)
+            dates = pa.array(dates, pa.string()).cast(pa.timestamp('s')).cast(pa.date32())
+            writer.write_batch(pa.record_batch(
+                [pa.array(ids, pa.int64()), pa.array(types, pa.string()),
+                 pa.array(amounts, pa.float64()), dates, pa.array(descriptions, pa.string())],
+                schema=schema))
+            exported += len(batch)
+            if progress:
+                progress(exported)
+    return exported
+
+
+def export_transactions(conn, path, fmt=None, batch_size=EXPORT_BATCH_SIZE, progress=None, **filters):
+    # Write the (filtered) ledger to CSV or Parquet with yyyy-mm-dd dates.
+    # progress(exported) is called after every batch. Returns the row count.
+    if fmt is None:
+        fmt = 'parquet' if path.lower().endswith('.parquet') else 'csv'
+    batches = iter_transaction_batches(conn, batch_size, **filters)
+    if fmt == 'parquet':
+        return _write_parquet(path, batches, progress)
+    return _write_csv(path, batches, progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Maintenance commands for the finance database")
+    parser.add_argument('--db', default=DEFAULT_DB,
+                        help="path to the SQLite database")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rollups = commands.add_parser(
+        'rollups', help="recompute or check the dashboard rollup tables")
+    rollups.add_argument('action', choices=['verify', 'rebuild'])
+
+    importer = commands.add_parser(
+        'import', help="bulk import a CSV or OFX bank statement")
+    importer.add_argument('path')
+    importer.add_argument('--format', choices=['csv', 'ofx'],
+                          help="file format (default: from the file extension)")
+    importer.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    importer.add_argument('--date-format', metavar='FORMAT',
+                          help="strptime format of a CSV file's dates, e.g. %%m/%%d/%%Y for US "
+                               "statements (default: any usual format, with dd/mm/yyyy for slashed dates)")
+
+    exporter = commands.add_parser(
+        'export', help="export the ledger to CSV or Parquet")
+    exporter.add_argument('path')
+    exporter.add_argument('--format', choices=['csv', 'parquet'],
+                          help="file format (default: from the file extension)")
+    exporter.add_argument('--type', choices=['Income', 'Expense'])
+    exporter.add_argument('--from', dest='start', metavar='YYYY-MM-DD',
+                          help="first date to include")
+    exporter.add_argument('--to', dest='end', metavar='YYYY-MM-DD',
+                          help="last date to include")
+    exporter.add_argument('--search', help="words the description must contain")
+    exporter.add_argument('--min-amount', type=float)
+    exporter.add_argument('--max-amount', type=float)
+    exporter.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+
+    partition = commands.add_parser(
+        'partition', help="move finished years to read-only files, or back")
+    partition.add_argument('action', choices=['list', 'close', 'reopen'])
+    partition.add_argument('years', type=int, nargs='*')
+    partition.add_argument('--through', type=int, metavar='YEAR',
+                           help="with close: every finished, still open year up to and including YEAR")
+
+    args = parser.parse_args(argv)
+    conn = connect(args.db)
+
+    if args.command == 'rollups':
+        if args.action == 'rebuild':
+            rebuild_rollups(conn)
+            print("Rollups rebuilt.")
+            return 0
+        drift = verify_rollups(conn)
+        for table, key, want, have in drift:
+            print(f"{table} {key}: expected total={want[0]:.2f} count={want[1]}, "
+                  f"stored total={have[0]:.2f} count={have[1]}")
+        print("Rollups match the transactions table." if not drift
+              else f"{len(drift)} rollup bucket(s) drifted; run 'rollups rebuild'.")
+        return 1 if drift else 0
+
+    if args.command == 'import':
+        started = time.perf_counter()
+
+        def report(imported, rejected, done, total):
+            percent = 100 * done / total if total else 100
+            print(f"\rImported {imported} rows, rejected {rejected} ({percent:.0f}%)",
+                  end='', file=sys.stderr, flush=True)
+
+        imported, rejected = import_statement(conn, args.path, args.format,
+                                              args.batch_size, report, args.date_format)
+        elapsed = time.perf_counter() - started
+        print(file=sys.stderr)
+        print(f"Imported {imported} rows ({rejected} rejected) in {elapsed:.1f}s"
+              f" ({imported / max(elapsed, 1e-9):.0f} rows/s).")
+        return 0
+
+    if args.command == 'export':
+        started = time.perf_counter()
+        exported = export_transactions(
+            conn, args.path, args.format, args.batch_size,
+            lambda exported: print(f"\rExported {exported} rows", end='',
+                                   file=sys.stderr, flush=True),
+            ttype=args.type, start=args.start, end=args.end,
+            min_amount=args.min_amount, max_amount=args.max_amount, text=args.search)
+        elapsed = time.perf_counter() - started
+        print(file=sys.stderr)
+        print(f"Exported {exported} rows to {args.path} in {elapsed:.1f}s.")
+        return 0
+
+    if args.command == 'partition':
+        years = list(args.years)
+        if args.action == 'close' and args.through is not None:
+            # Only finished years that are still open; rows added to a
+            # closed year later stay in the main table
+            through = min(args.through, datetime.now().year - 1)
+            years += [year for (year,) in conn.execute(
+                '''SELECT DISTINCT CAST(substr(iso_date, 1, 4) AS INTEGER) FROM main.transactions
+                   WHERE iso_date <= ? AND CAST(substr(iso_date, 1, 4) AS INTEGER)
+                   NOT IN (SELECT year FROM partitions) ORDER BY 1''', (f"{through}-12-31",))]
+        if args.action == 'list':
+            folder = os.path.dirname(_main_file(conn))
+            for year, path, rows in conn.execute("SELECT year, path, rows FROM partitions ORDER BY year"):
+                size = os.path.getsize(os.path.join(folder, path))
+                print(f"{year}  {rows:>10} rows  {size / 1e6:8.1f} MB  {path}")
+            return 0
+        if not years:
+            if args.through is not None:
+                print(f"No open years up to {args.through} to close.")
+                return 0
+            parser.error(f"partition {args.action} needs a year")
+        status = 0
+        done = 0
+        for year in sorted(set(years)):
+            started = time.perf_counter()
+            try:
+                if args.action == 'close':
+                    moved = close_year(conn, year)
+                    print(f"Closed {year}: moved {moved} rows to {partition_path(conn, year)}"
+                          f" in {time.perf_counter() - started:.1f}s.")
+                else:
+                    moved = reopen_year(conn, year)
+                    print(f"Reopened {year}: moved {moved} rows back"
+                          f" in {time.perf_counter() - started:.1f}s.")
+            except (ValueError, RuntimeError, OSError, sqlite3.Error) as e:
+                print(f"Cannot {args.action} {year}: {e}", file=sys.stderr)
+                status = 1
+                break
+            done += 1
+        if args.action == 'close' and done:
+            # Give the space the moved rows used back to the file system
+            conn.execute("VACUUM main")
+        return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
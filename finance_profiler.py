@@ -0,0 +1,208 @@
+# Timing of SQL statements and render steps for the finance app
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Statements slower than this get their EXPLAIN QUERY PLAN captured
+DEFAULT_SLOW_QUERY_MS = 50.0
+SLOW_QUERY_MS = os.environ.get('FINANCE_SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+try:
+    SLOW_QUERY_MS = float(SLOW_QUERY_MS)
+    if not 0 <= SLOW_QUERY_MS < float('inf'):
+        raise ValueError
+except ValueError:
+    print(f"Ignoring FINANCE_SLOW_QUERY_MS={SLOW_QUERY_MS!r}: expected a number of "
+          f"milliseconds; using {DEFAULT_SLOW_QUERY_MS:g}", file=sys.stderr)
+    SLOW_QUERY_MS = DEFAULT_SLOW_QUERY_MS
+# Every record is appended to this JSON-lines file when set
+PROFILE_LOG = os.environ.get('FINANCE_PROFILE_LOG')
+# Records kept in memory for the performance panel
+MAX_RECORDS = 2000
+
+# Frames in these files are never reported as the caller
+_SKIPPED_FILES = {os.path.normcase(os.path.abspath(path))
+                  for path in (__file__, contextlib.__file__)}
+# Helper modules skipped when naming the caller of a statement
+_LIBRARY_FILES = {os.path.normcase(os.path.abspath(os.path.join(os.path.dirname(__file__), name)))
+                  for name in ('finance_db.py', 'finance_analytics.py')}
+
+
+class Profiler:
+    # Collects timing records from any thread. Each record is a dict with
+    # time, kind (sql, commit, treeview, render, aggregation), label, ms,
+    # rows, site and thread, plus plan for slow statements.
+    def __init__(self, slow_ms=SLOW_QUERY_MS, log_path=PROFILE_LOG, max_records=MAX_RECORDS):
+        self.slow_ms = slow_ms
+        self.records = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+        self.log = None
+        if log_path:
+            try:
+                self.log = open(log_path, 'a', encoding='utf-8')
+            except OSError as e:
+                print(f"Not writing the profile log to {log_path}: {e}", file=sys.stderr)
+
+    def record(self, kind, label, seconds, rows=None, site=None, plan=None):
+        entry = {
+            'time': time.time(),
+            'kind': kind,
+            'label': label,
+            'ms': round(seconds * 1000, 3),
+            'rows': rows,
+            'site': site or call_site(),
+            'thread': threading.current_thread().name,
+        }
+        if plan is not None:
+            entry['plan'] = plan
+        with self.lock:
+            self.records.append(entry)
+            if self.log:
+                try:
+                    self.log.write(json.dumps(entry) + '\n')
+                    self.log.flush()
+                except OSError as e:
+                    # A full or vanished disk must not break the statement
+                    # being timed; stop logging instead
+                    print(f"Stopped writing the profile log: {e}", file=sys.stderr)
+                    self.log = None
+        return entry
+
+    @contextmanager
+    def measure(self, kind, label, rows=None):
+        site = call_site()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, label, time.perf_counter() - started, rows, site)
+
+    def wrap(self, kind, label, function):
+        # function, timed on every call
+        def timed(*args, **kwargs):
+            with self.measure(kind, label):
+                return function(*args, **kwargs)
+        return timed
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.records)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
+
+
+def call_site():
+    # "caller (file:line)" for the first frame outside this module, followed
+    # by the first frame outside the database helpers when they differ, e.g.
+    # "update_treeview (personal_financea_system.py:210) > fetch_page (finance_db.py:312)"
+    frame = sys._getframe(1)
+    while frame and os.path.normcase(os.path.abspath(frame.f_code.co_filename)) in _SKIPPED_FILES:
+        frame = frame.f_back
+    sites = []
+    while frame:
+        filename = os.path.normcase(os.path.abspath(frame.f_code.co_filename))
+        if not sites or filename not in _LIBRARY_FILES:
+            sites.append(
+                f"{frame.f_code.co_name} ({os.path.basename(filename)}:{frame.f_lineno})")
+            if filename not in _LIBRARY_FILES:
+                break
+        frame = frame.f_back
+    return ' > '.join(reversed(sites)) if sites else None
+
+
+def query_plan(conn, sql, params):
+    try:
+        return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    except (sqlite3.Error, ValueError):
+        return None
+
+
+class ProfiledCursor:
+    # Cursor proxy that records every statement: time spent executing and
+    # fetching, rows returned or changed, and the caller. SELECTs are recorded
+    # once fetched (fetchone, fetchall, or a short fetchmany); other
+    # statements right after they execute.
+    def __init__(self, cursor, profiler):
+        self._cursor = cursor
+        self._profiler = profiler
+        self._pending = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def execute(self, sql, params=()):
+        return self._run(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(self._cursor.executemany, sql, seq_of_params, many=True)
+
+    def _run(self, method, sql, params, many=False):
+        self._finish()
+        site = call_site()
+        started = time.perf_counter()
+        method(sql, params)
+        self._pending = {
+            'sql': ' '.join(sql.split()),
+            'params': None if many else params,
+            'seconds': time.perf_counter() - started,
+            'rows': max(self._cursor.rowcount, 0),
+            'site': site,
+        }
+        if self._cursor.description is None:
+            self._finish()
+        return self
+
+    def _fetched(self, started, rows, done):
+        if self._pending:
+            self._pending['seconds'] += time.perf_counter() - started
+            self._pending['rows'] += rows
+            if done:
+                self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(started, row is not None, True)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(size or self._cursor.arraysize)
+        self._fetched(started, len(rows), len(rows) < (size or self._cursor.arraysize))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if not pending:
+            return
+        plan = None
+        if pending['seconds'] * 1000 >= self._profiler.slow_ms and pending['params'] is not None:
+            plan = query_plan(self._cursor.connection,
+                              pending['sql'], pending['params'])
+        self._profiler.record('sql', pending['sql'], pending['seconds'],
+                              pending['rows'], pending['site'], plan)
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
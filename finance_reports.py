@@ -0,0 +1,238 @@
+# Headless PDF/PNG statements rendered with the dashboard's charts
+#
+#   python finance_reports.py finance.db                       # whole ledger
+#   python finance_reports.py a.db b.db --monthly --format png
+#   python finance_reports.py finance.db --from 2024-01-01 --to 2024-06-30
+#
+# Reports are rendered on the Agg backend in a process pool, one ledger and
+# date range per task. Each output is recorded in a cache manifest in the
+# output directory under a hash of the rollup rows it was drawn from, so
+# reports whose data has not changed are skipped on the next run.
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import finance_db
+
+# Bump when the report layout changes so cached reports are re-rendered
+RENDER_VERSION = 1
+CACHE_MANIFEST = '.report-cache.json'
+FORMATS = ('pdf', 'png')
+REPORT_DPI = 100
+
+
+def _init_worker():
+    # Runs once in each pool process, before any figure is created
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def month_ranges(start, end):
+    # Inclusive yyyy-mm-dd (first, last) day pairs for each month from the
+    # month of start to the month of end
+    year, month = int(start[:4]), int(start[5:7])
+    while f"{year:04d}-{month:02d}" <= end[:7]:
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        last = date.fromordinal(date(next_year, next_month, 1).toordinal() - 1)
+        yield f"{year:04d}-{month:02d}-01", last.isoformat()
+        year, month = next_year, next_month
+
+
+def open_readonly(path):
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def report_name(path):
+    # Output name for a ledger: its path relative to the working directory
+    # without the extension, so ledgers that share a file name, such as
+    # */finance.db, get distinct reports; ledgers outside the working
+    # directory use their file name and a hash of their absolute path
+    relative = os.path.relpath(os.path.abspath(path))
+    if relative.startswith(os.pardir) or os.path.isabs(relative):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        digest = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:8]
+        return f"{stem}-{digest}"
+    return os.path.splitext(relative)[0].replace(os.sep, '_')
+
+
+def plan_reports(paths, out_dir, fmt, start=None, end=None, monthly=False):
+    # Returns (tasks, problems): a (db_path, start, end, out_path) tuple per
+    # report, and a (db_path, message) pair per ledger that cannot be
+    # reported on. Ledgers are only read; a missing path or one whose schema
+    # is older than this version of finance_db is reported, not created or
+    # migrated.
+    tasks, problems = [], []
+    outputs = {}
+    seen = set()
+    for path in paths:
+        if os.path.realpath(path) in seen:
+            continue
+        seen.add(os.path.realpath(path))
+        if not os.path.isfile(path):
+            problems.append((path, "no such file"))
+            continue
+        try:
+            conn = open_readonly(path)
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < len(finance_db.MIGRATIONS):
+                    problems.append((path, "the ledger has not been migrated; open it once with "
+                                           "personal_financea_system.py or finance_db.py"))
+                    continue
+                first, last = conn.execute("SELECT MIN(day), MAX(day) FROM daily_totals").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            problems.append((path, f"cannot read the ledger: {e}"))
+            continue
+
+        name = report_name(path)
+        if monthly:
+            if first is None:
+                continue
+            planned = [(path, month_start, month_end,
+                        os.path.join(out_dir, f"{name}-{month_start[:7]}.{fmt}"))
+                       for month_start, month_end in month_ranges(max(first, start or first),
+                                                                  min(last, end or last))]
+        else:
+            suffix = f"-{start or 'start'}_{end or 'end'}" if start or end else ""
+            planned = [(path, start, end, os.path.join(out_dir, f"{name}{suffix}.{fmt}"))]
+        # Two jobs writing one file would race and share a cache entry
+        clash = next((outputs[task[3]] for task in planned if task[3] in outputs), None)
+        if clash is not None:
+            problems.append((path, f"its reports would overwrite those of {clash}"))
+            continue
+        for task in planned:
+            outputs[task[3]] = path
+        tasks.extend(planned)
+    return tasks, problems
+
+
+def data_key(daily, start, end, fmt):
+    # Content hash of everything a report shows. PRAGMA data_version only
+    # tracks changes during one connection, so it cannot tell runs apart;
+    # the rollup rows for the range are small and cheap to hash instead.
+    import pandas as pd
+    digest = hashlib.sha256(f"{RENDER_VERSION}|{fmt}|{start}|{end}".encode())
+    digest.update(pd.util.hash_pandas_object(daily, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def render_report(db_path, start, end, out_path, cached_key=None):
+    # Render one report unless cached_key matches its data. Returns
+    # (out_path, key, rendered).
+    from matplotlib.figure import Figure
+
+    import finance_analytics
+    import finance_charts
+
+    conn = open_readonly(db_path)
+    try:
+        daily = finance_analytics.load_daily_totals(conn, start, end)
+    finally:
+        conn.close()
+
+    fmt = os.path.splitext(out_path)[1].lstrip('.')
+    key = data_key(daily, start, end, fmt)
+    if key == cached_key and os.path.exists(out_path):
+        return out_path, key, False
+
+    totals = daily.groupby('type')['total'].sum().to_dict()
+    figure = Figure(figsize=(16, 8))
+    charts = finance_charts.DashboardCharts(figure)
+    charts.draw(totals, finance_analytics.series_from_daily(daily))
+    balance = totals.get('Income', 0.0) - totals.get('Expense', 0.0)
+    period = f"{start or 'start'} to {end or 'end'}" if start or end else "All transactions"
+    figure.suptitle(f"{db_path}: {period}    Balance: ${balance:.2f}",
+                    fontsize=18, color=finance_charts.TEXT_COLOR)
+
+    # Write under a temporary name so an interrupted run leaves no partial report
+    partial = f"{out_path}.partial"
+    figure.savefig(partial, format=fmt, dpi=REPORT_DPI)
+    os.replace(partial, out_path)
+    return out_path, key, True
+
+
+def _render_task(task):
+    return render_report(*task)
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, CACHE_MANIFEST)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, CACHE_MANIFEST)
+    with open(path + '.partial', 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(path + '.partial', path)
+
+
+def render_reports(tasks, out_dir, jobs=None, use_cache=True):
+    # Render tasks from plan_reports across a process pool. Returns
+    # (rendered, skipped, failed) counts; the manifest is saved even when
+    # some reports fail.
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir) if use_cache else {}
+    rendered = skipped = failed = 0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as pool:
+        futures = {pool.submit(_render_task, (*task, manifest.get(os.path.basename(task[3])))): task
+                   for task in tasks}
+        try:
+            for future in futures:
+                task = futures[future]
+                try:
+                    out_path, key, was_rendered = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Failed to render {task[3]}: {e}", file=sys.stderr)
+                    continue
+                manifest[os.path.basename(out_path)] = key
+                if was_rendered:
+                    rendered += 1
+                    print(f"Rendered {out_path}", file=sys.stderr)
+                else:
+                    skipped += 1
+        finally:
+            save_manifest(out_dir, manifest)
+    return rendered, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render finance reports without a display")
+    parser.add_argument('ledgers', nargs='+', help="finance.db files to report on")
+    parser.add_argument('--out-dir', default='reports')
+    parser.add_argument('--format', choices=FORMATS, default='pdf')
+    parser.add_argument('--from', dest='start', type=date.fromisoformat,
+                        help="first day to include (yyyy-mm-dd)")
+    parser.add_argument('--to', dest='end', type=date.fromisoformat,
+                        help="last day to include (yyyy-mm-dd)")
+    parser.add_argument('--monthly', action='store_true',
+                        help="one report per calendar month instead of one per ledger")
+    parser.add_argument('--jobs', type=int, help="worker processes (default: one per core)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="render every report even if its data is unchanged")
+    args = parser.parse_args(argv)
+
+    start = args.start.isoformat() if args.start else None
+    end = args.end.isoformat() if args.end else None
+    tasks, problems = plan_reports(args.ledgers, args.out_dir, args.format, start, end, args.monthly)
+    for path, message in problems:
+        print(f"Skipping {path}: {message}", file=sys.stderr)
+    rendered, skipped, failed = render_reports(tasks, args.out_dir, args.jobs, not args.no_cache)
+    failed += len(problems)
+    print(f"{rendered} rendered, {skipped} unchanged, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
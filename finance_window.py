@@ -0,0 +1,152 @@
+# The part of the transaction table the finance app's Treeview holds
+#
+# The Treeview never holds more than MAX_LOADED_ROWS of the rows matching
+# the filter bar. Scrolling near either end of them fetches the next keyset
+# page and drops rows far from the view. The window also counts the matching
+# rows before it and in all, so the scrollbar can be sized and placed for
+# the whole result instead of the loaded rows.
+import finance_db
+
+# Rows fetched per keyset page and the most rows kept in the Treeview at once
+PAGE_SIZE = 100
+MAX_LOADED_ROWS = 3 * PAGE_SIZE
+# Fraction of the loaded window left above/below the view that triggers a fetch
+SCROLL_FETCH_THRESHOLD = 0.1
+
+
+class PageWindow:
+    # Consecutive rows matching filters, in id order, held by tree with the
+    # transaction id as item id. offset and total are the numbers of matching
+    # rows before the first loaded one and in all. Only get_children,
+    # insert, delete, yview and yview_moveto of tree are used.
+    def __init__(self, tree, cursor):
+        self.tree = tree
+        self.cursor = cursor
+        self.filters = {}
+        self.offset = 0
+        self.total = 0
+        self.has_rows_above = False
+        self.has_rows_below = False
+
+    def reload(self):
+        # Reload a page from the first loaded row, or from the first
+        # matching row when none is loaded. Returns the rows loaded.
+        children = self.tree.get_children()
+        start_id = int(children[0]) if children else None
+        self.tree.delete(*children)
+
+        rows = finance_db.fetch_page(
+            self.cursor, PAGE_SIZE, after_id=start_id, inclusive=True, **self.filters)
+        for row in rows:
+            self.tree.insert('', 'end', iid=row[0], values=row)
+
+        self.has_rows_below = len(rows) == PAGE_SIZE
+        self.has_rows_above = bool(rows) and finance_db.has_rows_before(
+            self.cursor, rows[0][0], **self.filters)
+        self.recount()
+        return rows
+
+    def recount(self):
+        # Count offset and total again, after changes that were not
+        # followed row by row
+        self.total = finance_db.count_transactions(self.cursor, **self.filters)
+        children = self.tree.get_children()
+        if self.has_rows_above and children:
+            self.offset = finance_db.count_transactions(
+                self.cursor, before_id=int(children[0]), **self.filters)
+        else:
+            self.offset = 0
+
+    def count_change(self, transaction_id, delta):
+        # A change to transaction_id added delta matching rows; call it
+        # before the change reaches the tree
+        self.total = max(self.total + delta, 0)
+        children = self.tree.get_children()
+        if delta and children and transaction_id < int(children[0]):
+            self.offset = max(self.offset + delta, 0)
+
+    def next_page(self):
+        # Append the next page and drop rows far above the view, which stays
+        # in place. Returns the rows added.
+        children = self.tree.get_children()
+        if not children or not self.has_rows_below:
+            return []
+
+        rows = finance_db.fetch_page(
+            self.cursor, PAGE_SIZE, after_id=int(children[-1]), **self.filters)
+        self.has_rows_below = len(rows) == PAGE_SIZE
+
+        top = self.tree.yview()[0] * len(children)
+        for row in rows:
+            self.tree.insert('', 'end', iid=row[0], values=row)
+
+        excess = len(children) + len(rows) - MAX_LOADED_ROWS
+        if excess > 0:
+            self.tree.delete(*children[:excess])
+            self.offset += excess
+            self.has_rows_above = True
+            self.tree.yview_moveto(max(top - excess, 0) / len(self.tree.get_children()))
+        return rows
+
+    def previous_page(self):
+        # Prepend the previous page and drop rows far below the view, which
+        # stays in place. Returns the rows added.
+        children = self.tree.get_children()
+        if not children or not self.has_rows_above:
+            return []
+
+        rows = finance_db.fetch_page(
+            self.cursor, PAGE_SIZE, before_id=int(children[0]), **self.filters)
+        self.has_rows_above = len(rows) == PAGE_SIZE
+        self.offset = max(self.offset - len(rows), 0) if self.has_rows_above else 0
+
+        top = self.tree.yview()[0] * len(children)
+        for index, row in enumerate(rows):
+            self.tree.insert('', index, iid=row[0], values=row)
+
+        excess = len(children) + len(rows) - MAX_LOADED_ROWS
+        if excess > 0:
+            self.tree.delete(*children[-excess:])
+            self.has_rows_below = True
+        self.tree.yview_moveto((top + len(rows)) / len(self.tree.get_children()))
+        return rows
+
+    def scroll_fractions(self, first, last):
+        # The tree's (first, last) view fractions of the loaded rows as
+        # fractions of all matching rows, for the scrollbar
+        loaded = len(self.tree.get_children())
+        if not loaded or self.total <= loaded:
+            return first, last
+        return (min((self.offset + first * loaded) / self.total, 1.0),
+                min((self.offset + last * loaded) / self.total, 1.0))
+
+    def moveto(self, fraction):
+        # Scroll so that the view starts at fraction of all matching rows,
+        # as dragging the scrollbar asks. A position outside the loaded rows
+        # replaces them with the page around it. Returns the rows loaded.
+        children = self.tree.get_children()
+        loaded = len(children)
+        if not loaded or self.total <= loaded:
+            self.tree.yview_moveto(fraction)
+            return []
+
+        first, last = self.tree.yview()
+        visible = (last - first) * loaded
+        target = min(max(fraction, 0.0), 1.0) * self.total
+        if self.offset <= target and (target + visible <= self.offset + loaded
+                                      or not self.has_rows_below):
+            self.tree.yview_moveto((target - self.offset) / loaded)
+            return []
+
+        start = max(0, min(int(target) - PAGE_SIZE // 2, self.total - PAGE_SIZE))
+        rows = finance_db.fetch_page(self.cursor, PAGE_SIZE, offset=start, **self.filters)
+        if not rows:
+            return []
+        self.tree.delete(*children)
+        for row in rows:
+            self.tree.insert('', 'end', iid=row[0], values=row)
+        self.offset = start
+        self.has_rows_above = start > 0
+        self.has_rows_below = len(rows) == PAGE_SIZE
+        self.tree.yview_moveto((target - start) / len(rows))
+        return rows
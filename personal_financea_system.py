@@ -1,17 +1,63 @@
-import pandas as pd
+import time
+# Taken before the other imports so --startup-time can include them
+STARTED = time.perf_counter()
+import argparse
+import os
+import queue
+import sys
+import threading
 from datetime import datetime
 from tkcalendar import DateEntry
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import sqlite3
-import matplotlib
-matplotlib.use('TkAgg')
+import finance_db
+import finance_profiler
+from finance_window import SCROLL_FETCH_THRESHOLD, PageWindow
+# matplotlib and finance_analytics (pandas, numpy) are imported when the
+# Dashboard tab is first opened; see build_dashboard
+
+# Quiet period that coalesces bursts of edits into one dashboard refresh,
+# and how often the UI checks for results from the dashboard worker
+DASHBOARD_DEBOUNCE_MS = 300
+DASHBOARD_POLL_MS = 100
+# How often the UI checks on a running import or export
+JOB_POLL_MS = 200
+# Pause after the last keystroke in the filter bar before the table re-queries
+FILTER_DEBOUNCE_MS = 250
+# Set FINANCE_WRITE_BEHIND_MS to commit form edits on a writer thread,
+# grouping the edits made within that many milliseconds into one commit
+# (see finance_db.WriteQueue for the durability trade-off). Unset, every
+# edit is committed on the Tk thread before the form returns.
+WRITE_BEHIND_MS = os.environ.get('FINANCE_WRITE_BEHIND_MS')
+if WRITE_BEHIND_MS is not None:
+    try:
+        WRITE_BEHIND_MS = float(WRITE_BEHIND_MS)
+        if not 0 <= WRITE_BEHIND_MS < float('inf'):
+            raise ValueError
+    except ValueError:
+        print(f"Ignoring FINANCE_WRITE_BEHIND_MS={WRITE_BEHIND_MS!r}: expected a number of "
+              "milliseconds; committing every edit immediately", file=sys.stderr)
+        WRITE_BEHIND_MS = None
+# How often the UI checks for confirmations from the writer thread
+WRITE_POLL_MS = 50
+# Date formats offered when importing a CSV statement
+STATEMENT_DATE_FORMATS = {
+    "Any usual format (slashed dates as dd/mm/yyyy)": None,
+    "dd/mm/yyyy": '%d/%m/%Y',
+    "mm/dd/yyyy (US)": '%m/%d/%Y',
+    "yyyy-mm-dd": '%Y-%m-%d',
+    "dd-mm-yyyy": '%d-%m-%Y',
+    "dd.mm.yyyy": '%d.%m.%Y',
+}
 
 
 class FinanceApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, report_startup=False):
+        # Seconds spent in each startup phase, in order
+        self.startup_times = [('imports', time.perf_counter() - STARTED)]
+        self.startup_mark = time.perf_counter()
+        self.report_startup = report_startup
         super().__init__()
         self.title("Personal Finance Management System")
         self.geometry("1300x800")
@@ -26,13 +72,28 @@ class FinanceApp(tk.Tk):
         self.entry_color = "#ffffff"
         self.editing_transaction_id = None  # Track if a transaction is being edited
         self.configure(bg=self.bg_color)
+        self.mark_startup('window')
 
         # Create SQLite database
-        self.conn = sqlite3.connect('finance.db')
-        self.cursor = self.conn.cursor()
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS transactions
-                              (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, amount REAL, date TEXT, description TEXT)''')
-        self.conn.commit()
+        self.db_path = finance_db.DEFAULT_DB
+        self.conn = sqlite3.connect(self.db_path)
+        # Every statement issued through self.cursor is timed; see the
+        # Performance tab or set FINANCE_PROFILE_LOG for a JSON-lines log
+        self.profiler = finance_profiler.Profiler()
+        self.cursor = finance_profiler.ProfiledCursor(
+            self.conn.cursor(), self.profiler)
+        with self.profiler.measure('sql', 'create_schema'):
+            finance_db.create_schema(self.conn)
+
+        # Optional write-behind queue; callbacks for its unconfirmed writes
+        self.writer = None
+        self.pending_writes = {}
+        self.write_poll_job = None
+        if WRITE_BEHIND_MS is not None:
+            self.writer = finance_db.WriteQueue(
+                self.db_path, WRITE_BEHIND_MS, self.profiler)
+            self.writer.start()
+        self.mark_startup('database')
 
         # Main frame
         main_frame = tk.Frame(self, bg=self.bg_color)
@@ -105,6 +166,51 @@ class FinanceApp(tk.Tk):
             button_frame, "Edit", self.edit_transaction, 0, 1)
         delete_button = self.create_button(
             button_frame, "Delete", self.delete_transaction, 0, 2)
+        import_button = self.create_button(
+            button_frame, "Import", self.import_statement, 0, 3)
+        export_button = self.create_button(
+            button_frame, "Export", self.export_transactions, 0, 4)
+        select_all_button = self.create_button(
+            button_frame, "Select All", self.select_all, 0, 5)
+
+        self.status_label = ttk.Label(button_frame, text="")
+        self.status_label.grid(row=1, column=0, columnspan=6,
+                               padx=20, sticky='w')
+        self.job_thread = None
+        self.job_writes = False
+
+        # Filter bar; filtering happens in SQL and results are paged like
+        # the unfiltered table
+        filter_frame = tk.Frame(transaction_tab, bg=self.bg_color)
+        filter_frame.grid(row=5, column=0, columnspan=3, padx=20, sticky='ew')
+
+        self.search_var = tk.StringVar()
+        self.filter_type_var = tk.StringVar(value='All')
+        self.filter_from_var = tk.StringVar()
+        self.filter_to_var = tk.StringVar()
+        self.filter_min_var = tk.StringVar()
+        self.filter_max_var = tk.StringVar()
+
+        ttk.Label(filter_frame, text="Search:").grid(row=0, column=0, padx=5)
+        ttk.Entry(filter_frame, textvariable=self.search_var, width=20,
+                  font=('Helvetica', 16)).grid(row=0, column=1, padx=5)
+        ttk.Combobox(filter_frame, textvariable=self.filter_type_var, values=['All', 'Income', 'Expense'],
+                     width=8, state='readonly', font=('Helvetica', 16)).grid(row=0, column=2, padx=5)
+        column = 3
+        for text, variable, width in (("From:", self.filter_from_var, 10), ("To:", self.filter_to_var, 10),
+                                      ("Min $:", self.filter_min_var, 8), ("Max $:", self.filter_max_var, 8)):
+            ttk.Label(filter_frame, text=text).grid(row=0, column=column, padx=5)
+            ttk.Entry(filter_frame, textvariable=variable, width=width,
+                      font=('Helvetica', 16)).grid(row=0, column=column + 1, padx=5)
+            column += 2
+        ttk.Button(filter_frame, text="Clear", command=self.clear_filters,
+                   style='TButton').grid(row=0, column=column, padx=5)
+
+        self.filters = {}
+        self.filter_job = None
+        for variable in (self.search_var, self.filter_type_var, self.filter_from_var,
+                         self.filter_to_var, self.filter_min_var, self.filter_max_var):
+            variable.trace_add('write', lambda *args: self.schedule_filter())
 
         # Treeview (Modernized) with increased font size
         self.tree = ttk.Treeview(transaction_tab, columns=(
@@ -114,48 +220,250 @@ class FinanceApp(tk.Tk):
         self.tree.heading('Amount', text='Amount')
         self.tree.heading('Date', text='Date')
         self.tree.heading('Description', text='Description')
-        self.tree.grid(row=5, column=0, columnspan=3, padx=20,
+        self.tree.grid(row=6, column=0, columnspan=3, padx=20,
                        pady=20, sticky='nsew')  # Increased padding
 
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(
-            transaction_tab, orient='vertical', command=self.tree.yview)
-        scrollbar.grid(row=5, column=3, sticky='ns')
-        self.tree.configure(yscroll=scrollbar.set)
+        # Scrollbar; it spans every matching row, not just the loaded ones
+        self.scrollbar = ttk.Scrollbar(
+            transaction_tab, orient='vertical', command=self.on_scrollbar)
+        self.scrollbar.grid(row=6, column=3, sticky='ns')
+        self.tree.configure(yscroll=self.on_tree_scroll)
+
+        # Rows can be multi-selected for bulk edit and delete. Select All
+        # selects every row matching the filter bar, loaded or not.
+        self.select_all_filter = False
+        self.select_all_count = 0
+        self.tree.bind('<<TreeviewSelect>>', self.on_tree_select)
+        self.tree.bind('<Control-a>', lambda event: self.select_all() or 'break')
 
-        # Dashboard Tab
-        dashboard_tab = tk.Frame(self.notebook, bg=self.bg_color)
-        self.notebook.add(dashboard_tab, text='Dashboard')
+        # Keyset window currently held by the treeview
+        self.window = PageWindow(self.tree, self.cursor)
+        self.loading_page = False
+        self.scroll_target = None
 
-        # Dashboard Widgets
-        self.figure, (self.ax1, self.ax2) = plt.subplots(1, 2, figsize=(16, 8))
-        self.canvas = FigureCanvasTkAgg(self.figure, master=dashboard_tab)
-        self.canvas.draw()
-        self.canvas.get_tk_widget().pack(fill='both', expand=True)
+        # Running dashboard state; totals are adjusted by delta on every change
+        # and replaced by the worker's recomputation once it arrives
+        self.totals = {'Income': 0.0, 'Expense': 0.0}
+        self.dashboard_refresh_job = None
+        self.dashboard_poll_job = None
+        self.dashboard_worker = None
+        self.canvas = None
 
-        # Balance Label
-        self.balance_label = tk.Label(dashboard_tab, text="Total Balance: $0.00", font=(
+        # Dashboard Tab; its widgets are built the first time it is selected
+        self.dashboard_tab = tk.Frame(self.notebook, bg=self.bg_color)
+        self.notebook.add(self.dashboard_tab, text='Dashboard')
+        self.dashboard_loading_label = tk.Label(self.dashboard_tab, text="Loading dashboard...", font=(
             'Helvetica', 24, 'bold'), bg=self.bg_color, fg=self.text_color)
-        self.balance_label.pack(pady=30)
+        self.dashboard_loading_label.pack(pady=30)
+
+        self.create_performance_tab()
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+
+        # Time every treeview rebuild, including scroll-triggered page loads
+        for name in ('update_treeview', 'load_next_page', 'load_previous_page'):
+            setattr(self, name, self.profiler.wrap(
+                'treeview', name, getattr(self, name)))
+
+        self.mark_startup('widgets')
 
         # Now you can safely call update_treeview
         self.update_treeview()
+        self.mark_startup('first page')
 
-        # Initialize the dashboard
-        self.update_dashboard()
+        # Idle callbacks can run before the window manager has mapped the
+        # window, so start waiting for idle only once it has been mapped
+        self.bind('<Map>', self.on_first_map)
+
+    def mark_startup(self, phase):
+        now = time.perf_counter()
+        self.startup_times.append((phase, now - self.startup_mark))
+        self.startup_mark = now
+
+    def on_first_map(self, event):
+        # Children's events reach the root's binding too; only the root's counts
+        if event.widget is not self:
+            return
+        self.unbind('<Map>')
+        # Run the redraws already scheduled, then measure on the next idle
+        self.update_idletasks()
+        self.after_idle(self.finish_startup)
+
+    def finish_startup(self):
+        self.mark_startup('first paint')
+        for phase, seconds in self.startup_times:
+            self.profiler.record('startup', phase, seconds, site='FinanceApp')
+        if self.report_startup:
+            for phase, seconds in self.startup_times:
+                print(f"{phase:<12} {seconds * 1000:8.1f} ms", file=sys.stderr)
+            print(f"{'interactive':<12} {(time.perf_counter() - STARTED) * 1000:8.1f} ms",
+                  file=sys.stderr)
+            self.destroy()
 
     def update_treeview(self):
-        # Clear the treeview
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        # Reload the current window instead of the whole table
+        self.window.reload()
+        self.place_scrollbar()
+
+    def schedule_filter(self):
+        if self.filter_job:
+            self.after_cancel(self.filter_job)
+        self.filter_job = self.after(FILTER_DEBOUNCE_MS, self.apply_filters)
+
+    def apply_filters(self):
+        self.filter_job = None
+        filters = {}
+        problems = []
+
+        text = self.search_var.get().strip()
+        if text:
+            filters['text'] = text
+        if self.filter_type_var.get() in ('Income', 'Expense'):
+            filters['ttype'] = self.filter_type_var.get()
+        for key, variable, name in (('start', self.filter_from_var, "From"), ('end', self.filter_to_var, "To")):
+            value = variable.get().strip()
+            if value:
+                try:
+                    filters[key] = finance_db.to_iso_date(value)
+                except ValueError:
+                    problems.append(f"{name} date must be dd-mm-yyyy")
+        for key, variable, name in (('min_amount', self.filter_min_var, "Min"), ('max_amount', self.filter_max_var, "Max")):
+            value = variable.get().strip()
+            if value:
+                try:
+                    filters[key] = float(value)
+                except ValueError:
+                    problems.append(f"{name} amount must be a number")
+
+        # Invalid fields are ignored until corrected
+        self.status_label.config(text='; '.join(problems))
+        self.filters = self.window.filters = filters
+        self.select_all_filter = False
+
+        # Restart from the first matching page
+        self.tree.delete(*self.tree.get_children())
+        self.update_treeview()
+
+    def clear_filters(self):
+        for variable in (self.search_var, self.filter_from_var, self.filter_to_var,
+                         self.filter_min_var, self.filter_max_var):
+            variable.set('')
+        self.filter_type_var.set('All')
+
+    def place_scrollbar(self):
+        self.scrollbar.set(*self.window.scroll_fractions(*self.tree.yview()))
+
+    def on_tree_scroll(self, first, last):
+        self.scrollbar.set(*self.window.scroll_fractions(float(first), float(last)))
+        if self.loading_page:
+            return
+        # Defer so the treeview is not modified from inside its own callback
+        if float(last) >= 1 - SCROLL_FETCH_THRESHOLD and self.window.has_rows_below:
+            self.loading_page = True
+            self.after_idle(self.load_next_page)
+        elif float(first) <= SCROLL_FETCH_THRESHOLD and self.window.has_rows_above:
+            self.loading_page = True
+            self.after_idle(self.load_previous_page)
+
+    def on_scrollbar(self, action, *args):
+        if action != 'moveto':
+            self.tree.yview(action, *args)
+            return
+        # Dragging can jump to rows that are not loaded; only the latest
+        # position of a burst of drag events is loaded
+        if self.scroll_target is None:
+            self.after_idle(self.scroll_to_target)
+        self.scroll_target = float(args[0])
+
+    def scroll_to_target(self):
+        fraction, self.scroll_target = self.scroll_target, None
+        self.select_loaded(self.window.moveto(fraction))
+
+    def load_next_page(self):
+        try:
+            self.select_loaded(self.window.next_page())
+        finally:
+            self.loading_page = False
+
+    def load_previous_page(self):
+        try:
+            self.select_loaded(self.window.previous_page())
+        finally:
+            self.loading_page = False
+
+    def select_loaded(self, transactions):
+        # Rows loaded after Select All are part of the selection
+        if self.select_all_filter and transactions:
+            self.tree.selection_add(*[t[0] for t in transactions])
+
+    def commit(self):
+        with self.profiler.measure('commit', 'COMMIT'):
+            self.conn.commit()
+
+    def create_performance_tab(self):
+        performance_tab = tk.Frame(self.notebook, bg=self.bg_color)
+        self.notebook.add(performance_tab, text='Performance')
 
-        # Fetch transactions from the database
-        self.cursor.execute("SELECT * FROM transactions ORDER BY id")
-        transactions = self.cursor.fetchall()
+        controls = tk.Frame(performance_tab, bg=self.bg_color)
+        controls.pack(fill='x', padx=20, pady=10)
+        ttk.Button(controls, text="Refresh", command=self.refresh_performance,
+                   style='TButton').pack(side='left', padx=5)
+        ttk.Button(controls, text="Clear", command=self.clear_performance,
+                   style='TButton').pack(side='left', padx=5)
+        self.slow_only_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(controls, text=f"Only slower than {self.profiler.slow_ms:g} ms",
+                        variable=self.slow_only_var, command=self.refresh_performance).pack(side='left', padx=20)
 
-        # Insert transactions into the treeview
-        for transaction in transactions:
-            self.tree.insert('', 'end', values=transaction)
+        self.performance_tree = ttk.Treeview(performance_tab, columns=(
+            'Kind', 'ms', 'Rows', 'Label', 'Call Site'), show='headings', height=12)
+        for column, width in (('Kind', 110), ('ms', 100), ('Rows', 90), ('Label', 500), ('Call Site', 450)):
+            self.performance_tree.heading(column, text=column)
+            self.performance_tree.column(column, width=width, stretch=column in ('Label', 'Call Site'))
+        self.performance_tree.pack(fill='both', expand=True, padx=20)
+        self.performance_tree.bind(
+            '<<TreeviewSelect>>', self.show_performance_details)
+
+        # Full statement and query plan of the selected record
+        self.performance_details = tk.Text(
+            performance_tab, height=8, font=('Courier', 12), wrap='word')
+        self.performance_details.pack(fill='x', padx=20, pady=10)
+        self.performance_records = []
+        self.performance_tab = performance_tab
+
+    def on_tab_changed(self, event=None):
+        selected = self.notebook.select()
+        if selected == str(self.dashboard_tab) and self.canvas is None:
+            # Let the loading label paint before the slow imports
+            self.after_idle(self.build_dashboard)
+        elif selected == str(self.performance_tab):
+            self.refresh_performance()
+
+    def refresh_performance(self):
+        records = self.profiler.snapshot()
+        if self.slow_only_var.get():
+            records = [r for r in records if r['ms'] >= self.profiler.slow_ms]
+        # Newest first
+        self.performance_records = records[::-1]
+
+        self.performance_tree.delete(*self.performance_tree.get_children())
+        for index, record in enumerate(self.performance_records):
+            self.performance_tree.insert('', 'end', iid=index, values=(
+                record['kind'], f"{record['ms']:.2f}", '' if record['rows'] is None else record['rows'],
+                record['label'][:200], record['site'] or ''))
+
+    def clear_performance(self):
+        self.profiler.clear()
+        self.refresh_performance()
+
+    def show_performance_details(self, event=None):
+        selected = self.performance_tree.focus()
+        if not selected:
+            return
+        record = self.performance_records[int(selected)]
+        details = f"{record['label']}\n\nCalled from: {record['site']}\nThread: {record['thread']}"
+        if 'plan' in record:
+            details += "\n\nQuery plan:\n" + '\n'.join(record['plan'] or ['(unavailable)'])
+        self.performance_details.delete(1.0, tk.END)
+        self.performance_details.insert(1.0, details)
 
     def create_label(self, parent, text, row, column):
         label = ttk.Label(parent, text=text)
@@ -188,23 +496,30 @@ class FinanceApp(tk.Tk):
             messagebox.showerror("Input Error", "Please enter a valid amount.")
             return
 
-        if self.editing_transaction_id:  # If editing a transaction
-            try:
-                # Update the existing transaction
-                self.cursor.execute("UPDATE transactions SET type = ?, amount = ?, date = ?, description = ? WHERE id = ?",
-                                    (transaction_type, amount, date, description, self.editing_transaction_id))
-                self.conn.commit()
+        if self.import_running():
+            return
+
+        editing = bool(self.editing_transaction_id)
+
+        def saved(result):
+            if isinstance(result, Exception):
+                action = "update" if editing else "add"
+                messagebox.showerror(
+                    "Database Error", f"Failed to {action} transaction: {result}")
+                return
+            old_row, new_row = result
+            if editing:
                 messagebox.showinfo(
                     "Success", "Transaction updated successfully!")
-            except Exception as e:
-                messagebox.showerror(
-                    "Database Error", f"Failed to update transaction: {e}")
-        else:
-            # Add a new transaction
-            self.cursor.execute("INSERT INTO transactions (type, amount, date, description) VALUES (?, ?, ?, ?)",
-                                (transaction_type, amount, date, description))
-            self.conn.commit()
-            messagebox.showinfo("Success", "Transaction added successfully!")
+            else:
+                messagebox.showinfo(
+                    "Success", "Transaction added successfully!")
+            # Update only the changed row and dashboard figures
+            self.apply_change(old_row, new_row)
+
+        # Add a new transaction, or update the one being edited
+        self.submit_write(saved, finance_db.save_transaction, self.editing_transaction_id,
+                          transaction_type, amount, date, description)
 
         # Clear the editing state
         self.editing_transaction_id = None
@@ -212,16 +527,18 @@ class FinanceApp(tk.Tk):
         # Clear the input fields
         self.clear_entries()
 
-        # Update the treeview and dashboard
-        self.update_treeview()
-        self.update_dashboard()
-
     def edit_transaction(self):
-        selected = self.tree.focus()  # Get the currently selected item in the treeview
-        if not selected:
+        selection = self.tree.selection()
+        if not selection:
             messagebox.showerror(
                 "Error", "Please select a transaction to edit.")
             return
+        if self.import_running():
+            return
+        if len(selection) > 1 or self.select_all_filter:
+            self.bulk_edit_dialog()
+            return
+        selected = selection[0]
 
         # Get the selected transaction's ID and details
         transaction_details = self.tree.item(selected)['values']
@@ -241,11 +558,17 @@ class FinanceApp(tk.Tk):
             "Info", "Transaction details loaded. Make changes and click 'Add' to save.")
 
     def delete_transaction(self):
-        selected = self.tree.focus()
-        if not selected:
+        selection = self.tree.selection()
+        if not selection:
             messagebox.showerror(
                 "Error", "Please select a transaction to delete.")
             return
+        if self.import_running():
+            return
+        if len(selection) > 1 or self.select_all_filter:
+            self.bulk_delete()
+            return
+        selected = selection[0]
 
         # Get the selected transaction's ID
         transaction_id = self.tree.item(selected)['values'][0]
@@ -254,21 +577,397 @@ class FinanceApp(tk.Tk):
             messagebox.showerror("Error", "Unable to retrieve transaction ID.")
             return
 
+        def deleted(old_row):
+            # The deleted row, None if it was already gone, or an exception
+            if old_row is None or isinstance(old_row, Exception):
+                messagebox.showerror(
+                    "Error", "Failed to delete the transaction.")
+            else:
+                messagebox.showinfo(
+                    "Success", "Transaction deleted successfully!")
+                self.apply_change(old_row, None)
+
         # Delete the transaction from the database
-        self.cursor.execute(
-            "DELETE FROM transactions WHERE id = ?", (transaction_id,))
-        self.conn.commit()
-
-        # Verify deletion
-        self.cursor.execute(
-            "SELECT * FROM transactions WHERE id = ?", (transaction_id,))
-        result = self.cursor.fetchone()
-        if result:
-            messagebox.showerror("Error", "Failed to delete the transaction.")
+        self.submit_write(
+            deleted, finance_db.remove_transaction, transaction_id)
+
+    def select_all(self):
+        children = self.tree.get_children()
+        if not children:
+            return
+        self.select_all_count = finance_db.count_transactions(
+            self.cursor, **self.filters)
+        self.select_all_filter = True
+        self.tree.selection_set(*children)
+        self.status_label.config(
+            text=f"All {self.select_all_count} matching transactions selected")
+
+    def on_tree_select(self, event=None):
+        # Any selection other than every loaded row ends Select All
+        if self.select_all_filter and set(self.tree.selection()) != set(self.tree.get_children()):
+            self.select_all_filter = False
+            self.status_label.config(text="")
+
+    def selection_scope(self):
+        # (ids, filters, count) for the bulk statements: the selected ids,
+        # or after Select All every row matching the filter bar
+        if self.select_all_filter:
+            return None, dict(self.filters), self.select_all_count
+        ids = [int(item) for item in self.tree.selection()]
+        return ids, None, len(ids)
+
+    def bulk_delete(self):
+        ids, filters, count = self.selection_scope()
+        if not messagebox.askyesno("Confirm Delete", f"Delete {count} transactions?"):
+            return
+
+        def deleted(result):
+            if isinstance(result, Exception):
+                messagebox.showerror(
+                    "Database Error", f"Failed to delete transactions: {result}")
+                return
+            deleted_count, read_only, deltas = result
+            messagebox.showinfo(
+                "Success", f"{deleted_count} transactions deleted successfully!"
+                + self.read_only_note(read_only))
+            self.apply_bulk_change(ids, deltas, deleted=True, read_only=read_only)
+
+        self.submit_write(deleted, finance_db.delete_transactions, ids, filters)
+
+    def bulk_edit_dialog(self):
+        ids, filters, count = self.selection_scope()
+        dialog = tk.Toplevel(self, bg=self.bg_color)
+        dialog.title(f"Edit {count} Transactions")
+        dialog.transient(self)
+
+        ttk.Label(dialog, text="Tick the fields to set on every selected transaction.").grid(
+            row=0, column=0, columnspan=2, padx=20, pady=20)
+        type_var = tk.StringVar()
+        fields = {
+            'type': ("Type", ttk.Combobox(dialog, textvariable=type_var, values=['Income', 'Expense'],
+                                          state='readonly', font=('Helvetica', 16))),
+            'amount': ("Amount", ttk.Entry(dialog, font=('Helvetica', 16))),
+            'date': ("Date", DateEntry(dialog, font=('Helvetica', 16), date_pattern='dd-mm-yyyy',
+                                       background=self.light_bg, foreground=self.text_color)),
+            'description': ("Description", ttk.Entry(dialog, font=('Helvetica', 16))),
+        }
+        enabled = {}
+        for row, (column, (text, widget)) in enumerate(fields.items(), start=1):
+            enabled[column] = tk.BooleanVar(value=False)
+            ttk.Checkbutton(dialog, text=text, variable=enabled[column]).grid(
+                row=row, column=0, padx=20, pady=10, sticky='w')
+            widget.grid(row=row, column=1, padx=20, pady=10, sticky='ew')
+
+        def apply():
+            changes = {}
+            for column, (text, widget) in fields.items():
+                if not enabled[column].get():
+                    continue
+                if column == 'date':
+                    changes[column] = widget.get_date().strftime('%d-%m-%Y')
+                elif column == 'amount':
+                    try:
+                        changes[column] = float(widget.get())
+                    except ValueError:
+                        messagebox.showerror(
+                            "Input Error", "Please enter a valid amount.", parent=dialog)
+                        return
+                elif column == 'type' and not type_var.get():
+                    messagebox.showerror(
+                        "Input Error", "Please choose a transaction type.", parent=dialog)
+                    return
+                else:
+                    changes[column] = widget.get()
+            if not changes:
+                messagebox.showerror(
+                    "Input Error", "Tick at least one field to change.", parent=dialog)
+                return
+            dialog.destroy()
+
+            def updated(result):
+                if isinstance(result, Exception):
+                    messagebox.showerror(
+                        "Database Error", f"Failed to update transactions: {result}")
+                    return
+                updated_count, read_only, deltas = result
+                messagebox.showinfo(
+                    "Success", f"{updated_count} transactions updated successfully!"
+                    + self.read_only_note(read_only))
+                self.apply_bulk_change(ids, deltas, deleted=False)
+
+            self.submit_write(updated, finance_db.update_transactions,
+                              changes, ids, filters)
+
+        button_frame = tk.Frame(dialog, bg=self.bg_color)
+        button_frame.grid(row=len(fields) + 1, column=0, columnspan=2, pady=20)
+        ttk.Button(button_frame, text="Apply", command=apply,
+                   style='TButton').pack(side='left', padx=10)
+        ttk.Button(button_frame, text="Cancel", command=dialog.destroy,
+                   style='TButton').pack(side='left', padx=10)
+        dialog.grab_set()
+
+    def read_only_note(self, read_only):
+        if not read_only:
+            return ""
+        return (f"\n\n{read_only} selected transactions are in closed years and were left "
+                "unchanged. Reopen those years to change them.")
+
+    def apply_bulk_change(self, ids, deltas, deleted, read_only=0):
+        # Propagate a bulk update or delete to the loaded rows and the
+        # dashboard. ids is None after Select All, when every loaded row
+        # was part of the change. read_only counts selected rows in closed
+        # years, which a delete leaves in place.
+        if ids is None:
+            loaded = list(self.tree.get_children())
         else:
-            messagebox.showinfo("Success", "Transaction deleted successfully!")
+            loaded = [str(i) for i in ids if self.tree.exists(i)]
+
+        if deleted and read_only:
+            # Only drop the rows that are gone
+            remaining = {str(row[0]) for row in finance_db.fetch_transactions(
+                self.cursor, [int(i) for i in loaded])}
+            self.tree.delete(*[i for i in loaded if i not in remaining])
+        elif deleted:
+            self.tree.delete(*loaded)
+            if ids is None:
+                # Nothing matching the filter bar is left
+                self.window.has_rows_above = self.window.has_rows_below = False
+        elif loaded:
+            # One query for the changed rows still in view; rows that no
+            # longer match the filter bar drop out
+            rows = finance_db.fetch_transactions(
+                self.cursor, [int(i) for i in loaded], **self.filters)
+            for row in rows:
+                self.tree.item(row[0], values=row)
+            remaining = {str(row[0]) for row in rows}
+            self.tree.delete(*[i for i in loaded if i not in remaining])
+        self.window.recount()
+        self.reload_if_emptied()
+        self.place_scrollbar()
+
+        self.select_all_filter = False
+        self.status_label.config(text="")
+        for ttype, delta in deltas.items():
+            self.totals[ttype] = self.totals.get(ttype, 0.0) + delta
+        self.update_balance_label()
+        self.schedule_dashboard_refresh()
+
+    def submit_write(self, done, function, *args):
+        # Run function(cursor, *args) and commit, then call done with its
+        # result or the exception it raised. With the write-behind queue,
+        # done runs later, once the writer thread confirms the commit.
+        if self.writer is None:
+            try:
+                result = function(self.cursor, *args)
+                self.commit()
+            except Exception as e:
+                self.conn.rollback()
+                result = e
+            done(result)
+            return
+
+        self.pending_writes[self.writer.submit(function, *args)] = done
+        if self.write_poll_job is None:
+            self.write_poll_job = self.after(WRITE_POLL_MS, self.poll_writes)
+
+    def poll_writes(self):
+        self.write_poll_job = None
+        while True:
+            try:
+                token, result = self.writer.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending_writes.pop(token)(result)
+
+        if self.pending_writes and self.write_poll_job is None:
+            self.write_poll_job = self.after(WRITE_POLL_MS, self.poll_writes)
+
+    def shutdown(self):
+        # Runs once the main loop has ended: commit any queued writes
+        # before the process exits
+        if self.writer:
+            self.writer.stop()
+        if self.dashboard_worker:
+            self.dashboard_worker.stop()
+        self.profiler.close()
+        self.conn.close()
+
+    def reload_if_emptied(self):
+        # Paging keys off the first and last loaded rows, so a window
+        # emptied by deletes or edits is reloaded while rows remain outside it
+        if not self.tree.get_children() and (self.window.has_rows_above or self.window.has_rows_below):
+            self.update_treeview()
+
+    def apply_change(self, old_row, new_row):
+        # Propagate one inserted, updated or deleted row to the treeview
+        # and the dashboard without re-reading the table
+        matches = bool(new_row) and (not self.filters or finance_db.matches_filter(
+            self.cursor, new_row[0], **self.filters))
+        # Only listed rows are edited or deleted, so the old row matched
+        self.window.count_change((old_row or new_row)[0], matches - bool(old_row))
+        if old_row and not new_row:
+            if self.tree.exists(old_row[0]):
+                self.tree.delete(old_row[0])
+        elif not matches:
+            # The row no longer (or never did) match the filter bar
+            if self.tree.exists(new_row[0]):
+                self.tree.delete(new_row[0])
+        elif self.tree.exists(new_row[0]):
+            self.tree.item(new_row[0], values=new_row)
+        elif old_row is None and not self.window.has_rows_below:
+            # A new row has the highest id, so it belongs at the end, which
+            # is only loaded when the window reaches the end of the table.
+            # An edited row outside the window stays unloaded.
+            self.tree.insert('', 'end', iid=new_row[0], values=new_row)
+        self.reload_if_emptied()
+        self.place_scrollbar()
+
+        if old_row:
+            _, ttype, amount, _, _ = old_row
+            self.totals[ttype] = self.totals.get(ttype, 0.0) - amount
+        if new_row:
+            _, ttype, amount, _, _ = new_row
+            self.totals[ttype] = self.totals.get(ttype, 0.0) + amount
+
+        # The balance is known right away; the charts follow from the worker
+        self.update_balance_label()
+        self.schedule_dashboard_refresh()
+
+    def import_statement(self):
+        path = filedialog.askopenfilename(title="Import Bank Statement", filetypes=[
+            ("Bank statements", "*.csv *.ofx *.qfx"), ("All files", "*.*")])
+        if not path:
+            return
+        date_format = None
+        if not path.lower().endswith(('.ofx', '.qfx')):
+            date_format = self.ask_date_format()
+            if date_format is False:
+                return
+
+        def work(conn, progress):
+            return finance_db.import_statement(
+                conn, path, progress=lambda imported, rejected, done, total: progress(
+                    imported, done / total if total else 1), date_format=date_format)
+
+        def finish(result):
+            imported, rejected = result
+            # One refresh for the whole import
             self.update_treeview()
             self.update_dashboard()
+            messagebox.showinfo(
+                "Success", f"Imported {imported} transactions ({rejected} rows rejected).")
+
+        self.start_job("Import", work, finish, writes=True)
+
+    def ask_date_format(self):
+        # The strptime format of a CSV statement's dates, None to accept any
+        # of the usual formats, or False if the import was cancelled
+        dialog = tk.Toplevel(self, bg=self.bg_color)
+        dialog.title("Statement Dates")
+        dialog.transient(self)
+        ttk.Label(dialog, text="How are dates written in this statement?").grid(
+            row=0, column=0, columnspan=2, padx=20, pady=20)
+        choice = tk.StringVar(value=next(iter(STATEMENT_DATE_FORMATS)))
+        ttk.Combobox(dialog, textvariable=choice, values=list(STATEMENT_DATE_FORMATS),
+                     state='readonly', font=('Helvetica', 16), width=30).grid(
+            row=1, column=0, columnspan=2, padx=20, pady=10, sticky='ew')
+        result = [False]
+
+        def accept():
+            result[0] = STATEMENT_DATE_FORMATS[choice.get()]
+            dialog.destroy()
+
+        ttk.Button(dialog, text="Import", command=accept,
+                   style='TButton').grid(row=2, column=0, padx=10, pady=20)
+        ttk.Button(dialog, text="Cancel", command=dialog.destroy,
+                   style='TButton').grid(row=2, column=1, padx=10, pady=20)
+        dialog.grab_set()
+        self.wait_window(dialog)
+        return result[0]
+
+    def export_transactions(self):
+        path = filedialog.asksaveasfilename(title="Export Transactions", defaultextension=".csv", filetypes=[
+            ("CSV", "*.csv"), ("Parquet", "*.parquet")])
+        if not path:
+            return
+
+        # Exports what the filter bar currently selects
+        filters = dict(self.filters)
+
+        def work(conn, progress):
+            return finance_db.export_transactions(conn, path, progress=progress, **filters)
+
+        def finish(exported):
+            messagebox.showinfo(
+                "Success", f"Exported {exported} transactions.")
+
+        self.start_job("Export", work, finish)
+
+    def start_job(self, title, work, finish, writes=False):
+        # Run work(conn, progress) on a background thread with its own
+        # connection; progress(rows, fraction=None) updates the status line
+        # and finish(result) runs on the Tk thread afterwards. Jobs that
+        # write hold one transaction throughout, so edits are refused
+        # until they finish; see import_running
+        if self.job_thread and self.job_thread.is_alive():
+            messagebox.showerror(
+                "Error", "Please wait for the running import or export to finish.")
+            return
+
+        self.job_title = title
+        self.job_finish = finish
+        self.job_writes = writes
+        self.job_events = queue.Queue()
+        self.job_thread = threading.Thread(
+            target=self.run_job, args=(work,), daemon=True)
+        self.job_thread.start()
+        self.status_label.config(text=f"{title} running...")
+        self.after(JOB_POLL_MS, self.poll_job)
+
+    def import_running(self):
+        # True (after telling the user) while an import holds the write
+        # lock; an edit would wait out SQLite's busy timeout and then fail
+        if self.job_writes and self.job_thread and self.job_thread.is_alive():
+            messagebox.showerror(
+                "Import Running", "Please wait for the running import to finish.")
+            return True
+        return False
+
+    def run_job(self, work):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            finance_db.attach_partitions(conn)
+            result = work(conn, lambda *state: self.job_events.put(('progress', state)))
+            self.job_events.put(('done', result))
+        except Exception as e:
+            self.job_events.put(('error', e))
+        finally:
+            conn.close()
+
+    def poll_job(self):
+        while True:
+            try:
+                kind, payload = self.job_events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == 'progress':
+                rows, fraction = (*payload, None)[:2]
+                status = f"{self.job_title} running... {rows} rows"
+                if fraction is not None:
+                    status += f" ({100 * fraction:.0f}%)"
+                self.status_label.config(text=status)
+                continue
+
+            self.status_label.config(text="")
+            if kind == 'done':
+                self.job_finish(payload)
+            else:
+                messagebox.showerror(
+                    f"{self.job_title} Error", f"{self.job_title} failed: {payload}")
+            return
+
+        self.after(JOB_POLL_MS, self.poll_job)
 
     def clear_entries(self):
         self.type_var.set('')
@@ -276,73 +975,111 @@ class FinanceApp(tk.Tk):
         self.date_entry.set_date(datetime.now())
         self.description_entry.delete(0, tk.END)
 
+    def build_dashboard(self):
+        # Heavy imports happen here, on first use, rather than at startup
+        if self.canvas is not None:
+            return
+        with self.profiler.measure('startup', 'build_dashboard'):
+            import matplotlib
+            matplotlib.use('TkAgg')
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            from matplotlib.figure import Figure
+            import finance_analytics
+            import finance_charts
+
+            self.dashboard_loading_label.destroy()
+            self.dashboard_worker = finance_analytics.DashboardWorker(
+                self.db_path, self.profiler)
+            self.dashboard_worker.start()
+
+            # Dashboard Widgets
+            self.figure = Figure(figsize=(16, 8))
+            self.charts = finance_charts.DashboardCharts(
+                self.figure, self.secondary_color, self.accent_color, self.text_color)
+            self.canvas = FigureCanvasTkAgg(
+                self.figure, master=self.dashboard_tab)
+            self.canvas.get_tk_widget().pack(fill='both', expand=True)
+            # draw_idle ends up in canvas.draw, so timing it covers every redraw
+            self.canvas.draw = self.profiler.wrap(
+                'render', 'canvas.draw', self.canvas.draw)
+            self.canvas.draw()
+
+            # Balance Label
+            self.balance_label = tk.Label(self.dashboard_tab, text="Total Balance: ...", font=(
+                'Helvetica', 24, 'bold'), bg=self.bg_color, fg=self.text_color)
+            self.balance_label.pack(pady=30)
+
+        # Initialize the dashboard
+        self.update_dashboard()
+
     def update_dashboard(self):
-        self.ax1.clear()
-        self.ax2.clear()
+        # Ask the worker for a full recomputation right away
+        if self.dashboard_refresh_job:
+            self.after_cancel(self.dashboard_refresh_job)
+            self.dashboard_refresh_job = None
+        # Not built yet; it computes everything afresh when it is
+        if self.dashboard_worker is None:
+            return
+        self.dashboard_worker.request()
+        if self.dashboard_poll_job is None:
+            self.dashboard_poll_job = self.after(DASHBOARD_POLL_MS, self.poll_dashboard)
 
-        transactions = self.cursor.execute(
-            "SELECT type, amount FROM transactions").fetchall()
-        income = sum(amount for ttype,
-                     amount in transactions if ttype == 'Income')
-        expense = sum(amount for ttype,
-                      amount in transactions if ttype == 'Expense')
+    def schedule_dashboard_refresh(self):
+        # Nothing to refresh until the dashboard has been opened; it
+        # computes everything afresh when it is built
+        if self.dashboard_worker is None:
+            return
+        # Restart the quiet period so rapid edits end in a single refresh
+        if self.dashboard_refresh_job:
+            self.after_cancel(self.dashboard_refresh_job)
+        self.dashboard_refresh_job = self.after(
+            DASHBOARD_DEBOUNCE_MS, self.update_dashboard)
 
-        balance = income - expense
-        self.balance_label.config(text=f"Total Balance: ${balance:.2f}")
+    def poll_dashboard(self):
+        self.dashboard_poll_job = None
+        # Read before draining: a request stops being outstanding only once
+        # its result is queued, so none can be missed after the last poll
+        outstanding = self.dashboard_worker.outstanding
+        # Only the newest result matters when several are waiting
+        result = None
+        while True:
+            try:
+                result = self.dashboard_worker.results.get_nowait()
+            except queue.Empty:
+                break
 
-        if income > 0 or expense > 0:
-            labels = []
-            sizes = []
-            colors = []
-
-            if income > 0:
-                labels.append('Income')
-                sizes.append(income)
-                colors.append(self.secondary_color)
-
-            if expense > 0:
-                labels.append('Expense')
-                sizes.append(expense)
-                colors.append(self.accent_color)
-
-            if sizes:
-                self.ax1.pie(sizes, labels=labels, colors=colors,
-                             autopct='%1.1f%%', startangle=90)
-                self.ax1.set_title("Income vs Expense")
-        else:
-            self.ax1.text(0.5, 0.5, 'No Data Available', horizontalalignment='center',
-                          verticalalignment='center', transform=self.ax1.transAxes, fontsize=24, color=self.text_color)
-
-        # Cash Flow Over Time
-        transactions = self.cursor.execute(
-            "SELECT type, amount, date FROM transactions ORDER BY date").fetchall()
-
-        income_dates = [datetime.strptime(
-            date, '%d-%m-%Y') for ttype, amount, date in transactions if ttype == 'Income']
-        income_amounts = [amount for ttype, amount,
-                          date in transactions if ttype == 'Income']
-
-        expense_dates = [datetime.strptime(
-            date, '%d-%m-%Y') for ttype, amount, date in transactions if ttype == 'Expense']
-        expense_amounts = [amount for ttype, amount,
-                           date in transactions if ttype == 'Expense']
-
-        if income_dates or expense_dates:
-            self.ax2.plot(income_dates, income_amounts, marker='o',
-                          linestyle='-', color=self.secondary_color, label='Income')
-            self.ax2.plot(expense_dates, expense_amounts, marker='o',
-                          linestyle='-', color=self.accent_color, label='Expense')
-            self.ax2.set_title("Cash Flow Over Time")
-            self.ax2.set_ylabel("Amount ($)")
-            self.ax2.set_xlabel("Date")
-            self.ax2.legend()
-        else:
-            self.ax2.text(0.5, 0.5, 'No Data Available', horizontalalignment='center',
-                          verticalalignment='center', transform=self.ax2.transAxes, fontsize=24, color=self.text_color)
+        if isinstance(result, Exception):
+            messagebox.showerror(
+                "Dashboard Error", f"Failed to refresh the dashboard: {result}")
+        elif result is not None:
+            totals, cash_flow = result
+            self.totals = {'Income': 0.0, 'Expense': 0.0}
+            self.totals.update(totals)
+            self.draw_dashboard(cash_flow)
+
+        # Poll only while the worker has requests to answer
+        if outstanding and self.dashboard_poll_job is None:
+            self.dashboard_poll_job = self.after(DASHBOARD_POLL_MS, self.poll_dashboard)
+
+    def update_balance_label(self):
+        if self.canvas is None:
+            return
+        balance = self.totals['Income'] - self.totals['Expense']
+        self.balance_label.config(text=f"Total Balance: ${balance:.2f}")
 
-        self.canvas.draw()
+    def draw_dashboard(self, cash_flow):
+        self.update_balance_label()
+        self.charts.draw(self.totals, cash_flow)
+        self.canvas.draw_idle()
 
 
 if __name__ == "__main__":
-    app = FinanceApp()
-    app.mainloop()
+    parser = argparse.ArgumentParser(description="Personal finance manager")
+    parser.add_argument('--startup-time', action='store_true',
+                        help="print how long each startup phase took and exit once the window is interactive")
+    args = parser.parse_args()
+    app = FinanceApp(report_startup=args.startup_time)
+    try:
+        app.mainloop()
+    finally:
+        app.shutdown()
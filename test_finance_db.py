@@ -0,0 +1,563 @@
+# Tests for the finance database layer
+#
+# Run from the repository root with "python -m pytest test_finance_db.py" or
+# "python test_finance_db.py". Each test works on a fresh database in a
+# temporary folder; closed years are counted back from the current one.
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import stat
+import tempfile
+import unittest
+from datetime import datetime
+
+import finance_db
+import finance_profiler
+
+THIS_YEAR = datetime.now().year
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'finance.db')
+        self.conn = finance_db.connect(self.path)
+
+    def tearDown(self):
+        self.conn.close()
+        # Closed years are made read-only
+        for name in os.listdir(self.folder):
+            os.chmod(os.path.join(self.folder, name), stat.S_IREAD | stat.S_IWRITE)
+        shutil.rmtree(self.folder)
+
+    def add_years(self, years, per_year=6):
+        # per_year rows on different days of each year, alternating type
+        cursor = self.conn.cursor()
+        for year in years:
+            for n in range(per_year):
+                ttype = 'Income' if n % 2 else 'Expense'
+                finance_db.insert_transaction(cursor, ttype, 10.0 * n + year % 100,
+                                              f"{n + 1:02d}-{n % 12 + 1:02d}-{year}",
+                                              f"{ttype.lower()} {year} item {n}")
+        self.conn.commit()
+
+    def partitions(self, conn=None):
+        return [year for (year,) in (conn or self.conn).execute(
+            "SELECT year FROM partitions ORDER BY year")]
+
+    def snapshot(self):
+        # Everything the UI reads: pages in both directions, filtered pages,
+        # counts and the dashboard totals
+        cursor = self.conn.cursor()
+        first = finance_db.fetch_page(cursor, 5)
+        return {
+            'all': finance_db.fetch_page(cursor, 1000),
+            'next': finance_db.fetch_page(cursor, 5, after_id=first[-1][0]),
+            'previous': finance_db.fetch_page(cursor, 3, before_id=first[-1][0]),
+            'income': finance_db.fetch_page(cursor, 1000, ttype='Income'),
+            'search': finance_db.fetch_page(cursor, 1000, text='item 3'),
+            'dated': finance_db.fetch_page(cursor, 1000, start=f"{THIS_YEAR - 2}-03-01",
+                                           end=f"{THIS_YEAR - 1}-03-31"),
+            'count': finance_db.count_transactions(cursor),
+            'totals': finance_db.read_totals(cursor),
+        }
+
+
+class PartitionTest(DatabaseTestCase):
+    def test_close_and_reopen_keep_rollups_and_pages(self):
+        self.add_years([THIS_YEAR - 3, THIS_YEAR - 2, THIS_YEAR - 1, THIS_YEAR])
+        before = self.snapshot()
+
+        self.assertEqual(finance_db.close_year(self.conn, THIS_YEAR - 2), 6)
+        self.assertEqual(finance_db.close_year(self.conn, THIS_YEAR - 1), 6)
+        self.assertEqual(self.partitions(), [THIS_YEAR - 2, THIS_YEAR - 1])
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+        self.assertEqual(self.snapshot(), before)
+
+        self.assertEqual(finance_db.reopen_year(self.conn, THIS_YEAR - 2), 6)
+        self.assertEqual(self.partitions(), [THIS_YEAR - 1])
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+        self.assertEqual(self.snapshot(), before)
+        self.assertFalse(os.path.exists(finance_db.partition_path(self.conn, THIS_YEAR - 2)))
+
+    def test_closed_year_survives_reconnect(self):
+        self.add_years([THIS_YEAR - 1, THIS_YEAR])
+        before = self.snapshot()
+        finance_db.close_year(self.conn, THIS_YEAR - 1)
+        self.conn.close()
+        self.conn = finance_db.connect(self.path)
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+        self.assertEqual(self.snapshot(), before)
+
+    def test_open_and_closed_years_are_refused(self):
+        self.add_years([THIS_YEAR - 1])
+        with self.assertRaises(ValueError):
+            finance_db.close_year(self.conn, THIS_YEAR)
+        finance_db.close_year(self.conn, THIS_YEAR - 1)
+        with self.assertRaises(ValueError):
+            finance_db.close_year(self.conn, THIS_YEAR - 1)
+        with self.assertRaises(ValueError):
+            finance_db.reopen_year(self.conn, THIS_YEAR - 2)
+
+    def test_bulk_changes_leave_closed_rows_alone(self):
+        self.add_years([THIS_YEAR - 1, THIS_YEAR])
+        finance_db.close_year(self.conn, THIS_YEAR - 1)
+        cursor = self.conn.cursor()
+        closed_ids = [row[0] for row in finance_db.fetch_page(cursor, 1000, end=f"{THIS_YEAR - 1}-12-31")]
+
+        updated, read_only, deltas = finance_db.update_transactions(
+            cursor, {'amount': 1.0}, filters={'ttype': 'Income'})
+        self.conn.commit()
+        self.assertEqual((updated, read_only), (3, 3))
+        self.assertEqual(set(deltas), {'Income'})
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+
+        deleted, read_only, deltas = finance_db.delete_transactions(cursor, filters={})
+        self.conn.commit()
+        self.assertEqual((deleted, read_only), (6, 6))
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+        self.assertEqual([row[0] for row in finance_db.fetch_page(cursor, 1000)], closed_ids)
+        # The deltas bring the totals the UI held down to the closed rows
+        totals = {'Income': 0.0, 'Expense': 0.0}
+        for row in finance_db.fetch_page(cursor, 1000):
+            totals[row[1]] += row[2]
+        for ttype, total in finance_db.read_totals(cursor).items():
+            self.assertAlmostEqual(total, totals[ttype])
+
+    def test_single_row_changes_to_closed_rows_are_refused(self):
+        self.add_years([THIS_YEAR - 1])
+        finance_db.close_year(self.conn, THIS_YEAR - 1)
+        cursor = self.conn.cursor()
+        row = finance_db.fetch_page(cursor, 1)[0]
+        with self.assertRaises(ValueError):
+            finance_db.save_transaction(cursor, row[0], 'Income', 1.0, row[3], row[4])
+        with self.assertRaises(ValueError):
+            finance_db.remove_transaction(cursor, row[0])
+        self.conn.rollback()
+        self.assertEqual(finance_db.fetch_transaction(cursor, row[0]), row)
+
+
+class CloseThroughTest(DatabaseTestCase):
+    def run_main(self, *args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+            status = finance_db.main(['--db', self.path, *args])
+        return status, output.getvalue()
+
+    def test_skips_closed_and_current_years(self):
+        self.add_years([THIS_YEAR - 3, THIS_YEAR - 2, THIS_YEAR - 1, THIS_YEAR])
+        before = self.snapshot()
+        finance_db.close_year(self.conn, THIS_YEAR - 2)
+
+        status, output = self.run_main('partition', 'close', '--through', str(THIS_YEAR))
+        self.assertEqual(status, 0)
+        self.assertIn(f"Closed {THIS_YEAR - 3}", output)
+        self.assertIn(f"Closed {THIS_YEAR - 1}", output)
+        self.assertNotIn(f"Closed {THIS_YEAR - 2}", output)
+        self.assertNotIn(f"Closed {THIS_YEAR}:", output)
+
+        self.conn.close()
+        self.conn = finance_db.connect(self.path)
+        self.assertEqual(self.partitions(), [THIS_YEAR - 3, THIS_YEAR - 2, THIS_YEAR - 1])
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+        self.assertEqual(self.snapshot(), before)
+
+    def test_nothing_left_to_close(self):
+        self.add_years([THIS_YEAR - 1, THIS_YEAR])
+        finance_db.close_year(self.conn, THIS_YEAR - 1)
+        status, output = self.run_main('partition', 'close', '--through', str(THIS_YEAR - 1))
+        self.assertEqual(status, 0)
+        self.assertIn("No open years", output)
+
+
+class RollupTriggerTest(DatabaseTestCase):
+    def test_single_row_changes_keep_rollups_current(self):
+        cursor = self.conn.cursor()
+        ids = [finance_db.insert_transaction(cursor, ttype, amount, date, "item")
+               for ttype, amount, date in [('Income', 100.0, '01-01-2024'), ('Expense', 40.0, '01-01-2024'),
+                                           ('Expense', 15.5, '20-02-2024'), ('Income', 7.25, '03-03-2024')]]
+        self.conn.commit()
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+
+        changes = [
+            # amount only, then type only, then date only (new day and month)
+            lambda: finance_db.update_transaction(cursor, ids[0], 'Income', 120.0, '01-01-2024', "item"),
+            lambda: finance_db.update_transaction(cursor, ids[1], 'Income', 40.0, '01-01-2024', "item"),
+            lambda: finance_db.update_transaction(cursor, ids[2], 'Expense', 15.5, '05-04-2024', "item"),
+            # type, amount and date at once
+            lambda: finance_db.update_transaction(cursor, ids[3], 'Expense', 9.0, '20-02-2024', "item"),
+            lambda: finance_db.delete_transaction(cursor, ids[0]),
+            lambda: finance_db.insert_transaction(cursor, 'Expense', 3.0, '01-01-2024', "item"),
+        ]
+        for step, change in enumerate(changes):
+            with self.subTest(step=step):
+                change()
+                self.conn.commit()
+                self.assertEqual(finance_db.verify_rollups(self.conn), [])
+
+        self.assertEqual(finance_db.read_totals(cursor), {'Income': 40.0, 'Expense': 27.5})
+        # Buckets that no longer hold any row are removed
+        self.assertEqual(self.conn.execute("SELECT DISTINCT month FROM monthly_totals ORDER BY 1").fetchall(),
+                         [('2024-01',), ('2024-02',), ('2024-04',)])
+
+    def test_missing_amount_is_rejected(self):
+        cursor = self.conn.cursor()
+        with self.assertRaises(ValueError):
+            finance_db.insert_transaction(cursor, 'Income', None, '01-01-2024', "no amount")
+        row_id = finance_db.insert_transaction(cursor, 'Income', 1.0, '01-01-2024', "item")
+        with self.assertRaises(ValueError):
+            finance_db.update_transaction(cursor, row_id, 'Income', None, '01-01-2024', "item")
+        self.conn.commit()
+        self.assertEqual(finance_db.read_totals(cursor), {'Income': 1.0})
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+
+
+class MigrationTest(DatabaseTestCase):
+    def test_baseline_ledger_is_upgraded(self):
+        # A ledger written before any migration: the original table, rows
+        # without iso_date, no rollups or search index, user_version 0
+        path = os.path.join(self.folder, 'baseline.db')
+        rows = [(n + 1, 'Income' if n % 3 == 0 else 'Expense', 5.0 * n + 0.25,
+                 f"{n % 28 + 1:02d}-{n % 12 + 1:02d}-{2020 + n % 4}",
+                 'rent payment' if n % 5 == 0 else f"item {n}")
+                for n in range(25)]
+        conn = sqlite3.connect(path)
+        conn.execute('''CREATE TABLE transactions
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, amount REAL, date TEXT, description TEXT)''')
+        conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?)", rows)
+        conn.commit()
+        conn.close()
+
+        # Backfill iso_date across several batches
+        batch_size = finance_db.MIGRATION_BATCH_SIZE
+        self.addCleanup(setattr, finance_db, 'MIGRATION_BATCH_SIZE', batch_size)
+        finance_db.MIGRATION_BATCH_SIZE = 10
+        conn = finance_db.connect(path)
+        self.addCleanup(conn.close)
+        cursor = conn.cursor()
+
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], len(finance_db.MIGRATIONS))
+        self.assertEqual(conn.execute(
+            "SELECT id, type, amount, date, description FROM transactions ORDER BY id").fetchall(), rows)
+        self.assertEqual(conn.execute("SELECT id, iso_date FROM transactions ORDER BY id").fetchall(),
+                         [(row[0], finance_db.to_iso_date(row[3])) for row in rows])
+        self.assertEqual(finance_db.verify_rollups(conn), [])
+        totals = {}
+        for _, ttype, amount, _, _ in rows:
+            totals[ttype] = totals.get(ttype, 0.0) + amount
+        self.assertEqual(finance_db.read_totals(cursor), totals)
+        self.assertEqual([row[0] for row in finance_db.fetch_page(cursor, 100, text='rent')],
+                         [row[0] for row in rows if row[4] == 'rent payment'])
+
+        # New rows keep the migrated columns and rollups current
+        finance_db.insert_transaction(cursor, 'Expense', 12.5, '15-06-2024', 'rent payment')
+        conn.commit()
+        self.assertEqual(conn.execute("SELECT iso_date FROM transactions ORDER BY id DESC LIMIT 1").fetchone(),
+                         ('2024-06-15',))
+        self.assertEqual(finance_db.verify_rollups(conn), [])
+
+
+class SearchPagingTest(DatabaseTestCase):
+    def expected(self, text, ttype=None, start=None, end=None, min_amount=None):
+        # The matching rows, found without the FTS index or the filters
+        def matches(row):
+            words = row[4].lower().split()
+            iso_date = finance_db.to_iso_date(row[3])
+            return (all(any(word.startswith(term) for word in words) for term in text.lower().split())
+                    and ttype in (None, row[1]) and (start is None or iso_date >= start)
+                    and (end is None or iso_date <= end) and (min_amount is None or row[2] >= min_amount))
+        return [row for row in finance_db.fetch_page(self.conn.cursor(), 1000) if matches(row)]
+
+    def walk_forward(self, size, **filters):
+        cursor = self.conn.cursor()
+        rows = finance_db.fetch_page(cursor, size, **filters)
+        pages = [rows]
+        while len(rows) == size:
+            rows = finance_db.fetch_page(cursor, size, after_id=rows[-1][0], **filters)
+            pages.append(rows)
+        return pages
+
+    def walk_backward(self, size, last_id, **filters):
+        # Pages before last_id, as the table loads them when scrolling up
+        cursor = self.conn.cursor()
+        rows = finance_db.fetch_page(cursor, size, before_id=last_id, **filters)
+        pages = [rows]
+        while finance_db.has_rows_before(cursor, rows[0][0], **filters):
+            self.assertEqual(len(rows), size)
+            rows = finance_db.fetch_page(cursor, size, before_id=rows[0][0], **filters)
+            pages.insert(0, rows)
+        return pages
+
+    def check_pages(self, expected, **filters):
+        self.assertGreater(len(expected), 3)
+        forward = self.walk_forward(3, **filters)
+        self.assertGreater(len(forward), 1)
+        self.assertTrue(all(len(page) <= 3 for page in forward))
+        self.assertEqual([row for page in forward for row in page], expected)
+
+        backward = self.walk_backward(3, expected[-1][0] + 1, **filters)
+        self.assertEqual([row for page in backward for row in page], expected)
+        self.assertFalse(finance_db.has_rows_before(self.conn.cursor(), expected[0][0], **filters))
+
+    def test_search_pages_in_both_directions(self):
+        self.add_years([THIS_YEAR - 1, THIS_YEAR], per_year=12)
+        for filters in [{'text': 'item 1'}, {'text': 'INC it'},
+                        {'text': 'item', 'ttype': 'Expense', 'min_amount': 40.0}]:
+            with self.subTest(**filters):
+                self.check_pages(self.expected(**filters), **filters)
+
+    def test_search_with_dates_across_a_closed_year(self):
+        self.add_years([THIS_YEAR - 2, THIS_YEAR - 1, THIS_YEAR], per_year=12)
+        finance_db.close_year(self.conn, THIS_YEAR - 1)
+        filters = {'text': 'item 1', 'start': f"{THIS_YEAR - 2}-06-01", 'end': f"{THIS_YEAR - 1}-12-31"}
+        expected = self.expected(**filters)
+        # Rows from the main table and from the closed year
+        self.assertEqual({row[3][-4:] for row in expected}, {str(THIS_YEAR - 2), str(THIS_YEAR - 1)})
+        self.check_pages(expected, **filters)
+
+    def test_counts_match_the_pages(self):
+        # Counts without filters or by type come from the rollups
+        self.add_years([THIS_YEAR - 2, THIS_YEAR - 1, THIS_YEAR], per_year=12)
+        finance_db.close_year(self.conn, THIS_YEAR - 1)
+        cursor = self.conn.cursor()
+        for filters in [{}, {'ttype': 'Income'}, {'ttype': 'Expense'}, {'text': 'item 1'},
+                        {'ttype': 'Income', 'min_amount': 40.0}]:
+            with self.subTest(**filters):
+                rows = finance_db.fetch_page(cursor, 1000, **filters)
+                self.assertEqual(finance_db.count_transactions(cursor, **filters), len(rows))
+                middle = rows[len(rows) // 2][0]
+                self.assertEqual(finance_db.count_transactions(cursor, before_id=middle, **filters),
+                                 len(rows) // 2)
+
+
+class SearchPlanTest(DatabaseTestCase):
+    # The FTS index has to drive searches combined with other filters;
+    # driven from a type index, the MATCH runs once per row of that type
+    def plans(self, **filters):
+        source, key, where, params = finance_db.build_filter(
+            partitions=finance_db.attached_partitions(self.conn), **filters)
+        for sql in (f"SELECT COUNT(*) FROM {source} {where}",
+                    f"SELECT 1 FROM {source} {where} LIMIT 1",
+                    f"SELECT {finance_db.COLUMNS} FROM {source} {where} ORDER BY {key} DESC LIMIT 10"):
+            yield [row[-1] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+    def check_plans(self, **filters):
+        for plan in self.plans(**filters):
+            with self.subTest(plan=plan):
+                first = next(step for step in plan if step.startswith(('SCAN', 'SEARCH')))
+                self.assertIn('VIRTUAL TABLE', first)
+                # transactions is only looked up by the ids FTS found
+                for step in plan:
+                    if step.startswith('SEARCH'):
+                        self.assertRegex(step, r'\b(row)?id=\?')
+                self.assertNotIn('TEMP B-TREE', ' '.join(plan))
+
+    def test_search_with_filters_is_driven_by_fts(self):
+        self.add_years([THIS_YEAR - 1, THIS_YEAR])
+        self.conn.execute("ANALYZE")
+        self.check_plans(text='item', ttype='Expense')
+        self.check_plans(text='item', ttype='Income', min_amount=10.0, start=f"{THIS_YEAR}-01-01")
+
+    def test_search_across_closed_years_is_driven_by_fts(self):
+        self.add_years([THIS_YEAR - 1, THIS_YEAR])
+        finance_db.close_year(self.conn, THIS_YEAR - 1)
+        self.conn.execute("ANALYZE")
+        self.check_plans(text='item', ttype='Expense')
+
+
+class TypeIndexTest(DatabaseTestCase):
+    def indexes(self):
+        return sorted(row[1] for row in self.conn.execute("PRAGMA main.index_list(transactions)"))
+
+    def test_type_filter_pages_without_sorting(self):
+        self.add_years([THIS_YEAR])
+        for keyset, order in (("{key} > ?", ''), ("{key} < ?", 'DESC')):
+            source, key, where, params = finance_db.build_filter(
+                ttype='Expense', keyset=keyset, keyset_params=(3,))
+            plan = ' '.join(row[-1] for row in self.conn.execute(
+                f"EXPLAIN QUERY PLAN SELECT {finance_db.COLUMNS} FROM {source} {where} ORDER BY {key} {order} LIMIT 10",
+                params))
+            with self.subTest(order=order or 'ASC'):
+                self.assertIn('idx_transactions_type_id', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_range_filter_indexes_are_replaced(self):
+        # A ledger migrated before the (type, id) index had three others
+        for sql in ("CREATE INDEX idx_transactions_type_date ON transactions (type, iso_date)",
+                    "CREATE INDEX idx_transactions_type_amount ON transactions (type, amount)",
+                    "CREATE INDEX idx_transactions_amount ON transactions (amount)"):
+            self.conn.execute(sql)
+        self.conn.execute("DROP INDEX idx_transactions_type_id")
+        self.conn.execute("PRAGMA user_version = 3")
+        self.conn.commit()
+        self.conn.close()
+        self.conn = finance_db.connect(self.path)
+        self.assertEqual(self.indexes(), ['idx_transactions_iso_date', 'idx_transactions_type_id'])
+        self.assertEqual(self.conn.execute("PRAGMA user_version").fetchone()[0],
+                         len(finance_db.MIGRATIONS))
+
+
+class ExportTest(DatabaseTestCase):
+    def test_streaming_export_does_not_block_commits(self):
+        self.add_years([THIS_YEAR], per_year=4)
+        reader = finance_db.connect(self.path)
+        try:
+            batches = finance_db.iter_transaction_batches(reader, batch_size=2)
+            first = next(batches)
+            # Fail at once rather than after the busy timeout
+            self.conn.execute("PRAGMA busy_timeout = 0")
+            finance_db.insert_transaction(self.conn.cursor(), 'Income', 1.0,
+                                          f"01-01-{THIS_YEAR}", "during export")
+            self.conn.commit()
+            # The export still sees the ledger as it was when it started
+            self.assertEqual(len(first) + sum(len(batch) for batch in batches), 4)
+        finally:
+            reader.close()
+
+
+class WriteQueueTest(DatabaseTestCase):
+    def start_queue(self, flush_ms, path=None):
+        self.profiler = finance_profiler.Profiler(log_path=None)
+        writer = finance_db.WriteQueue(path or self.path, flush_ms, self.profiler)
+        writer.start()
+        return writer
+
+    def results(self, writer, count):
+        return dict(writer.results.get(timeout=5) for _ in range(count))
+
+    def add(self, writer, description):
+        return writer.submit(finance_db.insert_transaction, 'Income', 1.0,
+                             f"01-01-{THIS_YEAR}", description)
+
+    def descriptions(self):
+        return [row[4] for row in finance_db.fetch_page(self.conn.cursor(), 1000)]
+
+    def commits(self):
+        return [record['rows'] for record in self.profiler.snapshot() if record['kind'] == 'commit']
+
+    def test_writes_within_flush_ms_share_a_commit(self):
+        writer = self.start_queue(300)
+        tokens = [self.add(writer, f"write {n}") for n in range(3)]
+        results = self.results(writer, 3)
+        self.assertEqual(sorted(results), tokens)
+        self.assertEqual(self.commits(), [3])
+        self.assertEqual(self.descriptions(), ["write 0", "write 1", "write 2"])
+        writer.stop()
+
+    def test_failing_write_only_undoes_itself(self):
+        def insert_then_fail(cursor):
+            finance_db.insert_transaction(cursor, 'Income', 1.0, f"01-01-{THIS_YEAR}", "undone")
+            raise ValueError("refused")
+
+        writer = self.start_queue(300)
+        first = self.add(writer, "kept 1")
+        failing = writer.submit(insert_then_fail)
+        last = self.add(writer, "kept 2")
+        results = self.results(writer, 3)
+        self.assertIsInstance(results[failing], ValueError)
+        self.assertNotIsInstance(results[first], Exception)
+        self.assertNotIsInstance(results[last], Exception)
+        self.assertEqual(self.descriptions(), ["kept 1", "kept 2"])
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+        writer.stop()
+
+    def test_stop_commits_queued_writes(self):
+        # Nothing would be committed for a minute without stop()
+        writer = self.start_queue(60000)
+        tokens = [self.add(writer, f"write {n}") for n in range(2)]
+        writer.stop()
+        self.assertEqual(sorted(self.results(writer, 2)), tokens)
+        self.assertEqual(self.descriptions(), ["write 0", "write 1"])
+
+    def test_writes_are_answered_after_the_writer_dies(self):
+        writer = self.start_queue(0, path=os.path.join(self.folder, 'missing', 'finance.db'))
+        queued = self.add(writer, "queued")
+        writer.join(5)
+        self.assertIsNotNone(writer.failure)
+        later = self.add(writer, "later")
+        results = self.results(writer, 2)
+        self.assertIs(results[queued], writer.failure)
+        self.assertIs(results[later], writer.failure)
+
+
+class ParseAmountTest(unittest.TestCase):
+    def test_accepted_amounts(self):
+        for text, amount in [('12.50', 12.5), (' -3 ', -3.0), ('+7', 7.0), ('(4.00)', -4.0),
+                             ('$1,234.56', 1234.56), ('-$5', -5.0), ('$-5', -5.0),
+                             ('(£1,000)', -1000.0), ('€ 2.5', 2.5)]:
+            with self.subTest(text=text):
+                self.assertEqual(finance_db._parse_amount(text), amount)
+
+    def test_rejected_amounts(self):
+        for text in ['nan', 'inf', '-Infinity', '1e999', '', 'abc', '1.234,56', '12,50',
+                     '1,23', '(5', '5)', '--5', '-$-5', '-(5)', '$$5']:
+            with self.subTest(text=text):
+                self.assertIsNone(finance_db._parse_amount(text))
+
+
+class ImportStatementTest(DatabaseTestCase):
+    def write(self, name, text):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            file.write(text)
+        return path
+
+    def rows(self):
+        return [row[1:] for row in finance_db.fetch_page(self.conn.cursor(), 1000)]
+
+    def test_bad_rows_are_rejected(self):
+        path = self.write('statement.csv', "\n".join([
+            "Date,Amount,Description,Type",
+            "05/03/2024,-12.50,Groceries,",
+            "2024-03-06,nan,Poisoned,",
+            "06-03-2024,inf,Poisoned,",
+            "07-03-2024,\"1.234,56\",European,",
+            "31/02/2024,5,No such day,",
+            "08-03-2024,(20.00),Refund,credit",
+            "short",
+        ]) + "\n")
+        self.assertEqual(finance_db.import_statement(self.conn, path), (2, 5))
+        self.assertEqual(self.rows(), [('Expense', 12.5, '05-03-2024', 'Groceries'),
+                                       ('Income', 20.0, '08-03-2024', 'Refund')])
+        self.assertEqual(finance_db.verify_rollups(self.conn), [])
+
+    def test_date_format(self):
+        path = self.write('us.csv', "Date,Amount,Description\n03/05/2024,1,March\n13/05/2024,2,Day first\n")
+        self.assertEqual(finance_db.import_statement(self.conn, path, date_format='%m/%d/%Y'), (1, 1))
+        self.assertEqual(self.rows(), [('Income', 1.0, '05-03-2024', 'March')])
+
+    def indexes(self):
+        return self.conn.execute('''SELECT name, sql FROM sqlite_master WHERE type = 'index'
+                                    AND tbl_name = 'transactions' ORDER BY name''').fetchall()
+
+    def test_indexes_are_rebuilt_or_kept(self):
+        indexes = self.indexes()
+        self.add_years([THIS_YEAR], per_year=8)
+        batch = [('Income', 1.0, f"02-01-{THIS_YEAR}", f"{THIS_YEAR}-01-02", "imported")]
+        # Eight rows make the first a large import, the second a small one
+        for rows in (8, 1):
+            with self.subTest(rows=rows):
+                finance_db.bulk_insert(self.conn, [batch * rows])
+                self.assertEqual(self.indexes(), indexes)
+                self.assertEqual(finance_db.verify_rollups(self.conn), [])
+                self.assertEqual(finance_db.fetch_page(self.conn.cursor(), 1000, text='imported',
+                                                       ttype='Income', start=f"{THIS_YEAR}-01-02",
+                                                       end=f"{THIS_YEAR}-01-02")[-1][4], "imported")
+
+    def test_failed_import_restores_indexes(self):
+        indexes = self.indexes()
+
+        def batches():
+            yield [('Income', 1.0, '02-01-2024', '2024-01-02', "imported")]
+            raise ValueError("unreadable")
+
+        with self.assertRaises(ValueError):
+            finance_db.bulk_insert(self.conn, batches())
+        self.assertEqual(self.indexes(), indexes)
+        self.assertEqual(finance_db.count_transactions(self.conn.cursor()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
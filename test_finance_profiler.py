@@ -0,0 +1,132 @@
+# Tests for the statement profiler
+#
+# Run from the repository root with "python -m pytest test_finance_profiler.py"
+# or "python test_finance_profiler.py". Statements run against an in-memory
+# database; the environment settings are read in a child interpreter, since
+# they are parsed when the module is imported.
+import io
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+import finance_db
+import finance_profiler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ProfiledCursorTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        finance_db.create_schema(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def profiled(self, slow_ms):
+        profiler = finance_profiler.Profiler(slow_ms=slow_ms, log_path=None)
+        return profiler, finance_profiler.ProfiledCursor(self.conn.cursor(), profiler)
+
+    def test_slow_statement_records_its_plan(self):
+        profiler, cursor = self.profiled(slow_ms=0)
+        cursor.execute("SELECT * FROM transactions WHERE iso_date >= ?", ('2024-01-01',))
+        self.assertEqual(cursor.fetchall(), [])
+        record, = profiler.snapshot()
+        self.assertEqual(record['kind'], 'sql')
+        self.assertEqual(record['label'], "SELECT * FROM transactions WHERE iso_date >= ?")
+        self.assertTrue(any('idx_transactions_iso_date' in step for step in record['plan']))
+
+    def test_fast_statement_has_no_plan(self):
+        profiler, cursor = self.profiled(slow_ms=60000)
+        cursor.execute("SELECT * FROM transactions WHERE iso_date >= ?", ('2024-01-01',))
+        cursor.fetchall()
+        record, = profiler.snapshot()
+        self.assertNotIn('plan', record)
+
+    def test_rows_are_counted_once_fetched(self):
+        profiler, cursor = self.profiled(slow_ms=60000)
+        for n in range(5):
+            finance_db.insert_transaction(cursor, 'Income', 1.0, '01-01-2024', f"item {n}")
+        cursor.execute("SELECT id FROM transactions")
+        self.assertEqual(len(cursor.fetchmany(3)), 3)
+        self.assertEqual(len(profiler.snapshot()), 5)
+        self.assertEqual(len(cursor.fetchmany(3)), 2)
+        self.assertEqual(profiler.snapshot()[-1]['rows'], 5)
+
+    def test_call_site_names_the_app_frame(self):
+        profiler, cursor = self.profiled(slow_ms=60000)
+
+        def load_table():
+            finance_db.fetch_page(cursor, 10)
+
+        load_table()
+        site = profiler.snapshot()[-1]['site']
+        first, second = site.split(' > ')
+        self.assertTrue(first.startswith('load_table (test_finance_profiler.py:'))
+        self.assertTrue(second.startswith('fetch_page (finance_db.py:'))
+        self.assertNotIn(' (finance_profiler.py:', site)
+        self.assertNotIn('sqlite3', site)
+
+    def test_measure_names_its_caller(self):
+        profiler = finance_profiler.Profiler(log_path=None)
+        with profiler.measure('render', 'draw'):
+            pass
+        site = profiler.snapshot()[0]['site']
+        self.assertTrue(site.startswith('test_measure_names_its_caller (test_finance_profiler.py:'))
+        self.assertNotIn('contextlib', site)
+
+
+class SettingsTest(unittest.TestCase):
+    def slow_query_ms(self, value):
+        # FINANCE_SLOW_QUERY_MS as parsed by a fresh import, and the warning
+        env = dict(os.environ, FINANCE_SLOW_QUERY_MS=value)
+        result = subprocess.run(
+            [sys.executable, '-c', "import finance_profiler; print(finance_profiler.SLOW_QUERY_MS)"],
+            cwd=HERE, env=env, capture_output=True, text=True, check=True)
+        return float(result.stdout), result.stderr
+
+    def test_valid_threshold(self):
+        self.assertEqual(self.slow_query_ms('12.5'), (12.5, ''))
+
+    def test_invalid_threshold_falls_back(self):
+        for value in ['fast', '', 'nan', 'inf', '-1']:
+            with self.subTest(value=value):
+                slow_ms, warning = self.slow_query_ms(value)
+                self.assertEqual(slow_ms, finance_profiler.DEFAULT_SLOW_QUERY_MS)
+                self.assertIn("Ignoring FINANCE_SLOW_QUERY_MS", warning)
+
+    def test_unopenable_log_keeps_records_in_memory(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        warning = io.StringIO()
+        with redirect_stderr(warning):
+            # A folder cannot be opened as the log
+            profiler = finance_profiler.Profiler(log_path=folder)
+            profiler.record('sql', 'SELECT 1', 0.001, site='test')
+        self.assertIsNone(profiler.log)
+        self.assertEqual(len(profiler.snapshot()), 1)
+        self.assertIn("Not writing the profile log", warning.getvalue())
+
+    def test_failing_log_is_dropped(self):
+        class FullDisk:
+            def write(self, text):
+                raise OSError(28, "No space left on device")
+
+        profiler = finance_profiler.Profiler(log_path=None)
+        profiler.log = FullDisk()
+        warning = io.StringIO()
+        with redirect_stderr(warning):
+            profiler.record('sql', 'SELECT 1', 0.001, site='test')
+            profiler.record('sql', 'SELECT 2', 0.001, site='test')
+        self.assertIsNone(profiler.log)
+        self.assertEqual(len(profiler.snapshot()), 2)
+        self.assertEqual(warning.getvalue().count("Stopped writing the profile log"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+# Tests for the Treeview's keyset window
+#
+# Run from the repository root with "python -m pytest test_finance_window.py"
+# or "python test_finance_window.py". The window pages through an in-memory
+# database into a stub with the parts of ttk.Treeview it uses, so no display
+# is needed.
+import sqlite3
+import unittest
+
+import finance_db
+from finance_window import MAX_LOADED_ROWS, PAGE_SIZE, PageWindow
+
+ROWS = 1000
+
+
+class StubTree:
+    # Items in order with Treeview's string ids, and height rows in view
+    def __init__(self, height=10):
+        self.items = []
+        self.height = height
+        self.top = 0
+
+    def get_children(self):
+        return tuple(self.items)
+
+    def insert(self, parent, index, iid, values):
+        self.items.insert(len(self.items) if index == 'end' else index, str(iid))
+
+    def delete(self, *items):
+        for item in items:
+            self.items.remove(item)
+        self.top = max(0, min(self.top, len(self.items) - self.height))
+
+    def yview(self):
+        if not self.items:
+            return 0.0, 1.0
+        return self.top / len(self.items), min(self.top + self.height, len(self.items)) / len(self.items)
+
+    def yview_moveto(self, fraction):
+        # Like Tk, the view does not scroll past the last row
+        self.top = max(0, min(round(fraction * len(self.items)), len(self.items) - self.height))
+
+
+class PageWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        finance_db.create_schema(self.conn)
+        rows = []
+        for n in range(ROWS):
+            ttype = 'Income' if n % 4 == 0 else 'Expense'
+            rows.append((ttype, 10.0 + n, '01-01-2024', '2024-01-01',
+                         'salary' if ttype == 'Income' else f"item {n}"))
+        finance_db.bulk_insert(self.conn, [rows])
+        self.tree = StubTree()
+        self.window = PageWindow(self.tree, self.conn.cursor())
+
+    def tearDown(self):
+        self.conn.close()
+
+    def expected(self, **filters):
+        return [str(row[0]) for row in finance_db.fetch_page(self.conn.cursor(), ROWS, **filters)]
+
+    def assertWindow(self, expected):
+        # The loaded rows are the matching rows from offset on
+        loaded = self.tree.get_children()
+        self.assertEqual(self.window.total, len(expected))
+        self.assertEqual(loaded, tuple(expected[self.window.offset:self.window.offset + len(loaded)]))
+        # A full page leaves the flags set, so they may only err on the side
+        # of another fetch
+        if self.window.offset > 0:
+            self.assertTrue(self.window.has_rows_above)
+        if self.window.offset + len(loaded) < len(expected):
+            self.assertTrue(self.window.has_rows_below)
+
+    def visible(self):
+        return self.tree.items[self.tree.top]
+
+    def test_first_page(self):
+        self.window.reload()
+        self.assertEqual(len(self.tree.items), PAGE_SIZE)
+        self.assertWindow(self.expected())
+
+    def test_next_pages_drop_rows_above(self):
+        expected = self.expected()
+        self.window.reload()
+        while True:
+            self.tree.yview_moveto(1.0)
+            top = self.visible()
+            if not self.window.next_page():
+                break
+            self.assertLessEqual(len(self.tree.items), MAX_LOADED_ROWS)
+            self.assertEqual(self.visible(), top)
+            self.assertWindow(expected)
+        self.assertEqual(self.tree.items[-1], expected[-1])
+        self.assertEqual(self.window.offset, ROWS - MAX_LOADED_ROWS)
+        self.assertFalse(self.window.has_rows_below)
+
+    def test_previous_pages_drop_rows_below(self):
+        expected = self.expected()
+        self.window.reload()
+        for _ in range(6):
+            self.window.next_page()
+        self.assertEqual(self.window.offset, 4 * PAGE_SIZE)
+        while True:
+            self.tree.yview_moveto(0.0)
+            top = self.visible()
+            if not self.window.previous_page():
+                break
+            self.assertLessEqual(len(self.tree.items), MAX_LOADED_ROWS)
+            self.assertEqual(self.visible(), top)
+            self.assertWindow(expected)
+        self.assertEqual(self.window.offset, 0)
+        self.assertEqual(self.tree.items[0], expected[0])
+        self.assertFalse(self.window.has_rows_above)
+
+    def test_filtered_paging(self):
+        for filters in ({'ttype': 'Income'}, {'ttype': 'Expense'}, {'text': 'item'},
+                        {'text': 'salary', 'ttype': 'Income'}, {'min_amount': 500.0}):
+            with self.subTest(filters=filters):
+                expected = self.expected(**filters)
+                self.tree.delete(*self.tree.get_children())
+                self.window.filters = filters
+                self.window.reload()
+                self.assertWindow(expected)
+                while self.window.next_page():
+                    self.assertWindow(expected)
+                while self.window.previous_page():
+                    self.assertWindow(expected)
+                self.assertEqual(self.window.offset, 0)
+
+    def test_scrollbar_spans_every_matching_row(self):
+        self.window.reload()
+        # Everything matching fits in the window
+        self.window.filters = {'min_amount': ROWS + 10.0 - 50}
+        self.tree.delete(*self.tree.get_children())
+        self.window.reload()
+        self.assertEqual(self.window.scroll_fractions(*self.tree.yview()), self.tree.yview())
+
+        self.window.filters = {}
+        self.tree.delete(*self.tree.get_children())
+        self.window.reload()
+        for _ in range(4):
+            self.window.next_page()
+        self.tree.yview_moveto(0.5)
+        first, last = self.window.scroll_fractions(*self.tree.yview())
+        position = self.window.offset + self.tree.top
+        self.assertAlmostEqual(first, position / ROWS)
+        self.assertAlmostEqual(last, (position + self.tree.height) / ROWS)
+
+    def test_moveto_jumps_to_unloaded_rows(self):
+        expected = self.expected()
+        self.window.reload()
+        self.assertTrue(self.window.moveto(0.5))
+        self.assertEqual(self.visible(), expected[ROWS // 2])
+        self.assertWindow(expected)
+
+        # Within the loaded rows the view only moves
+        self.assertEqual(self.window.moveto(0.51), [])
+        self.assertEqual(self.visible(), expected[round(0.51 * ROWS)])
+
+        self.assertTrue(self.window.moveto(1.0))
+        self.assertEqual(self.tree.items[-1], expected[-1])
+        self.assertEqual(self.window.next_page(), [])
+        self.assertFalse(self.window.has_rows_below)
+        self.assertEqual(self.window.scroll_fractions(*self.tree.yview())[1], 1.0)
+
+        self.assertTrue(self.window.moveto(0.0))
+        self.assertEqual(self.visible(), expected[0])
+        self.assertWindow(expected)
+
+    def test_changes_keep_counts(self):
+        cursor = self.conn.cursor()
+        self.window.reload()
+        for _ in range(4):
+            self.window.next_page()
+        first = int(self.tree.items[0])
+
+        # A row above the window leaves the result
+        self.window.count_change(first - 10, -1)
+        finance_db.delete_transaction(cursor, first - 10)
+        # A loaded row leaves it, and a new row joins it
+        self.window.count_change(first + 10, -1)
+        finance_db.delete_transaction(cursor, first + 10)
+        self.tree.delete(str(first + 10))
+        _, new_row = finance_db.save_transaction(cursor, None, 'Income', 1.0, '02-01-2024', 'new')
+        self.window.count_change(new_row[0], 1)
+        self.assertWindow(self.expected())
+
+        offset, total = self.window.offset, self.window.total
+        self.window.recount()
+        self.assertEqual((self.window.offset, self.window.total), (offset, total))
+
+    def test_reload_starts_at_first_loaded_row(self):
+        self.window.reload()
+        for _ in range(4):
+            self.window.next_page()
+        first = self.tree.items[0]
+        finance_db.delete_transaction(self.conn.cursor(), int(first))
+        self.window.reload()
+        self.assertEqual(len(self.tree.items), PAGE_SIZE)
+        self.assertEqual(int(self.tree.items[0]), int(first) + 1)
+        self.assertWindow(self.expected())
+
+
+if __name__ == '__main__':
+    unittest.main()